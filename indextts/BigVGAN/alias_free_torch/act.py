@@ -1,7 +1,9 @@
 # Adapted from https://github.com/junjun3518/alias-free-torch under the Apache License 2.0
 #   LICENSE is in incl_licenses directory.
 
+import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 from .resample import DownSample1d, UpSample1d
 
@@ -19,11 +21,45 @@ class Activation1d(nn.Module):
         self.act = activation
         self.upsample = UpSample1d(up_ratio, up_kernel_size)
         self.downsample = DownSample1d(down_ratio, down_kernel_size)
+        # BigVGAN 的设置 (2 倍, 12-tap) 在推理时使用等价的 polyphase 实现
+        self.polyphase = up_ratio == down_ratio == 2 and up_kernel_size == down_kernel_size == 12
 
     # x: [B,C,T]
     def forward(self, x):
+        if self.polyphase and not self.training:
+            return self._forward_polyphase(x)
         x = self.upsample(x)
         x = self.act(x)
         x = self.downsample(x)
 
-        return x
\ No newline at end of file
+        return x
+
+    def _polyphase_filters(self):
+        # upsampling: the even/odd output samples are 7-tap filters over the input padded by 3
+        up = self.upsample.filter.view(-1).flip(0)
+        zero = up.new_zeros(1)
+        up = self.upsample.ratio * torch.stack([torch.cat([up[0::2], zero]), torch.cat([zero, up[1::2]])])
+        # downsampling: odd taps over the even samples, even taps over the odd samples
+        down = self.downsample.lowpass.filter.view(-1)
+        down = torch.stack([down[1::2], down[0::2]])
+        return up.unsqueeze(1), down.unsqueeze(0)  # [2, 1, 7], [1, 2, 6]
+
+    def _forward_polyphase(self, x):
+        """
+        Same output as upsample -> act -> downsample for ratio 2 and 12-tap filters, without the padded
+        transposed convolution and the padded 2x signal: the even and odd samples of the 2x signal are computed
+        as two phases of length T by one grouped conv, activated, and filtered back by one grouped conv.
+        """
+        B, C, T = x.shape
+        up, down = self._polyphase_filters()
+        x = F.pad(x, (3, 3), mode='replicate')
+        x = F.conv1d(x, up.repeat(C, 1, 1), groups=C)  # [B, 2C, T], even/odd phase per channel
+        x = self.act(x.view(B, C, 2 * T)).view(B, C, 2, T)
+        even, odd = x[:, :, 0], x[:, :, 1]
+        # replicate padding of the 2x signal: its first sample is even[0], its last is odd[-1]
+        first, last = even[..., :1], odd[..., -1:]
+        x = torch.stack([
+            torch.cat([first.expand(-1, -1, 2), even, last.expand(-1, -1, 3)], dim=-1),
+            torch.cat([first.expand(-1, -1, 3), odd, last.expand(-1, -1, 2)], dim=-1),
+        ], dim=2).view(B, 2 * C, T + 5)
+        return F.conv1d(x, down.expand(C, -1, -1), groups=C)
@@ -198,8 +198,22 @@ class BigVGAN(torch.nn.Module):
 
         # self.logit_scale = nn.Parameter(torch.ones([]) * np.log(1 / 0.07))
 
-    def forward(self, x, mel_ref, lens=None):
-        speaker_embedding = self.speaker_encoder(mel_ref, lens)
+    def get_speaker_embedding(self, mel_ref, lens=None):
+        """
+        ECAPA-TDNN speaker embedding of the reference mel (b, frames, num_mels) -> (b, 1, speaker_embedding_dim),
+        can be computed once per prompt and passed to `forward(speaker_embedding=...)`.
+        """
+        return self.speaker_encoder(mel_ref, lens)
+
+    def forward(self, x, mel_ref=None, lens=None, speaker_embedding=None):
+        """
+        Args:
+            x: latents (b, frames, gpt_dim)
+            mel_ref: reference mel (b, frames, num_mels), unused when speaker_embedding is given
+            speaker_embedding: (b or 1, 1, speaker_embedding_dim) from `get_speaker_embedding()`
+        """
+        if speaker_embedding is None:
+            speaker_embedding = self.get_speaker_embedding(mel_ref, lens)
         n_batch = x.size(0)
         contrastive_loss = None
         if n_batch * 2 == speaker_embedding.size(0):
@@ -1,3 +1,4 @@
+import itertools
 import sys
 from typing import List, Optional
 
@@ -6,29 +7,91 @@ from torch import nn
 
 from .attention import (
     ForwardContext,
+    flash_attn_available,
     get_forward_context,
     reset_forward_context,
     set_forward_context,
 )
-from .kv_manager import KVCacheManager, Seq
+from .kv_manager import KVCacheManager, Seq, anonymous_prefix_ids
+
+
+# 主机端尚未同步的生成 token 的占位 id, 低于所有 prefix_token_id, 不会与真实的块哈希冲突
+_placeholder_ids = itertools.count()
+
+
+def _placeholder_id() -> int:
+    return -(1 << 62) - next(_placeholder_ids)
 
 
 class Sampler(nn.Module):
+    """
+    Sampling on the device with the logits processing of the HF `generate()` path, in the same order:
+    repetition penalty (RepetitionPenaltyLogitsProcessor), temperature, top-k and top-p
+    (TemperatureLogitsWarper, TopKLogitsWarper, TopPLogitsWarper), then a multinomial draw.
+    Every parameter is a per sequence tensor.
+    """
+
     def __init__(self):
         super().__init__()
 
+    @staticmethod
+    def process_logits(
+        logits: torch.Tensor,
+        temperatures: torch.Tensor,
+        top_k: torch.Tensor,
+        top_p: torch.Tensor,
+        repetition_penalties: torch.Tensor,
+        seen_mask: torch.Tensor,
+    ):
+        """
+        Args:
+            logits: [batch, vocab]
+            temperatures: [batch], <= 0 for greedy decoding (only the repetition penalty applies, as in HF)
+            top_k: [batch] int, 0 disables it
+            top_p: [batch], >= 1 disables it
+            repetition_penalties: [batch], 1 disables it
+            seen_mask: [batch, vocab] bool, the tokens of each sequence so far, input ids included (HF `input_ids`)
+        Returns:
+            processed logits [batch, vocab] float32 with the filtered tokens at -inf, greedy mask [batch]
+        """
+        logits = logits.float()
+        penalties = repetition_penalties.unsqueeze(1)
+        penalized = torch.where(logits < 0, logits * penalties, logits / penalties)
+        logits = torch.where(seen_mask, penalized, logits)
+        greedy = temperatures <= 0
+        logits = logits / torch.where(greedy, 1.0, temperatures).unsqueeze(1)
+
+        vocab_size = logits.size(-1)
+        sorted_logits, sorted_ids = logits.sort(dim=-1, descending=True)
+        k = torch.where(top_k > 0, top_k.clamp(max=vocab_size), vocab_size)
+        kth = sorted_logits.gather(-1, (k - 1).unsqueeze(1))
+        sorted_logits = sorted_logits.masked_fill(sorted_logits < kth, float("-inf"))
+        sorted_probs = sorted_logits.softmax(dim=-1)
+        # HF 按升序累计并去掉累计概率 <= 1 - top_p 的 token, 即降序时排在它前面的概率和 >= top_p
+        remove = (sorted_probs.cumsum(dim=-1) - sorted_probs) >= top_p.unsqueeze(1)
+        remove = remove & (top_p < 1.0).unsqueeze(1)
+        remove[:, 0] = False
+        remove = remove | (sorted_logits == float("-inf"))
+        remove = torch.zeros_like(remove).scatter(-1, sorted_ids, remove)
+        return logits.masked_fill(remove, float("-inf")), greedy
+
     @torch.compile
-    def forward(self, logits: torch.Tensor, temperatures: torch.Tensor):
-        temperatures = temperatures.to(logits.device).clamp(min=1e-8)
-        greedy_mask = temperatures < 1e-5
-        temp_for_scaling = torch.where(greedy_mask, 1.0, temperatures)
-        scaled_logits = logits / temp_for_scaling.unsqueeze(-1)
-        probs = torch.softmax(scaled_logits, dim=-1, dtype=torch.float32)
-        q = torch.empty_like(probs)
-        q.exponential_()
-        sampled_tokens = probs.div_(q).argmax(dim=-1)
-        greedy_tokens = logits.argmax(dim=-1)
-        return torch.where(greedy_mask, greedy_tokens, sampled_tokens)
+    def forward(
+        self,
+        logits: torch.Tensor,
+        temperatures: torch.Tensor,
+        top_k: torch.Tensor,
+        top_p: torch.Tensor,
+        repetition_penalties: torch.Tensor,
+        seen_mask: torch.Tensor,
+    ):
+        logits, greedy = self.process_logits(logits, temperatures, top_k, top_p, repetition_penalties, seen_mask)
+        probs = torch.softmax(logits, dim=-1)
+        # exponential race: argmax(p / E), E ~ Exp(1), is a sample of p
+        sampled_tokens = probs.div_(
+            torch.empty_like(probs).exponential_(1).clamp_min_(1e-10)
+        ).argmax(dim=-1)
+        return torch.where(greedy, logits.argmax(dim=-1), sampled_tokens)
 
 
 class AccelInferenceEngine:
@@ -58,7 +121,11 @@ class AccelInferenceEngine:
         self.lm_head = lm_head
         self.block_size = block_size
         self.num_blocks = num_blocks
-        self.use_cuda_graph = use_cuda_graph and torch.cuda.is_available()
+        self.device = next(model.parameters()).device
+        # CUDA graphs are captured around the flash_attn kernels
+        self.use_cuda_graph = (
+            use_cuda_graph and self.device.type == "cuda" and flash_attn_available()
+        )
         self.hidden_size = (
             model.config.hidden_size
             if hasattr(model, "config")
@@ -70,7 +137,9 @@ class AccelInferenceEngine:
             head_dim=head_dim,
             block_size=block_size,
             num_blocks=num_blocks,
-            dtype=torch.float16,  # Force fp16 for FlashAttention
+            # Force fp16 for FlashAttention, the torch backend keeps the model dtype
+            dtype=torch.float16 if self.device.type == "cuda" else next(model.parameters()).dtype,
+            device=self.device,
         )
         self.kv_manager.wire_kv_cache_to_model(model)
         self.sampler = Sampler()
@@ -80,6 +149,11 @@ class AccelInferenceEngine:
         self.graph_pool = None
         self.graph_captured = False
 
+    def _to_device(self, data, dtype: torch.dtype) -> torch.Tensor:
+        if self.device.type == "cuda":
+            return torch.tensor(data, dtype=dtype, pin_memory=True).to(self.device, non_blocking=True)
+        return torch.tensor(data, dtype=dtype, device=self.device)
+
     def _prepare_prefill(self, requests: List[Seq]):
         input_ids = []
         positions = []
@@ -111,21 +185,11 @@ class AccelInferenceEngine:
                     slot_idx = block_id * self.block_size + block_offset
                     slot_mapping.append(slot_idx)
 
-        input_ids = torch.tensor(input_ids, dtype=torch.int64, pin_memory=True).cuda(
-            non_blocking=True
-        )
-        positions = torch.tensor(positions, dtype=torch.int64, pin_memory=True).cuda(
-            non_blocking=True
-        )
-        cu_seqlens_q = torch.tensor(
-            cu_seqlens_q, dtype=torch.int32, pin_memory=True
-        ).cuda(non_blocking=True)
-        cu_seqlens_k = torch.tensor(
-            cu_seqlens_k, dtype=torch.int32, pin_memory=True
-        ).cuda(non_blocking=True)
-        slot_mapping = torch.tensor(
-            slot_mapping, dtype=torch.int32, pin_memory=True
-        ).cuda(non_blocking=True)
+        input_ids = self._to_device(input_ids, torch.int64)
+        positions = self._to_device(positions, torch.int64)
+        cu_seqlens_q = self._to_device(cu_seqlens_q, torch.int32)
+        cu_seqlens_k = self._to_device(cu_seqlens_k, torch.int32)
+        slot_mapping = self._to_device(slot_mapping, torch.int32)
 
         block_tables = None
         if cu_seqlens_k[-1] > cu_seqlens_q[-1]:
@@ -134,9 +198,7 @@ class AccelInferenceEngine:
             for req in requests:
                 table = req.block_table + [-1] * (max_len - len(req.block_table))
                 block_tables_list.append(table)
-            block_tables = torch.tensor(
-                block_tables_list, dtype=torch.int32, pin_memory=True
-            ).cuda(non_blocking=True)
+            block_tables = self._to_device(block_tables_list, torch.int32)
 
         set_forward_context(
             True,
@@ -151,21 +213,27 @@ class AccelInferenceEngine:
 
         return input_ids, positions
 
-    def _prepare_decode(self, requests: List[Seq]):
+    def _prepare_decode(self, requests: List[Seq], input_ids: Optional[torch.Tensor] = None):
+        """
+        Args:
+            input_ids: [len(requests)] tokens to feed, already on the device. Taken from `req.last_token` when None.
+        """
         if not requests:
             raise RuntimeError("FATAL: No requests provided to _prepare_decode!")
 
-        input_ids = []
+        token_ids = []
         positions = []
         slot_mapping = []
         context_lens = []
 
         for req in requests:
-            input_ids.append(req.last_token)
+            token_ids.append(req.last_token)
 
             pos = len(req) - 1
             if hasattr(self, "_tts_mode") and self._tts_mode:
-                pos = pos - (self._tts_prompt_len - 1)
+                # mel positions as in GPT2InferenceModel: the start_mel_token (last prompt token) is 0,
+                # the k-th generated token is k + 1. Per sequence, so varlen batches match unpadded runs
+                pos = len(req) - req.num_prompt_tokens + 1
             positions.append(pos)
 
             context_lens.append(len(req))
@@ -173,27 +241,18 @@ class AccelInferenceEngine:
                 req.block_table[-1] * self.block_size + req.last_block_num_tokens - 1
             )
 
-        input_ids = torch.tensor(input_ids, dtype=torch.int64, pin_memory=True).cuda(
-            non_blocking=True
-        )
-        positions = torch.tensor(positions, dtype=torch.int64, pin_memory=True).cuda(
-            non_blocking=True
-        )
-        slot_mapping = torch.tensor(
-            slot_mapping, dtype=torch.int32, pin_memory=True
-        ).cuda(non_blocking=True)
-        context_lens = torch.tensor(
-            context_lens, dtype=torch.int32, pin_memory=True
-        ).cuda(non_blocking=True)
+        if input_ids is None:
+            input_ids = self._to_device(token_ids, torch.int64)
+        positions = self._to_device(positions, torch.int64)
+        slot_mapping = self._to_device(slot_mapping, torch.int32)
+        context_lens = self._to_device(context_lens, torch.int32)
 
         max_len = max(len(req.block_table) for req in requests)
         block_tables_list = []
         for req in requests:
             table = req.block_table + [-1] * (max_len - len(req.block_table))
             block_tables_list.append(table)
-        block_tables = torch.tensor(
-            block_tables_list, dtype=torch.int32, pin_memory=True
-        ).cuda(non_blocking=True)
+        block_tables = self._to_device(block_tables_list, torch.int32)
 
         assert block_tables.dim() == 2, (
             f"block_tables must be 2D, got shape {block_tables.shape}"
@@ -211,30 +270,39 @@ class AccelInferenceEngine:
 
         return input_ids, positions
 
-    def _prepare_sample(self, requests: List[Seq], temperature: float):
-        temperatures = [temperature] * len(requests)
-        temperatures = torch.tensor(
-            temperatures, dtype=torch.float32, pin_memory=True
-        ).cuda(non_blocking=True)
-        return temperatures
+    def _prepare_sample(self, batch_size: int, temperature=1.0, top_k=0, top_p=1.0, repetition_penalty=1.0):
+        """
+        Sampling parameters as device tensors, built once per `generate()`.
+        Each argument is a scalar or a list with one value per sequence (None disables top_k/top_p/penalty).
+        """
+        def per_seq(value, default):
+            values = list(value) if isinstance(value, (list, tuple)) else [value] * batch_size
+            return [default if v is None else v for v in values]
+
+        return (
+            self._to_device(per_seq(temperature, 1.0), torch.float32),
+            self._to_device(per_seq(top_k, 0), torch.int64),
+            self._to_device(per_seq(top_p, 1.0), torch.float32),
+            self._to_device(per_seq(repetition_penalty, 1.0), torch.float32),
+        )
 
     def _capture_cuda_graphs(self, tts_mel_embedding=None, tts_text_pos_embedding=None):
         print("Capturing CUDA graphs for decode optimization...")
         max_bs = 8  # Support up to batch size 8
         max_num_blocks = (2048 + self.block_size - 1) // self.block_size
         model_dtype = next(self.model.parameters()).dtype
-        input_ids = torch.ones(max_bs, dtype=torch.int64, device="cuda")
-        positions = torch.ones(max_bs, dtype=torch.int64, device="cuda")
-        slot_mapping = torch.zeros(max_bs, dtype=torch.int32, device="cuda")
-        context_lens = torch.zeros(max_bs, dtype=torch.int32, device="cuda")
+        input_ids = torch.ones(max_bs, dtype=torch.int64, device=self.device)
+        positions = torch.ones(max_bs, dtype=torch.int64, device=self.device)
+        slot_mapping = torch.zeros(max_bs, dtype=torch.int32, device=self.device)
+        context_lens = torch.zeros(max_bs, dtype=torch.int32, device=self.device)
         block_tables = torch.zeros(
-            max_bs, max_num_blocks, dtype=torch.int32, device="cuda"
+            max_bs, max_num_blocks, dtype=torch.int32, device=self.device
         )
         outputs = torch.zeros(
-            max_bs, self.hidden_size, dtype=model_dtype, device="cuda"
+            max_bs, self.hidden_size, dtype=model_dtype, device=self.device
         )
         inputs_embeds_buffer = torch.zeros(
-            max_bs, self.hidden_size, dtype=model_dtype, device="cuda"
+            max_bs, self.hidden_size, dtype=model_dtype, device=self.device
         )
 
         self.graph_bs = [1, 2, 4, 8]
@@ -244,7 +312,7 @@ class AccelInferenceEngine:
         for bs in reversed(self.graph_bs):
             graph = torch.cuda.CUDAGraph()
 
-            slot_mapping[:bs] = torch.arange(bs, dtype=torch.int32, device="cuda")
+            slot_mapping[:bs] = torch.arange(bs, dtype=torch.int32, device=self.device)
             context_lens[:bs] = bs + 1
             block_tables[:bs, :] = 0
 
@@ -375,6 +443,15 @@ class AccelInferenceEngine:
 
         return graph_vars["outputs"][:bs]
 
+    def can_generate(self, seq_lens: List[int], max_new_tokens: int) -> bool:
+        """
+        Whether sequences with these prompt lengths (start_mel_token included) still fit the free KV blocks
+        after generating `max_new_tokens` tokens each. `generate()` has no preemption, so a batch that does
+        not fit would run out of blocks midway.
+        """
+        needed = sum((n + max_new_tokens + self.block_size - 1) // self.block_size for n in seq_lens)
+        return needed <= len(self.kv_manager.free_block_ids)
+
     def generate(
         self,
         input_ids: torch.Tensor,
@@ -382,6 +459,7 @@ class AccelInferenceEngine:
         temperature: float = 1.0,
         top_k: int = 50,
         top_p: float = 1.0,
+        repetition_penalty: float = 1.0,
         stop_tokens: Optional[List[int]] = None,
         attention_mask: Optional[torch.Tensor] = None,
         tts_embeddings: Optional[
@@ -391,23 +469,42 @@ class AccelInferenceEngine:
         tts_text_pos_embedding: Optional[
             torch.nn.Module
         ] = None,  # TTS: text_pos_embedding layer
-    ) -> torch.Tensor:
+        capture_latents: bool = False,
+        tts_prompt_ids: Optional[List[List[int]]] = None,
+        streamer=None,
+        stop_check_interval: int = 8,
+    ):
         """
         Generate tokens.
 
         Args:
             input_ids: Input token IDs [batch_size, seq_len]
             max_new_tokens: Maximum number of tokens to generate
-            temperature: Sampling temperature
-            top_k: Top-k sampling
+            temperature: Sampling temperature, 0 for greedy decoding
+            top_k: Top-k sampling, 0 disables it
             top_p: Nucleus sampling threshold
+            repetition_penalty: HF repetition penalty over the input ids and the generated tokens of each sequence
+                (temperature, top_k, top_p and repetition_penalty may also be lists with one value per sequence)
             stop_tokens: List of token IDs that stop generation
+            capture_latents: Also return the output of lm_head[0] (the final norm) for every fed token
+            tts_prompt_ids: TTS: per sequence ids standing for its unpadded prompt embeddings
+                (see `kv_manager.prefix_token_id`), used as prefix cache keys. Without them the
+                prompt blocks are never shared.
+            streamer: HF-style streamer, `put(input_ids)` once, then `put(tokens [batch_size])` after every
+                sampling step and `end()` when done. With capture_latents the latents of the step are passed
+                to `streamer.put_latent()` first, when the streamer has it.
+            stop_check_interval: sampled tokens stay on the device and are copied to the host (to check the
+                stop tokens) every this many steps. Finished sequences may run up to this many extra steps.
+                1 with a streamer.
 
         Returns:
-            Generated token IDs [batch_size, total_len]
+            Generated token IDs [batch_size, total_len],
+            and latents [batch_size, steps, hidden_size] when capture_latents
         """
         batch_size = input_ids.size(0)
         device = input_ids.device
+        if streamer is not None:
+            streamer.put(input_ids.cpu())
 
         self._tts_mode = tts_embeddings is not None
         self._tts_prompt_len = input_ids.size(1) if self._tts_mode else 0
@@ -447,170 +544,172 @@ class AccelInferenceEngine:
             seq_lens = [actual_seq_len] * batch_size
 
         sequences = []
-        for i in range(batch_size):
-            seq_len = seq_lens[i]
-            token_ids = [1] * seq_len
-            if tts_embeddings is not None and seq_len > 0:
-                token_ids[-1] = input_ids[i, -1].item() if input_ids.size(1) > 0 else 1
-            else:
-                token_ids = input_ids[i].tolist()
-            req = Seq(token_ids)
-            self.kv_manager.allocate(req)
-            sequences.append(req)
+        try:
+            for i in range(batch_size):
+                seq_len = seq_lens[i]
+                if tts_embeddings is not None and seq_len > 0:
+                    start_token = input_ids[i, -1].item() if input_ids.size(1) > 0 else 1
+                    if tts_prompt_ids is not None:
+                        # prefix keys of the [cond][text] prompt, identical prompts share KV blocks
+                        token_ids = list(tts_prompt_ids[i]) + [start_token]
+                        assert len(token_ids) == seq_len, (
+                            f"tts_prompt_ids[{i}] has {len(token_ids) - 1} ids for {seq_len - 1} prompt embeddings"
+                        )
+                    else:
+                        token_ids = anonymous_prefix_ids(seq_len - 1) + [start_token]
+                else:
+                    token_ids = input_ids[i].tolist()
+                req = Seq(token_ids, block_size=self.block_size)
+                self.kv_manager.allocate(req)
+                sequences.append(req)
 
-        self.current_sequences = sequences
+            self.current_sequences = sequences
 
-        prefill_ids, prefill_pos = self._prepare_prefill(sequences)
+            prefill_ids, prefill_pos = self._prepare_prefill(sequences)
 
-        if (
-            tts_embeddings is not None
-            and tts_mel_embedding is not None
-            and tts_text_pos_embedding is not None
-        ):
-            start_token_id = input_ids[0, -1] if input_ids.size(1) > 0 else 8192
+            use_tts_embeddings = (
+                tts_embeddings is not None
+                and tts_mel_embedding is not None
+                and tts_text_pos_embedding is not None
+            )
+            if use_tts_embeddings:
+                start_token_id = input_ids[0, -1] if input_ids.size(1) > 0 else 8192
 
-            start_emb = tts_mel_embedding(
-                torch.tensor([[start_token_id]], device="cuda")
-            )  # [1, 1, hidden_dim]
+                start_emb = tts_mel_embedding(
+                    torch.tensor([start_token_id], device=self.device)
+                )  # [1, hidden_dim]
 
-            start_pos = torch.tensor(
-                [[tts_embeddings.size(1)]], device="cuda", dtype=torch.long
-            )
-            pos_emb = tts_text_pos_embedding.emb(start_pos)
-            start_emb = start_emb + pos_emb
-            start_emb = start_emb.repeat(batch_size, 1, 1)
+                # the start_mel_token is mel position 0, as in GPT2InferenceModel
+                start_pos = torch.zeros(1, device=self.device, dtype=torch.long)
+                start_emb = start_emb + tts_text_pos_embedding.emb(start_pos)
 
-            if is_varlen_batch:
                 valid_embeddings = []
-                for i in range(batch_size):
+                for i, req in enumerate(sequences):
                     emb_len = seq_lens[i] - 1
                     padding_len = tts_embeddings.size(1) - emb_len
-                    valid_emb = tts_embeddings[i, padding_len:].unsqueeze(
-                        0
-                    )  # [1, emb_len, hidden_dim]
-                    valid_embeddings.append(
-                        torch.cat([valid_emb, start_emb[i : i + 1]], dim=1)
-                    )
+                    seq_emb = torch.cat([tts_embeddings[i, padding_len:], start_emb], dim=0)  # [seq_len, hidden_dim]
+                    # blocks served from the prefix cache are not recomputed
+                    valid_embeddings.append(seq_emb[req.num_cached_tokens:])
                 full_embeddings = torch.cat(
-                    valid_embeddings, dim=1
-                )  # [1, total_tokens, hidden_dim]
-            else:
-                full_embeddings = torch.cat(
-                    [tts_embeddings, start_emb], dim=1
-                )  # [batch_size, seq_len, hidden_dim]
-
-            model_dtype = next(self.model.parameters()).dtype
-            if full_embeddings.dtype != model_dtype:
-                full_embeddings = full_embeddings.to(model_dtype)
+                    valid_embeddings, dim=0
+                ).unsqueeze(0)  # [1, total_tokens, hidden_dim]
 
-            hidden_states = self.model(
-                inputs_embeds=full_embeddings, return_dict=True
-            ).last_hidden_state
-
-        else:
-            hidden_states = self.model(
-                input_ids=input_ids, attention_mask=attention_mask, return_dict=True
-            ).last_hidden_state
+                model_dtype = next(self.model.parameters()).dtype
+                if full_embeddings.dtype != model_dtype:
+                    full_embeddings = full_embeddings.to(model_dtype)
 
-        if is_varlen_batch:
-            context = get_forward_context()
-            cu_seqlens = context.cu_seqlens_q.cpu().tolist()
-            last_hidden = torch.stack(
-                [hidden_states[0, cu_seqlens[i + 1] - 1] for i in range(batch_size)]
-            )
-        else:
-            last_hidden = hidden_states[:, -1, :]  # [batch_size, hidden_size]
-
-        reset_forward_context()
-
-        if self.lm_head is not None:
-            if last_hidden.dtype != next(self.lm_head.parameters()).dtype:
-                last_hidden = last_hidden.to(next(self.lm_head.parameters()).dtype)
-            logits = self.lm_head(last_hidden)  # [batch_size, vocab_size]
-        else:
-            logits = self.model.compute_logits(last_hidden)  # [batch_size, vocab_size]
-
-        temperatures = self._prepare_sample(sequences, temperature)
-        if temperature > 0:
-            first_token = self.sampler(logits, temperatures)
-        else:
-            first_token = torch.argmax(logits, dim=-1)
-
-        first_token_list = first_token.tolist()
-
-        generated_tokens = [[] for _ in range(batch_size)]
-        is_finished = [False] * batch_size
+                hidden_states = self.model(
+                    inputs_embeds=full_embeddings, return_dict=True
+                ).last_hidden_state
 
-        for i, token_id in enumerate(first_token_list):
-            if stop_tokens and token_id in stop_tokens:
-                is_finished[i] = True
             else:
-                generated_tokens[i].append(token_id)
-                sequences[i].append_token(token_id)
-                self.kv_manager.append_to_seq(sequences[i])
-
-        if all(is_finished):
-            for req in sequences:
-                self.kv_manager.remove_seq(req)
-            self.current_sequences = []
-
-            output_ids = []
-            for i in range(batch_size):
-                full_sequence = input_ids[i].tolist() + generated_tokens[i]
-                output_ids.append(full_sequence)
-
-            output = torch.tensor(output_ids, dtype=torch.long, device=device)
-            return output
-
-        remaining_tokens = max_new_tokens - 1
-
-        for step in range(remaining_tokens):
-            decode_ids, decode_pos = self._prepare_decode(sequences)
-
-            context = get_forward_context()
-            hidden_states = self._run_decode_with_graph(
-                decode_ids,
-                decode_pos,
-                context,
-                tts_mel_embedding=tts_mel_embedding,
-                tts_text_pos_embedding=tts_text_pos_embedding,
-            )
+                hidden_states = self.model(
+                    input_ids=input_ids, attention_mask=attention_mask, return_dict=True
+                ).last_hidden_state
 
-            # Get logits
-            if self.lm_head is not None:
-                logits = self.lm_head(hidden_states)  # [batch_size, vocab_size]
+            if use_tts_embeddings:
+                context = get_forward_context()
+                cu_seqlens = context.cu_seqlens_q.cpu().tolist()
+                last_hidden = torch.stack(
+                    [hidden_states[0, cu_seqlens[i + 1] - 1] for i in range(batch_size)]
+                )
             else:
-                logits = self.model.compute_logits(
-                    hidden_states
-                )  # [batch_size, vocab_size]
+                last_hidden = hidden_states[:, -1, :]  # [batch_size, hidden_size]
 
             reset_forward_context()
 
-            temperatures = self._prepare_sample(sequences, temperature)
-            if temperature > 0:
-                next_token = self.sampler(logits, temperatures)
-            else:
-                next_token = torch.argmax(logits, dim=-1)
-            next_token_list = next_token.tolist()
-
-            for i, token_id in enumerate(next_token_list):
-                if is_finished[i]:
-                    continue
-                elif stop_tokens and token_id in stop_tokens:
-                    is_finished[i] = True
-                else:
-                    sequences[i].append_token(token_id)
+            lm_dtype = next(self.lm_head.parameters()).dtype if self.lm_head is not None else None
+            if lm_dtype is not None and last_hidden.dtype != lm_dtype:
+                last_hidden = last_hidden.to(lm_dtype)
+            step_latents = [] if capture_latents else None
+            logits = self._logits(last_hidden, step_latents)  # [batch_size, vocab_size]
+
+            pad_token = stop_tokens[0] if stop_tokens else 0
+            sample_params = self._prepare_sample(batch_size, temperature, top_k, top_p, repetition_penalty)
+            # HF 的 repetition penalty 同样作用于输入 ids
+            seen_mask = torch.zeros(batch_size, logits.size(-1), dtype=torch.bool, device=self.device)
+            seen_mask.scatter_(1, input_ids.to(self.device), True)
+            latent_buffer = None
+            sync_interval = 1 if streamer is not None else max(1, stop_check_interval)
+
+            rows = list(range(batch_size))  # sequences still generating, as far as the host knows
+            rows_index = torch.arange(batch_size, device=self.device)
+            generated_tokens = [[] for _ in range(batch_size)]
+            num_steps = [None] * batch_size  # steps until the stop token, per sequence
+            window = []  # sampled tokens since the last host sync, on the device
+            step = 0
+            while True:
+                next_token = self.sampler(logits, *sample_params, seen_mask)
+                seen_mask.scatter_(1, next_token.unsqueeze(1), True)
+                if streamer is not None:
+                    self._stream_step(streamer, next_token, step_latents, rows_index, batch_size, pad_token)
+                if capture_latents:
+                    if latent_buffer is None:
+                        latent_buffer = step_latents[0].new_zeros(batch_size, max_new_tokens, step_latents[0].size(-1))
+                    latent_buffer[rows_index, step] = step_latents.pop()
+                window.append(next_token)
+                step += 1
+                # 主机端先用占位 id 推进序列长度, 真实 token 在同步时补上
+                for i in rows:
+                    sequences[i].append_token(_placeholder_id())
                     self.kv_manager.append_to_seq(sequences[i])
-                    generated_tokens[i].append(token_id)
-
-            if all(is_finished):
-                break
 
-        for req in sequences:
-            self.kv_manager.remove_seq(req)
-        self.current_sequences = []
+                if len(window) >= sync_interval or step >= max_new_tokens:
+                    window_tokens = torch.stack(window, dim=1).tolist()  # the only host sync
+                    window_start = step - len(window)
+                    window = []
+                    keep = []
+                    for j, i in enumerate(rows):
+                        tokens = window_tokens[j]
+                        stop_at = next((k for k, t in enumerate(tokens) if stop_tokens and t in stop_tokens), None)
+                        if stop_at is not None:
+                            generated_tokens[i].extend(tokens[:stop_at])
+                            num_steps[i] = window_start + stop_at + 1
+                            continue
+                        generated_tokens[i].extend(tokens)
+                        seq = sequences[i]
+                        seq.token_ids[len(seq) - len(tokens):] = tokens
+                        seq.last_token = tokens[-1]
+                        keep.append(j)
+                    if len(keep) < len(rows):
+                        rows = [rows[j] for j in keep]
+                        if rows:
+                            keep_index = torch.tensor(keep, device=self.device)
+                            next_token = next_token[keep_index]
+                            rows_index = rows_index[keep_index]
+                            seen_mask = seen_mask[keep_index]
+                            sample_params = tuple(p[keep_index] for p in sample_params)
+                if not rows or step >= max_new_tokens:
+                    break
+
+                rows_seqs = [sequences[i] for i in rows]
+                decode_ids, decode_pos = self._prepare_decode(rows_seqs, input_ids=next_token)
+
+                context = get_forward_context()
+                hidden_states = self._run_decode_with_graph(
+                    decode_ids,
+                    decode_pos,
+                    context,
+                    tts_mel_embedding=tts_mel_embedding,
+                    tts_text_pos_embedding=tts_text_pos_embedding,
+                )
+                reset_forward_context()
+                if lm_dtype is not None and hidden_states.dtype != lm_dtype:
+                    hidden_states = hidden_states.to(lm_dtype)
+                logits = self._logits(hidden_states, step_latents)  # [len(rows), vocab_size]
+        finally:
+            # 异常退出时 (如 streamer 取消生成) 也要释放 KV blocks
+            reset_forward_context()
+            for req in sequences:
+                self.kv_manager.remove_seq(req)
+            self.current_sequences = []
+        if streamer is not None:
+            streamer.end()
 
-        pad_token = stop_tokens[0] if stop_tokens else 0
+        if capture_latents:
+            # 与逐步检查时相同: 保留到最后一个序列结束的那一步
+            total_steps = max(step if n is None else n for n in num_steps)
+            latents = latent_buffer[:, :total_steps]
 
         if is_varlen_batch:
             max_prompt_len = attention_mask.size(1)
@@ -642,18 +741,33 @@ class AccelInferenceEngine:
             f"Output batch size mismatch: {output.size(0)} != {batch_size}"
         )
 
+        if capture_latents:
+            return output, latents
         return output
 
+    @staticmethod
+    def _stream_step(streamer, tokens: torch.Tensor, latents: Optional[list],
+                     rows_index: torch.Tensor, batch_size: int, pad_token: int):
+        # finished sequences are no longer decoded, the streamer still gets [batch_size] rows
+        if tokens.size(0) < batch_size:
+            tokens = tokens.new_full((batch_size,), pad_token).index_copy_(0, rows_index, tokens)
+        if latents and hasattr(streamer, "put_latent"):
+            latent = latents[-1]
+            if latent.size(0) < batch_size:
+                latent = latent.new_zeros(batch_size, latent.size(-1)).index_copy_(0, rows_index, latent)
+            streamer.put_latent(latent)
+        streamer.put(tokens.cpu())
+
+    def _logits(self, hidden_states: torch.Tensor, latents: Optional[list] = None):
+        if self.lm_head is not None:
+            return self._compute_logits(hidden_states, latents)
+        return self.model.compute_logits(hidden_states)
 
-class Sampler(nn.Module):
-    def __init__(self):
-        super().__init__()
+    def _compute_logits(self, hidden_states: torch.Tensor, latents: Optional[list] = None):
+        if latents is None:
+            return self.lm_head(hidden_states)
+        # lm_head is nn.Sequential(final_norm, mel_head), keep the normed states as latents
+        normed = self.lm_head[0](hidden_states)
+        latents.append(normed)
+        return self.lm_head[1](normed)
 
-    @torch.compile
-    def forward(self, logits: torch.Tensor, temperatures: torch.Tensor):
-        logits = logits.float().div_(temperatures.unsqueeze(dim=1))
-        probs = torch.softmax(logits, dim=-1)
-        sample_tokens = probs.div_(
-            torch.empty_like(probs).exponential_(1).clamp_min_(1e-10)
-        ).argmax(dim=-1)
-        return sample_tokens
\ No newline at end of file
@@ -1,11 +1,20 @@
 from dataclasses import dataclass
 
 import torch
-import triton
-import triton.language as tl
-from flash_attn import flash_attn_varlen_func, flash_attn_with_kvcache
+import torch.nn.functional as F
 from torch import nn
 
+try:
+    import triton
+    import triton.language as tl
+except ImportError:
+    triton = None
+
+try:
+    from flash_attn import flash_attn_varlen_func, flash_attn_with_kvcache
+except ImportError:
+    flash_attn_varlen_func = flash_attn_with_kvcache = None
+
 
 @dataclass
 class ForwardContext:
@@ -54,36 +63,38 @@ def reset_forward_context():
     _FORWARD_CONTEXT = ForwardContext()
 
 
-@triton.jit
-def store_kvcache_kernel(
-    key_ptr,
-    key_stride,
-    value_ptr,
-    value_stride,
-    k_cache_ptr,
-    v_cache_ptr,
-    slot_mapping_ptr,
-    D: tl.constexpr,
-):
-    BLOCK_SIZE: tl.constexpr = 2048
-    idx = tl.program_id(0)
-    slot = tl.load(slot_mapping_ptr + idx)
-    if slot == -1:
-        return
-    d_offset = 0
-    while d_offset < D:
-        cur_block_size = min(BLOCK_SIZE, D - d_offset)
-        key_offsets = idx * key_stride + d_offset + tl.arange(0, BLOCK_SIZE)
-        value_offsets = idx * value_stride + d_offset + tl.arange(0, BLOCK_SIZE)
-        cache_offsets = slot * D + d_offset + tl.arange(0, BLOCK_SIZE)
-
-        mask = tl.arange(0, BLOCK_SIZE) < cur_block_size
-        key = tl.load(key_ptr + key_offsets, mask=mask, other=0.0)
-        value = tl.load(value_ptr + value_offsets, mask=mask, other=0.0)
-        tl.store(k_cache_ptr + cache_offsets, key, mask=mask)
-        tl.store(v_cache_ptr + cache_offsets, value, mask=mask)
-
-        d_offset += BLOCK_SIZE
+if triton is not None:
+
+    @triton.jit
+    def store_kvcache_kernel(
+        key_ptr,
+        key_stride,
+        value_ptr,
+        value_stride,
+        k_cache_ptr,
+        v_cache_ptr,
+        slot_mapping_ptr,
+        D: tl.constexpr,
+    ):
+        BLOCK_SIZE: tl.constexpr = 2048
+        idx = tl.program_id(0)
+        slot = tl.load(slot_mapping_ptr + idx)
+        if slot == -1:
+            return
+        d_offset = 0
+        while d_offset < D:
+            cur_block_size = min(BLOCK_SIZE, D - d_offset)
+            key_offsets = idx * key_stride + d_offset + tl.arange(0, BLOCK_SIZE)
+            value_offsets = idx * value_stride + d_offset + tl.arange(0, BLOCK_SIZE)
+            cache_offsets = slot * D + d_offset + tl.arange(0, BLOCK_SIZE)
+
+            mask = tl.arange(0, BLOCK_SIZE) < cur_block_size
+            key = tl.load(key_ptr + key_offsets, mask=mask, other=0.0)
+            value = tl.load(value_ptr + value_offsets, mask=mask, other=0.0)
+            tl.store(k_cache_ptr + cache_offsets, key, mask=mask)
+            tl.store(v_cache_ptr + cache_offsets, value, mask=mask)
+
+            d_offset += BLOCK_SIZE
 
 
 def store_kvcache(
@@ -104,6 +115,97 @@ def store_kvcache(
     )
 
 
+def flash_attn_available() -> bool:
+    return flash_attn_varlen_func is not None and triton is not None
+
+
+def store_kvcache_torch(
+    key: torch.Tensor,
+    value: torch.Tensor,
+    k_cache: torch.Tensor,
+    v_cache: torch.Tensor,
+    slot_mapping: torch.Tensor,
+):
+    """
+    Same as `store_kvcache`: write token i of key/value to slot `slot_mapping[i]` of the
+    [num_blocks, block_size, H, D] caches, slots of -1 are skipped.
+    """
+    num_heads, head_dim = key.shape[1:]
+    k_flat = k_cache.view(-1, num_heads, head_dim)
+    v_flat = v_cache.view(-1, num_heads, head_dim)
+    valid = slot_mapping >= 0
+    slots = slot_mapping[valid].long()
+    k_flat.index_copy_(0, slots, key[valid].to(k_flat.dtype))
+    v_flat.index_copy_(0, slots, value[valid].to(v_flat.dtype))
+
+
+def _gather_kvcache(cache: torch.Tensor, block_table: torch.Tensor, num_tokens):
+    """
+    Gather the first `num_tokens` positions of a sequence from the paged cache -> [num_tokens, H, D]
+    """
+    block_size = cache.size(1)
+    pos = torch.arange(num_tokens, device=cache.device)
+    block_ids = block_table.long()[pos // block_size].clamp(min=0)
+    return cache[block_ids, pos % block_size]
+
+
+def prefill_attention_torch(q, k, v, k_cache, v_cache, context: ForwardContext, scale: float):
+    """
+    `flash_attn_varlen_func` with causal masking, reading keys/values from the paged cache when
+    `context.block_tables` is set (prefix cache hits: queries are only the uncached suffix).
+    """
+    cu_seqlens_q = context.cu_seqlens_q.tolist()
+    cu_seqlens_k = context.cu_seqlens_k.tolist()
+    outputs = []
+    for i in range(len(cu_seqlens_q) - 1):
+        q_i = q[cu_seqlens_q[i]:cu_seqlens_q[i + 1]]
+        seqlen_q = q_i.size(0)
+        seqlen_k = cu_seqlens_k[i + 1] - cu_seqlens_k[i]
+        if context.block_tables is not None:
+            k_i = _gather_kvcache(k_cache, context.block_tables[i], seqlen_k)
+            v_i = _gather_kvcache(v_cache, context.block_tables[i], seqlen_k)
+        else:
+            k_i = k[cu_seqlens_k[i]:cu_seqlens_k[i + 1]]
+            v_i = v[cu_seqlens_k[i]:cu_seqlens_k[i + 1]]
+        # queries are the last seqlen_q positions of the sequence
+        q_pos = torch.arange(seqlen_q, device=q.device) + (seqlen_k - seqlen_q)
+        mask = torch.arange(seqlen_k, device=q.device)[None, :] <= q_pos[:, None]
+        o = F.scaled_dot_product_attention(
+            q_i.transpose(0, 1).unsqueeze(0),
+            k_i.transpose(0, 1).unsqueeze(0).to(q_i.dtype),
+            v_i.transpose(0, 1).unsqueeze(0).to(q_i.dtype),
+            attn_mask=mask,
+            scale=scale,
+        )
+        outputs.append(o.squeeze(0).transpose(0, 1))
+    return torch.cat(outputs, dim=0)
+
+
+def decode_attention_torch(q, k_cache, v_cache, context: ForwardContext, scale: float):
+    """
+    `flash_attn_with_kvcache` for one query token per sequence. Shapes only depend on the block
+    table width, so this is also safe to capture in a CUDA graph.
+    """
+    block_tables = context.block_tables.long()
+    batch_size, max_blocks = block_tables.shape
+    block_size = k_cache.size(1)
+    max_len = max_blocks * block_size
+    pos = torch.arange(max_len, device=q.device)
+    block_ids = block_tables[:, pos // block_size].clamp(min=0)  # [B, max_len]
+    offsets = (pos % block_size).expand(batch_size, -1)
+    k = k_cache[block_ids, offsets].to(q.dtype)  # [B, max_len, H, D]
+    v = v_cache[block_ids, offsets].to(q.dtype)
+    mask = pos[None, :] < context.context_lens[:, None]  # [B, max_len]
+    o = F.scaled_dot_product_attention(
+        q.unsqueeze(2),  # [B, H, 1, D]
+        k.transpose(1, 2),
+        v.transpose(1, 2),
+        attn_mask=mask[:, None, None, :],
+        scale=scale,
+    )
+    return o.squeeze(2)  # [B, H, D]
+
+
 class Attention(nn.Module):
     def __init__(
         self,
@@ -123,6 +225,9 @@ class Attention(nn.Module):
         context = get_forward_context()
         k_cache, v_cache = self.k_cache, self.v_cache
 
+        if q.device.type != "cuda" or not flash_attn_available():
+            return self._forward_torch(q, k, v, context)
+
         if k_cache.numel() and v_cache.numel() and context.slot_mapping is not None:
             store_kvcache(k, v, k_cache, v_cache, context.slot_mapping)
 
@@ -152,3 +257,11 @@ class Attention(nn.Module):
                 causal=True,
             )
         return o
+
+    def _forward_torch(self, q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, context: ForwardContext):
+        k_cache, v_cache = self.k_cache, self.v_cache
+        if k_cache.numel() and v_cache.numel() and context.slot_mapping is not None:
+            store_kvcache_torch(k, v, k_cache, v_cache, context.slot_mapping)
+        if context.is_prefill:
+            return prefill_attention_torch(q, k, v, k_cache, v_cache, context, self.scale)
+        return decode_attention_torch(q, k_cache, v_cache, context, self.scale)
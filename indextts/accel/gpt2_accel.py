@@ -11,16 +11,7 @@ class GPT2AccelAttention(nn.Module):
         super().__init__()
         self.config = config
         self.layer_idx = layer_idx
-
-        max_positions = config.max_position_embeddings
-        self.register_buffer(
-            "bias",
-            torch.tril(
-                torch.ones((max_positions, max_positions), dtype=torch.bool)
-            ).view(1, 1, max_positions, max_positions),
-            persistent=False,
-        )
-        self.register_buffer("masked_bias", torch.tensor(-1e4), persistent=False)
+        # no causal mask buffers: masking is done by the paged attention (max_positions^2 per layer otherwise)
 
         self.embed_dim = config.hidden_size
         self.num_heads = config.num_attention_heads
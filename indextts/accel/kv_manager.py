@@ -1,5 +1,6 @@
 import hashlib
 import pickle
+import uuid
 from collections import deque
 from copy import copy
 from typing import Dict, List, Optional, Set
@@ -7,6 +8,24 @@ from typing import Dict, List, Optional, Set
 import torch
 
 
+def prefix_token_id(key: str, position: int) -> int:
+    """
+    Stand-in token id for position `position` of a prompt prefix that is given as embeddings
+    (e.g. the conditioning latents), derived from the identity `key` of those embeddings.
+    Always negative, so it never collides with real token ids in block hashes.
+    """
+    digest = hashlib.sha1(f"{key}:{position}".encode()).digest()
+    return -(int.from_bytes(digest[:7], "little") + 1)
+
+
+def anonymous_prefix_ids(length: int) -> List[int]:
+    """
+    Prefix ids of a prompt without a known identity, unique so its blocks are never shared.
+    """
+    key = uuid.uuid4().hex
+    return [prefix_token_id(key, i) for i in range(length)]
+
+
 class KVCacheBlock:
     def __init__(self, block_id: int):
         self.block_id = block_id
@@ -77,6 +96,7 @@ class KVCacheManager:
         block_size: int,
         num_blocks: int,
         dtype: torch.dtype,
+        device=None,
     ):
         self.num_layers = num_layers
         self.num_heads = num_heads
@@ -90,8 +110,10 @@ class KVCacheManager:
         self.free_block_ids: deque = deque(range(num_blocks))
         self.used_block_ids: Set[int] = set()
 
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        cache_dtype = torch.float16 if device == "cuda" else dtype
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        device = torch.device(device)
+        cache_dtype = torch.float16 if device.type == "cuda" else dtype
         self.kv_cache = torch.empty(
             2,
             num_layers,
@@ -117,6 +139,9 @@ class KVCacheManager:
     def _allocate_block(self, block_id: int) -> KVCacheBlock:
         block = self.blocks[block_id]
         assert block.ref_cnt == 0
+        if block.block_hash is not None and self.block_hash_to_id.get(block.block_hash) == block_id:
+            # the KV content is overwritten, the old hash must not hit this block any more
+            del self.block_hash_to_id[block.block_hash]
         block.reset()
         self.free_block_ids.remove(block_id)
         self.used_block_ids.add(block_id)
@@ -142,7 +167,11 @@ class KVCacheManager:
             )
             block_id = self.block_hash_to_id.get(block_hash) if block_hash else None
 
-            if block_id is None or self.blocks[block_id].token_ids != token_ids:
+            if (block_id is None or self.blocks[block_id].block_hash != block_hash
+                    or self.blocks[block_id].token_ids != token_ids):
+                cache_miss = True
+            if i == sequence.num_blocks - 1:
+                # never serve the whole prompt from the cache, the last token must be computed for its logits
                 cache_miss = True
 
             if cache_miss:
@@ -154,7 +183,7 @@ class KVCacheManager:
                     block = self.blocks[block_id]
                     block.ref_cnt += 1
                 else:
-                    block_id = self.free_block_ids[0]
+                    # freed but not yet reused, its KV content is still valid
                     block = self._allocate_block(block_id)
 
             if block_hash is not None:
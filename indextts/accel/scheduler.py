@@ -0,0 +1,354 @@
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Deque, List, Optional
+
+import torch
+
+from .attention import get_forward_context, reset_forward_context
+from .kv_manager import Seq, anonymous_prefix_ids
+
+
+@dataclass
+class TTSRequest:
+    request_id: int
+    prompt_embeds: torch.Tensor  # [prompt_len, hidden] [cond][text] embeddings, NO start_mel_token
+    max_new_tokens: int
+    temperature: float
+    top_k: int
+    top_p: float
+    repetition_penalty: float
+    capture_latents: bool
+    future: Future
+    prompt_ids: List[int]  # prefix cache keys of prompt_embeds
+    seen_ids: Optional[torch.Tensor] = None  # ids the repetition penalty applies to besides the generated ones
+    seen: Optional[torch.Tensor] = None  # [vocab] bool, built from seen_ids on the first sampling step
+    generated: List[int] = field(default_factory=list)
+    latents: List[torch.Tensor] = field(default_factory=list)
+    seq: Optional[Seq] = None
+    num_preemptions: int = 0
+
+    @property
+    def prompt_len(self) -> int:
+        # prompt embeddings + start_mel_token
+        return self.prompt_embeds.size(0) + 1
+
+
+class AccelScheduler:
+    """
+    Iteration-level (continuous batching) scheduler on top of `AccelInferenceEngine`.
+
+    Requests wait in a FIFO queue and are admitted into the running batch as soon as a batch slot
+    and enough free KV cache blocks are available, so new requests join between decode steps
+    instead of waiting for the whole batch to finish. When the running sequences need more KV
+    blocks than are free, the most recently admitted ones are preempted: their blocks are freed and
+    they go back to the front of the queue, to be recomputed (prompt + generated tokens) on re-admission.
+
+    The scheduler owns the engine's KV cache while it is running, `AccelInferenceEngine.generate()`
+    must not be called concurrently.
+    """
+
+    def __init__(
+        self,
+        engine,
+        tts_mel_embedding: torch.nn.Module,
+        tts_text_pos_embedding: torch.nn.Module,
+        start_token: int,
+        stop_tokens: List[int],
+        max_batch_size: int = 8,
+        watermark_blocks: int = 1,
+    ):
+        """
+        Args:
+            engine: AccelInferenceEngine
+            tts_mel_embedding: mel_embedding layer
+            tts_text_pos_embedding: mel position embedding layer
+            start_token: start_mel_token
+            stop_tokens: token IDs that finish a request
+            max_batch_size: max number of sequences decoded together
+            watermark_blocks: free KV blocks kept in reserve when admitting, to delay preemption
+        """
+        self.engine = engine
+        self.kv_manager = engine.kv_manager
+        self.block_size = engine.block_size
+        self.tts_mel_embedding = tts_mel_embedding
+        self.tts_text_pos_embedding = tts_text_pos_embedding
+        self.start_token = start_token
+        self.stop_tokens = set(stop_tokens)
+        self.max_batch_size = max_batch_size
+        self.watermark_blocks = watermark_blocks
+
+        self.waiting: Deque[TTSRequest] = deque()
+        self.running: List[TTSRequest] = []
+        self._ids = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(
+        self,
+        prompt_embeds: torch.Tensor,
+        max_new_tokens: int,
+        temperature: float = 1.0,
+        capture_latents: bool = False,
+        prompt_ids: Optional[List[int]] = None,
+        top_k: int = 50,
+        top_p: float = 1.0,
+        repetition_penalty: float = 1.0,
+        seen_ids: Optional[torch.Tensor] = None,
+    ) -> Future:
+        """
+        Queue a request.
+
+        Args:
+            prompt_embeds: [prompt_len, hidden] or [1, prompt_len, hidden] unpadded [cond][text] embeddings
+            temperature, top_k, top_p, repetition_penalty: as in `AccelInferenceEngine.generate()`
+            prompt_ids: ids standing for prompt_embeds (see `kv_manager.prefix_token_id`), requests with
+                the same leading ids share their cached KV blocks. Unique ids are used when None.
+            seen_ids: the input ids of the HF path (e.g. the fake ids of `prepare_gpt_inputs()`), penalized by
+                the repetition penalty together with the generated tokens
+        Returns:
+            Future resolving to codes [1, n] (without the stop token),
+            or (codes, latents [1, steps, hidden]) when capture_latents
+        """
+        if prompt_embeds.dim() == 3:
+            assert prompt_embeds.size(0) == 1, "submit one sequence per request"
+            prompt_embeds = prompt_embeds[0]
+        max_len = (prompt_embeds.size(0) + 1 + max_new_tokens)
+        if (max_len + self.block_size - 1) // self.block_size > self.kv_manager.num_blocks:
+            raise ValueError(
+                f"request needs up to {max_len} tokens, more than the KV cache capacity "
+                f"({self.kv_manager.num_blocks * self.block_size} tokens)"
+            )
+        if prompt_ids is None:
+            prompt_ids = anonymous_prefix_ids(prompt_embeds.size(0))
+        assert len(prompt_ids) == prompt_embeds.size(0), "one prompt id per prompt embedding"
+        future = Future()
+        req = TTSRequest(
+            request_id=next(self._ids),
+            prompt_embeds=prompt_embeds.detach(),
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            top_k=top_k or 0,
+            top_p=top_p,
+            repetition_penalty=repetition_penalty,
+            capture_latents=capture_latents,
+            future=future,
+            prompt_ids=list(prompt_ids),
+            seen_ids=seen_ids.detach().reshape(-1) if seen_ids is not None else None,
+        )
+        with self._cond:
+            self.waiting.append(req)
+            self._cond.notify()
+        return future
+
+    def start(self):
+        if self.is_running:
+            return self
+        self._stopping = False
+        self._thread = threading.Thread(target=self._loop, name="accel-scheduler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._stopping and not self.waiting and not self.running:
+                    self._cond.wait()
+                if self._stopping:
+                    break
+            try:
+                self.step()
+            except Exception as e:
+                self._fail_all(e)
+        self._fail_all(RuntimeError("scheduler stopped"))
+
+    def _fail_all(self, exc: Exception):
+        with self._cond:
+            requests = self.running + list(self.waiting)
+            self.running = []
+            self.waiting.clear()
+        for req in requests:
+            if req.seq is not None and req.seq.block_table:
+                self.kv_manager.remove_seq(req.seq)
+            req.seq = None
+            if not req.future.done():
+                req.future.set_exception(exc)
+        reset_forward_context()
+
+    @torch.inference_mode()
+    def step(self):
+        """
+        Run one scheduling iteration: a prefill of newly admitted requests if any, else one decode step.
+        """
+        self._ensure_cuda_graphs()
+        self.engine._tts_mode = True
+        admitted = self._admit()
+        if admitted:
+            self._prefill(admitted)
+        elif self.running:
+            self._reserve_decode_blocks()
+            if self.running:
+                self._decode()
+
+    def _ensure_cuda_graphs(self):
+        engine = self.engine
+        if engine.use_cuda_graph and not engine.graph_captured:
+            engine._capture_cuda_graphs(
+                tts_mel_embedding=self.tts_mel_embedding,
+                tts_text_pos_embedding=self.tts_text_pos_embedding,
+            )
+            engine.graph_captured = True
+
+    def _blocks_needed(self, num_tokens: int) -> int:
+        return (num_tokens + self.block_size - 1) // self.block_size
+
+    def _admit(self) -> List[TTSRequest]:
+        admitted = []
+        # free blocks promised to the admitted requests: the token sampled right after their prefill
+        # is appended before any preemption can happen, so its block must be there
+        owed = 0
+        with self._cond:
+            while self.waiting and len(self.running) + len(admitted) < self.max_batch_size:
+                req = self.waiting[0]
+                # [prompt][start_mel_token][generated] (prompt_len counts the start_mel_token)
+                # + the first token sampled after the prefill
+                needed = self._blocks_needed(req.prompt_len + len(req.generated) + 1)
+                free = len(self.kv_manager.free_block_ids) - owed
+                # no reserve when nothing else runs: `submit()` checks prompt_len + max_new_tokens against
+                # the whole cache, and an unfinished request has generated fewer than max_new_tokens,
+                # so it always fits an idle cache
+                reserve = self.watermark_blocks if self.running or admitted else 0
+                if needed + reserve > free:
+                    break
+                self.waiting.popleft()
+                token_ids = list(req.prompt_ids) + [self.start_token] + req.generated
+                seq = Seq(token_ids, block_size=self.block_size)
+                seq.num_prompt_tokens = req.prompt_len
+                self.kv_manager.allocate(seq)
+                owed += needed - seq.num_blocks
+                req.seq = seq
+                admitted.append(req)
+        return admitted
+
+    def _reserve_decode_blocks(self):
+        # a sequence whose last block is full needs a new block for the token sampled in this step
+        while True:
+            needed = sum(1 for req in self.running if len(req.seq) % self.block_size == 0)
+            if needed <= len(self.kv_manager.free_block_ids) or not self.running:
+                return
+            self._preempt(self.running[-1])
+
+    def _preempt(self, req: TTSRequest):
+        self.kv_manager.remove_seq(req.seq)
+        req.seq = None
+        req.num_preemptions += 1
+        with self._cond:
+            self.running.remove(req)
+            self.waiting.appendleft(req)
+
+    def _request_embeddings(self, req: TTSRequest) -> torch.Tensor:
+        device = req.prompt_embeds.device
+        mel_ids = torch.tensor([self.start_token] + req.generated, dtype=torch.long, device=device)
+        # same mel positions as AccelInferenceEngine._prepare_decode: 0 for start_mel_token, k + 1 for the k-th code
+        positions = torch.arange(1, mel_ids.size(0) + 1, device=device)
+        positions[0] = 0
+        mel_emb = self.tts_mel_embedding(mel_ids) + self.tts_text_pos_embedding.emb(positions)
+        return torch.cat([req.prompt_embeds, mel_emb.to(req.prompt_embeds.dtype)], dim=0)
+
+    def _prefill(self, requests: List[TTSRequest]):
+        embeds = []
+        for req in requests:
+            emb = self._request_embeddings(req)
+            embeds.append(emb[req.seq.num_cached_tokens:])
+        self.engine._prepare_prefill([req.seq for req in requests])
+        full_embeddings = torch.cat(embeds, dim=0).unsqueeze(0)
+        model_dtype = next(self.engine.model.parameters()).dtype
+        if full_embeddings.dtype != model_dtype:
+            full_embeddings = full_embeddings.to(model_dtype)
+        hidden_states = self.engine.model(inputs_embeds=full_embeddings, return_dict=True).last_hidden_state
+        cu_seqlens = get_forward_context().cu_seqlens_q.cpu().tolist()
+        last_hidden = torch.stack([hidden_states[0, cu_seqlens[i + 1] - 1] for i in range(len(requests))])
+        reset_forward_context()
+        with self._cond:
+            self.running.extend(requests)
+        self._sample_and_append(requests, last_hidden)
+
+    def _decode(self):
+        requests = list(self.running)
+        sequences = [req.seq for req in requests]
+        decode_ids, decode_pos = self.engine._prepare_decode(sequences)
+        context = get_forward_context()
+        hidden_states = self.engine._run_decode_with_graph(
+            decode_ids,
+            decode_pos,
+            context,
+            tts_mel_embedding=self.tts_mel_embedding,
+            tts_text_pos_embedding=self.tts_text_pos_embedding,
+        )
+        reset_forward_context()
+        self._sample_and_append(requests, hidden_states)
+
+    def _sample_and_append(self, requests: List[TTSRequest], hidden_states: torch.Tensor):
+        lm_dtype = next(self.engine.lm_head.parameters()).dtype
+        if hidden_states.dtype != lm_dtype:
+            hidden_states = hidden_states.to(lm_dtype)
+        latents = []
+        logits = self.engine._compute_logits(hidden_states, latents)
+        for req in requests:
+            if req.seen is None:
+                req.seen = torch.zeros(logits.size(-1), dtype=torch.bool, device=logits.device)
+                if req.seen_ids is not None:
+                    req.seen[req.seen_ids.to(logits.device)] = True
+        seen_mask = torch.stack([req.seen for req in requests])
+        sample_params = self.engine._prepare_sample(
+            len(requests),
+            temperature=[req.temperature for req in requests],
+            top_k=[req.top_k for req in requests],
+            top_p=[req.top_p for req in requests],
+            repetition_penalty=[req.repetition_penalty for req in requests],
+        )
+        sampled = self.engine.sampler(logits, *sample_params, seen_mask)
+        seen_mask.scatter_(1, sampled.unsqueeze(1), True)
+        for req, seen in zip(requests, seen_mask):
+            req.seen = seen
+        # 新请求随时可能加入, 每步都需要在主机端检查停止 token
+        next_tokens = sampled.tolist()
+
+        finished = []
+        for i, (req, token_id) in enumerate(zip(requests, next_tokens)):
+            if req.capture_latents:
+                req.latents.append(latents[0][i])
+            if token_id in self.stop_tokens:
+                finished.append(req)
+                continue
+            req.generated.append(token_id)
+            req.seq.append_token(token_id)
+            self.kv_manager.append_to_seq(req.seq)
+            if len(req.generated) >= req.max_new_tokens:
+                finished.append(req)
+
+        for req in finished:
+            self.kv_manager.remove_seq(req.seq)
+            req.seq = None
+            with self._cond:
+                self.running.remove(req)
+            codes = torch.tensor([req.generated], dtype=torch.long, device=logits.device)
+            if req.capture_latents:
+                req.future.set_result((codes, torch.stack(req.latents, dim=0).unsqueeze(0)))
+            else:
+                req.future.set_result(codes)
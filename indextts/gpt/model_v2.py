@@ -1,4 +1,8 @@
 import functools
+import hashlib
+import itertools
+from dataclasses import dataclass
+from typing import Optional
 
 import torch
 import torch.nn as nn
@@ -23,6 +27,19 @@ def null_position_embeddings(range, dim):
     return torch.zeros((range.shape[0], range.shape[1], dim), device=range.device)
 
 
+@dataclass
+class PreparedConditioning:
+    """
+    GPT conditioning that is constant for every text segment of a request,
+    built once by `UnifiedVoice.prepare_conditioning`.
+    """
+    speech_conditioning_latent: torch.Tensor  # (b, 32, dim) output of `get_conditioning()`
+    emo_vec: torch.Tensor  # (b, dim)
+    conds_latent: torch.Tensor  # (b, 34, dim) [speaker latent + emo_vec][speed half][speed]
+    # identity of conds_latent for the accel prefix cache, e.g. the speaker/emotion prompt hashes
+    cache_key: Optional[str] = None
+
+
 class ResBlock(nn.Module):
     """
     Basic residual convolutional block that uses GroupNorm.
@@ -57,6 +74,7 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
         self.model_parallel = False
         self.device_map = None
         self.cached_mel_emb = None
+        self.captured_latents = None
 
     def parallelize(self, device_map=None):
         self.device_map = (
@@ -87,6 +105,21 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
     def store_mel_emb(self, mel_emb):
         self.cached_mel_emb = mel_emb
 
+    def start_latent_capture(self):
+        """
+        Record the final-norm hidden state of the last position on every forward call of `generate()`,
+        i.e. the latent of each fed mel token (start_mel_token, then every generated code).
+        """
+        self.captured_latents = []
+
+    def stop_latent_capture(self):
+        """
+        Returns:
+            list of (b, dim) tensors, one per generation step
+        """
+        latents, self.captured_latents = self.captured_latents, None
+        return latents
+
     def prepare_inputs_for_generation(self, input_ids, past_key_values=None, **kwargs):
         token_type_ids = kwargs.get("token_type_ids", None)  # usually None
         if not self.kv_cache:
@@ -182,7 +215,12 @@ class GPT2InferenceModel(GPT2PreTrainedModel):
                 torch.cuda.set_device(self.transformer.first_device)
             hidden_states = hidden_states.to(self.lm_head.weight.device)
 
-        lm_logits = self.lm_head(hidden_states)
+        if self.captured_latents is not None:
+            latents = self.final_norm(hidden_states)
+            self.captured_latents.append(latents[:, -1])
+            lm_logits = self.lm_head[1](latents)
+        else:
+            lm_logits = self.lm_head(hidden_states)
 
         if not return_dict:
             return (lm_logits,) + transformer_outputs[1:]
@@ -411,8 +449,9 @@ class UnifiedVoice(nn.Module):
 
         self.use_accel = use_accel
         self.accel_engine = None  # Will be initialized in post_init_gpt2_config
+        self.accel_scheduler = None  # continuous batching, see start_accel_scheduler()
 
-    def post_init_gpt2_config(self, use_deepspeed=False, kv_cache=False, half=False):
+    def post_init_gpt2_config(self, use_deepspeed=False, kv_cache=False, half=False, accel_block_size=None):
         seq_length = self.max_mel_tokens + self.max_text_tokens + 2
         gpt_config = GPT2Config(
             vocab_size=self.number_mel_codes,
@@ -425,25 +464,36 @@ class UnifiedVoice(nn.Module):
             use_cache=True,
         )
 
-        if self.use_accel and torch.cuda.is_available():
-            # Check if flash attention is available
-            try:
-                import flash_attn
-            except ImportError:
-                raise ImportError("flash_attn is required for acceleration but not installed. Please install from https://github.com/Dao-AILab/flash-attention/releases/")
-
+        if self.use_accel:
             from indextts.accel import GPT2AccelModel, AccelInferenceEngine
-
-            # Create accel model
-            accel_gpt = GPT2AccelModel(gpt_config)
-            accel_gpt.load_state_dict(self.gpt.state_dict(), strict=False)
-
-            if half:
-                accel_gpt = accel_gpt.half().cuda()
-            else:
-                accel_gpt = accel_gpt.cuda()
+            from indextts.accel.attention import flash_attn_available
+
+            device = self.mel_embedding.weight.device
+            if not flash_attn_available():
+                # paged attention falls back to torch scaled_dot_product_attention
+                print(">> flash_attn/triton not available, acceleration engine uses the PyTorch attention backend. "
+                      "Install flash_attn from https://github.com/Dao-AILab/flash-attention/releases/ for best performance on CUDA.")
+
+            # 在 meta 设备上构建, 再直接引用 self.gpt 的参数 (不复制), 权重只占一份显存, dtype/设备与 self.gpt 相同
+            with torch.device("meta"):
+                accel_gpt = GPT2AccelModel(gpt_config)
+            accel_gpt.load_state_dict(self.gpt.state_dict(keep_vars=True), strict=False, assign=True)
+            # token/position embeddings as in self.gpt: mel_embedding and null position embeddings
+            del accel_gpt.wte, accel_gpt.wpe
+            accel_gpt.wte = self.mel_embedding
+            accel_gpt.wpe = self.gpt.wpe
+            on_meta = [name for name, t in itertools.chain(accel_gpt.named_parameters(), accel_gpt.named_buffers())
+                       if t.is_meta]
+            if on_meta:
+                raise RuntimeError(f"accel GPT tensors not shared with the GPT model: {on_meta}")
             accel_gpt.eval()
+            shared_bytes = sum(p.numel() * p.element_size() for p in accel_gpt.parameters())
+            print(f">> acceleration engine shares {shared_bytes / 2**20:.1f} MB of GPT weights with the GPT model")
 
+            if accel_block_size is None:
+                # flash_attn paged KV needs multiples of 256, smaller blocks let requests with the same
+                # voice share the KV of the conditioning prefix
+                accel_block_size = 256 if device.type == "cuda" and flash_attn_available() else 32
             lm_head_with_norm = nn.Sequential(self.final_norm, self.mel_head)
             self.accel_engine = AccelInferenceEngine(
                 model=accel_gpt,
@@ -451,8 +501,8 @@ class UnifiedVoice(nn.Module):
                 num_layers=self.layers,
                 num_heads=self.heads,
                 head_dim=self.model_dim // self.heads,
-                block_size=256,
-                num_blocks=16,  # Reduce to save memory (16*256 = 4096 tokens capacity)
+                block_size=accel_block_size,
+                num_blocks=4096 // accel_block_size,  # Reduce to save memory (4096 tokens capacity)
                 use_cuda_graph=True,
             )
             print("acceleration engine initialized")
@@ -485,6 +535,113 @@ class UnifiedVoice(nn.Module):
         # self.inference_model = PrunedGPT2InferenceModel(gpt_config, self.gpt, self.mel_pos_embedding, self.mel_embedding, self.final_norm, self.mel_head)
         self.gpt.wte = self.mel_embedding
 
+    def _accel_engine_fits(self, attention_mask, max_new_tokens):
+        if self.accel_engine.can_generate(attention_mask.sum(dim=1).tolist(), max_new_tokens):
+            return True
+        print(f">> batch of {attention_mask.size(0)} needs more KV cache than the acceleration engine has, "
+              f"falling back to HF generate")
+        return False
+
+    def start_accel_scheduler(self, max_batch_size=8):
+        """
+        Serve `inference_speech()` calls from concurrent threads with one continuously batched decode loop,
+        new requests join the running batch between decode steps. Requires the acceleration engine.
+        """
+        if self.accel_engine is None:
+            raise RuntimeError("accel scheduler requires the acceleration engine (use_accel=True)")
+        if self.accel_scheduler is None:
+            from indextts.accel.scheduler import AccelScheduler
+            self.accel_scheduler = AccelScheduler(
+                self.accel_engine,
+                tts_mel_embedding=self.inference_model.embeddings,
+                tts_text_pos_embedding=self.inference_model.text_pos_embedding,
+                start_token=self.start_mel_token,
+                stop_tokens=[self.stop_mel_token],
+                max_batch_size=max_batch_size,
+            )
+        self.accel_scheduler.start()
+        return self.accel_scheduler
+
+    def stop_accel_scheduler(self):
+        if self.accel_scheduler is not None:
+            self.accel_scheduler.stop()
+            self.accel_scheduler = None
+
+    def conditioning_key(self, prepared):
+        """
+        Identity of `prepared.conds_latent` for the accel prefix cache: `prepared.cache_key` when set,
+        else a hash of the tensor content (computed once per `PreparedConditioning`).
+        """
+        if prepared.cache_key is None:
+            conds = prepared.conds_latent.detach().contiguous().cpu()
+            prepared.cache_key = hashlib.sha1(conds.view(torch.uint8).numpy().tobytes()).hexdigest()
+        return prepared.cache_key
+
+    def accel_prompt_ids(self, prepared, text_inputs):
+        """
+        Prefix cache keys of the unpadded [cond][text] prompt of every row, matching `prepare_gpt_inputs()`:
+        one id per conditioning latent derived from `conditioning_key()`, then the text token ids.
+        """
+        from indextts.accel.kv_manager import prefix_token_id
+
+        key = self.conditioning_key(prepared)
+        num_conds = prepared.conds_latent.shape[1]
+        per_row_conds = prepared.conds_latent.shape[0] > 1
+        prompt_ids = []
+        for i in range(text_inputs.shape[0]):
+            row_key = f"{key}:{i}" if per_row_conds else key
+            cond_ids = [prefix_token_id(row_key, j) for j in range(num_conds)]
+            valid_mask = (text_inputs[i] != self.stop_text_token) & (text_inputs[i] != self.start_text_token)
+            text_ids = [self.start_text_token] + text_inputs[i][valid_mask].tolist() + [self.stop_text_token]
+            prompt_ids.append(cond_ids + text_ids)
+        return prompt_ids
+
+    _warned_accel_beams = False
+
+    def accel_sampling_kwargs(self, hf_generate_kwargs):
+        """
+        Sampling parameters of the accel engine/scheduler from `hf_generate_kwargs`, with the defaults of
+        the HF `generate()` path. Greedy decoding (temperature 0) when `do_sample` is False.
+        Beam search is not supported by the accel path, it samples a single beam instead.
+        """
+        if hf_generate_kwargs.get("num_beams", 1) > 1 and not UnifiedVoice._warned_accel_beams:
+            UnifiedVoice._warned_accel_beams = True
+            print(">> Warning: num_beams > 1 is not supported by the accel engine, sampling a single beam instead")
+        do_sample = hf_generate_kwargs.get("do_sample", False)
+        return dict(
+            temperature=hf_generate_kwargs.get("temperature", 1.0) if do_sample else 0.0,
+            top_k=hf_generate_kwargs.get("top_k", 50) or 0,
+            top_p=hf_generate_kwargs.get("top_p", 1.0),
+            repetition_penalty=hf_generate_kwargs.get("repetition_penalty", 1.0),
+        )
+
+    def _generate_with_scheduler(self, prepared, text_inputs, max_new_tokens, sampling_kwargs, return_latent):
+        """
+        Submit every row of `text_inputs` as its own scheduler request and gather the results
+        like `AccelInferenceEngine.generate()` would: codes padded with stop_mel_token.
+        """
+        conds_latent = prepared.conds_latent
+        prompt_ids = self.accel_prompt_ids(prepared, text_inputs)
+        futures = []
+        for i in range(text_inputs.shape[0]):
+            conds = conds_latent if conds_latent.shape[0] == 1 else conds_latent[i:i + 1]
+            input_ids, inputs_embeds, _ = self.prepare_gpt_inputs(conds, text_inputs[i:i + 1])
+            futures.append(self.accel_scheduler.submit(inputs_embeds, max_new_tokens,
+                                                       capture_latents=return_latent,
+                                                       prompt_ids=prompt_ids[i],
+                                                       seen_ids=input_ids[0],
+                                                       **sampling_kwargs))
+        results = [f.result() for f in futures]
+        codes = [r[0] if return_latent else r for r in results]
+        max_len = max(c.shape[1] for c in codes)
+        output = torch.cat([F.pad(c, (0, max_len - c.shape[1]), value=self.stop_mel_token) for c in codes], dim=0)
+        if not return_latent:
+            return output, None
+        latents = [r[1] for r in results]
+        max_steps = max(l.shape[1] for l in latents)
+        latent = torch.cat([F.pad(l, (0, 0, 0, max_steps - l.shape[1])) for l in latents], dim=0)
+        return output, latent
+
     def build_aligned_inputs_and_targets(self, input, start_token, stop_token):
         inp = F.pad(input, (1, 0), value=start_token)
         tar = F.pad(input, (0, 1), value=stop_token)
@@ -587,7 +744,8 @@ class UnifiedVoice(nn.Module):
 
 
     def forward(self, speech_conditioning_latent, text_inputs, text_lengths, mel_codes, mel_codes_lengths, emo_speech_conditioning_latent,
-                cond_mel_lengths=None, emo_cond_mel_lengths=None, emo_vec=None, use_speed=None, do_spk_cond=False):
+                cond_mel_lengths=None, emo_cond_mel_lengths=None, emo_vec=None, use_speed=None, do_spk_cond=False,
+                prepared=None):
         """
         Forward pass that uses both text and voice in either text conditioning mode or voice conditioning mode
 
@@ -599,14 +757,19 @@ class UnifiedVoice(nn.Module):
 
         If return_attentions is specified, only logits are returned.
         If return_latent is specified, loss & logits are not computed or returned. Only the predicted latents are returned.
+        If prepared (`PreparedConditioning`) is given, the speaker/emotion conditioning is taken from it as is.
         """
 
-        if do_spk_cond:
+        if prepared is not None:
+            conds = prepared.conds_latent
+            if conds.shape[0] != text_inputs.shape[0]:
+                conds = conds.expand(text_inputs.shape[0], -1, -1)
+        elif do_spk_cond:
             speech_conditioning_latent = self.get_conditioning(speech_conditioning_latent.transpose(1,2), cond_mel_lengths)
         else:
             speech_conditioning_latent = speech_conditioning_latent
 
-        if emo_vec is None:
+        if prepared is None and emo_vec is None:
             emo_vec_syn_ori = self.get_emo_conditioning(emo_speech_conditioning_latent.transpose(1,2), emo_cond_mel_lengths)
             emo_vec_syn = self.emovec_layer(emo_vec_syn_ori)
             emo_vec = self.emo_layer(emo_vec_syn)
@@ -617,9 +780,10 @@ class UnifiedVoice(nn.Module):
         mel_codes = self.set_mel_padding(mel_codes, mel_codes_lengths)
         mel_codes = F.pad(mel_codes, (0, 1), value=self.stop_mel_token)
 
-        duration_emb = self.speed_emb(torch.zeros_like(use_speed))
-        duration_emb_half = self.speed_emb(torch.ones_like(use_speed))
-        conds = torch.cat((speech_conditioning_latent + emo_vec.unsqueeze(1), duration_emb_half.unsqueeze(1), duration_emb.unsqueeze(1)), 1)
+        if prepared is None:
+            duration_emb = self.speed_emb(torch.zeros_like(use_speed))
+            duration_emb_half = self.speed_emb(torch.ones_like(use_speed))
+            conds = torch.cat((speech_conditioning_latent + emo_vec.unsqueeze(1), duration_emb_half.unsqueeze(1), duration_emb.unsqueeze(1)), 1)
         text_inputs, text_targets = self.build_aligned_inputs_and_targets(text_inputs, self.start_text_token, self.stop_text_token)
         text_emb = self.text_embedding(text_inputs) + self.text_pos_embedding(text_inputs)
         mel_codes, mel_targets = self.build_aligned_inputs_and_targets(mel_codes, self.start_mel_token, self.stop_mel_token)
@@ -630,6 +794,68 @@ class UnifiedVoice(nn.Module):
         text_logits, mel_logits = self.get_logits(conds, text_emb, self.text_head, mel_emb, self.mel_head, get_attns=False, return_latent=True)
         return mel_logits[:, :-2]  # Despite the name, these are not logits. Strip off the two tokens added by this forward pass.
 
+    def forward_latent(self, prepared, text_inputs, mel_codes, mel_codes_lengths):
+        """
+        Teacher-forced latents of generated codes for a padded batch of segments.
+        Unlike `forward()`, the [cond][text] prefix is left padded exactly like in `inference_speech()`,
+        so every item sees the same context as when it is processed alone.
+        Args:
+            prepared: `PreparedConditioning`
+            text_inputs: (b, L) right padded with stop_text_token
+            mel_codes: (b, m) generated codes
+            mel_codes_lengths: (b,)
+        Returns:
+            latent: (b, m, dim)
+        """
+        _, inputs_embeds, attention_mask = self.prepare_gpt_inputs(prepared.conds_latent, text_inputs)
+        mel_codes = self.set_mel_padding(mel_codes, mel_codes_lengths)
+        mel_codes = F.pad(mel_codes, (1, 0), value=self.start_mel_token)
+        mel_emb = self.mel_embedding(mel_codes) + self.mel_pos_embedding(mel_codes)
+        emb = torch.cat([inputs_embeds, mel_emb.to(inputs_embeds.dtype)], dim=1)
+        # attention_mask already covers the start_mel_token
+        attention_mask = F.pad(attention_mask, (0, mel_codes.shape[1] - 1), value=1)
+        gpt_out = self.gpt(inputs_embeds=emb, attention_mask=attention_mask, return_dict=True)
+        enc = self.final_norm(gpt_out.last_hidden_state[:, -mel_codes.shape[1]:])
+        return enc[:, :-1]
+
+    def forward_latent_chunk(self, prepared, text_inputs, mel_codes, state=None):
+        """
+        Incremental `forward_latent()` of one segment whose codes arrive in chunks. The KV cache of the
+        teacher-forced pass is kept in `state`, so every call only runs the GPT on the codes added since the last one.
+        Args:
+            prepared: `PreparedConditioning`
+            text_inputs: (1, L)
+            mel_codes: (1, m) all codes of the segment so far
+            state: returned by the previous call for the same segment, None on the first call
+        Returns:
+            latent: (1, m - m_prev, dim) latents of the codes added since the previous call, state
+        """
+        m = mel_codes.shape[1]
+        if state is None:
+            _, prefix_embeds, attention_mask = self.prepare_gpt_inputs(prepared.conds_latent, text_inputs)
+            # attention_mask already covers the start_mel_token
+            state = {"past_key_values": None, "attention_mask": attention_mask[:, :-1], "num_latents": 0,
+                     "dtype": prefix_embeds.dtype}
+        else:
+            prefix_embeds = None
+        done = state["num_latents"]
+        if m <= done:
+            return mel_codes.new_zeros(1, 0, self.model_dim, dtype=state["dtype"]), state
+        # as in forward_latent(): the latent of code k is the output at the start_mel_token (k = 0)
+        # or at code k - 1, fed at mel position k
+        mel_inputs = F.pad(mel_codes[:, :m - 1], (1, 0), value=self.start_mel_token)[:, done:]
+        positions = torch.arange(done, m, device=mel_codes.device)
+        emb = (self.mel_embedding(mel_inputs) + self.mel_pos_embedding.emb(positions)).to(state["dtype"])
+        if prefix_embeds is not None:
+            emb = torch.cat([prefix_embeds, emb], dim=1)
+        attention_mask = F.pad(state["attention_mask"], (0, m - done), value=1)
+        gpt_out = self.gpt(inputs_embeds=emb, attention_mask=attention_mask,
+                           past_key_values=state["past_key_values"], use_cache=True, return_dict=True)
+        latent = self.final_norm(gpt_out.last_hidden_state[:, -(m - done):])
+        state = {"past_key_values": gpt_out.past_key_values, "attention_mask": attention_mask, "num_latents": m,
+                 "dtype": state["dtype"]}
+        return latent, state
+
     def prepare_gpt_inputs(
         self,
         conditional_latents: torch.Tensor,
@@ -695,18 +921,17 @@ class UnifiedVoice(nn.Module):
         fake_inputs[:, -1] = self.start_mel_token
         return fake_inputs, batched_mel_emb, attention_mask
 
-    def inference_speech(self, speech_condition, text_inputs, emo_speech_condition=None, cond_lengths=None, emo_cond_lengths=None, emo_vec=None, use_speed=False, input_tokens=None, num_return_sequences=1,
-                         max_generate_length=None, typical_sampling=False, typical_mass=.9, **hf_generate_kwargs):
+    def prepare_conditioning(self, speech_condition, cond_lengths=None, emo_speech_condition=None, emo_cond_lengths=None, emo_vec=None):
         """
+        Compute the speaker latent, emotion vector and speed embeddings once, to be reused by
+        `inference_speech(prepared=...)` and `forward(prepared=...)` for every segment of a request.
         Args:
             speech_condition: (b, d, frames) or (d, frames)
-            text_inputs: (b, L)
-            cond_mel_lengths: lengths of the conditioning mel spectrograms in shape (b,) or (1,)
-            input_tokens: additional tokens for generation in shape (b, s) or (s,)
-            max_generate_length: limit the number of generated tokens
-            hf_generate_kwargs: kwargs for `GPT2InferenceModel.generate(**hf_generate_kwargs)`
+            cond_lengths: lengths of the conditioning features in shape (b,) or (1,)
+            emo_vec: (b, dim) precomputed emotion vector, computed from `emo_speech_condition` if None
+        Returns:
+            PreparedConditioning
         """
-
         if speech_condition.ndim == 2:
             speech_condition = speech_condition.unsqueeze(0)
         if emo_speech_condition is None:
@@ -714,21 +939,42 @@ class UnifiedVoice(nn.Module):
         if cond_lengths is None:
             cond_lengths = torch.tensor([speech_condition.shape[-1]], device=speech_condition.device)
         if emo_cond_lengths is None:
-            emo_cond_lengths = torch.tensor([emo_speech_condition.shape[-1]], device=speech_condition.device) 
+            emo_cond_lengths = torch.tensor([emo_speech_condition.shape[-1]], device=speech_condition.device)
 
         speech_conditioning_latent = self.get_conditioning(speech_condition.transpose(1,2), cond_lengths)
         if emo_vec is None:
-            print('compute emo vec')
-            emo_vec = self.get_emo_conditioning(emo_speech_condition.transpose(1,2), emo_cond_lengths)
-            emo_vec = self.emovec_layer(emo_vec)
-            emo_vec = self.emo_layer(emo_vec)
-        else:
-            print('Use the specified emotion vector')
+            emo_vec = self.get_emovec(emo_speech_condition, emo_cond_lengths)
 
-        tmp = torch.zeros(text_inputs.size(0)).to(text_inputs.device)
-        duration_emb =  self.speed_emb(torch.zeros_like(tmp).long())
+        tmp = torch.zeros(speech_conditioning_latent.size(0), device=speech_conditioning_latent.device)
+        duration_emb = self.speed_emb(torch.zeros_like(tmp).long())
         duration_emb_half = self.speed_emb(torch.ones_like(tmp).long())
         conds_latent = torch.cat((speech_conditioning_latent + emo_vec.unsqueeze(1), duration_emb_half.unsqueeze(1), duration_emb.unsqueeze(1)), 1)
+        return PreparedConditioning(speech_conditioning_latent, emo_vec, conds_latent)
+
+    def inference_speech(self, speech_condition, text_inputs, emo_speech_condition=None, cond_lengths=None, emo_cond_lengths=None, emo_vec=None, use_speed=False, input_tokens=None, num_return_sequences=1,
+                         max_generate_length=None, typical_sampling=False, typical_mass=.9, prepared=None, return_latent=False,
+                         **hf_generate_kwargs):
+        """
+        Args:
+            speech_condition: (b, d, frames) or (d, frames)
+            text_inputs: (b, L)
+            cond_mel_lengths: lengths of the conditioning mel spectrograms in shape (b,) or (1,)
+            input_tokens: additional tokens for generation in shape (b, s) or (s,)
+            max_generate_length: limit the number of generated tokens
+            prepared: `PreparedConditioning` from `prepare_conditioning()`, skips recomputing the conditioning
+            return_latent: also return the final-norm hidden states of the generated codes, as computed during decoding.
+                They are NOT the latents of `forward()`/`forward_latent()` on the same codes: while decoding, the k-th
+                code is embedded at mel position k + 2 (the start_mel_token is 0), teacher-forced at k + 1.
+            hf_generate_kwargs: kwargs for `GPT2InferenceModel.generate(**hf_generate_kwargs)`,
+                a `streamer` is also honored by the accel engine (not by the accel scheduler, which is bypassed)
+        Returns:
+            codes, speech_conditioning_latent (, latent: (b, steps, dim) aligned with codes when `return_latent`)
+        """
+
+        if prepared is None:
+            prepared = self.prepare_conditioning(speech_condition, cond_lengths, emo_speech_condition, emo_cond_lengths, emo_vec)
+        speech_conditioning_latent = prepared.speech_conditioning_latent
+        conds_latent = prepared.conds_latent
         input_ids, inputs_embeds, attention_mask = self.prepare_gpt_inputs(conds_latent, text_inputs)
         self.inference_model.store_mel_emb(inputs_embeds)
         if input_tokens is None:
@@ -758,28 +1004,63 @@ class UnifiedVoice(nn.Module):
         max_length = (trunc_index + self.max_mel_tokens - 1) if max_generate_length is None else trunc_index + max_generate_length
         
         # Use accel engine if available (single sequence only)
-        if self.accel_engine is not None and num_return_sequences == 1:
+        latent = None
+        streamer = hf_generate_kwargs.get("streamer")
+        if self.accel_scheduler is not None and num_return_sequences == 1 and input_tokens is None and streamer is None:
+            output, latent = self._generate_with_scheduler(
+                prepared, text_inputs, max_length - trunc_index,
+                self.accel_sampling_kwargs(hf_generate_kwargs), return_latent,
+            )
+            if return_latent:
+                return output, speech_conditioning_latent, latent
+            return output, speech_conditioning_latent
+        elif self.accel_engine is not None and num_return_sequences == 1 and self._accel_engine_fits(
+                attention_mask, max_length - trunc_index):
             output = self.accel_engine.generate(
                 inputs,  # fake input_ids (all 1s + start_mel_token)
                 max_new_tokens=max_length - trunc_index,
                 attention_mask=attention_mask,
-                temperature=hf_generate_kwargs.get('temperature', 1),
                 stop_tokens=[self.stop_mel_token],
                 tts_embeddings=inputs_embeds,  # [pad][cond][text] embeddings (87 tokens, NO start_mel_token)
                 tts_mel_embedding=self.inference_model.embeddings,  # mel_embedding layer
                 tts_text_pos_embedding=self.inference_model.text_pos_embedding,  # text_pos_embedding layer
+                capture_latents=return_latent,
+                tts_prompt_ids=self.accel_prompt_ids(prepared, text_inputs) if input_tokens is None else None,
+                streamer=streamer,
+                **self.accel_sampling_kwargs(hf_generate_kwargs),
             )
+            if return_latent:
+                output, latent = output
         else:
-            output = self.inference_model.generate(inputs, 
-                                                bos_token_id=self.start_mel_token, pad_token_id=self.stop_mel_token,
-                                                eos_token_id=self.stop_mel_token, attention_mask=attention_mask,
-                                                max_length=max_length, logits_processor=logits_processor,
-                                                num_return_sequences=num_return_sequences,
-                                                **hf_generate_kwargs)
+            num_beams = hf_generate_kwargs.get("num_beams", 1)
+            if return_latent:
+                self.inference_model.start_latent_capture()
+                if num_beams > 1:
+                    # beam_indices are needed to follow the selected beam through the captured steps
+                    hf_generate_kwargs.update(return_dict_in_generate=True, output_scores=True)
+            try:
+                output = self.inference_model.generate(inputs, 
+                                                    bos_token_id=self.start_mel_token, pad_token_id=self.stop_mel_token,
+                                                    eos_token_id=self.stop_mel_token, attention_mask=attention_mask,
+                                                    max_length=max_length, logits_processor=logits_processor,
+                                                    num_return_sequences=num_return_sequences,
+                                                    **hf_generate_kwargs)
+            finally:
+                captured = self.inference_model.stop_latent_capture()
+            if return_latent:
+                latent = torch.stack(captured, dim=1)  # (b * num_beams, steps, dim)
+                if num_beams > 1:
+                    beam_indices = output.beam_indices[:, :latent.shape[1]]
+                    steps = torch.arange(beam_indices.shape[1], device=latent.device)
+                    latent = latent[beam_indices.clamp(min=0), steps]
+                    output = output.sequences
         if isinstance(output, torch.Tensor):
-            return output[:, trunc_index:], speech_conditioning_latent
-        # GenerateOutput
-        output.sequences = output.sequences[:, trunc_index:]
+            output = output[:, trunc_index:]
+        else:
+            # GenerateOutput
+            output.sequences = output.sequences[:, trunc_index:]
+        if return_latent:
+            return output, speech_conditioning_latent, latent
         return output, speech_conditioning_latent
 
     def get_emovec(self, emo_speech_conditioning_latent, emo_cond_lengths):
@@ -1,11 +1,17 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import CalledProcessError
 
-os.environ['HF_HUB_CACHE'] = './checkpoints/hf_cache'
 import json
+import functools
+import gc
+import math
+import queue
 import re
+import threading
 import time
-import librosa
+from typing import Dict, List
+
 import torch
 import torchaudio
 from torch.nn.utils.rnn import pad_sequence
@@ -17,28 +23,61 @@ warnings.filterwarnings("ignore", category=UserWarning)
 
 from omegaconf import OmegaConf
 
-from indextts.gpt.model_v2 import UnifiedVoice
-from indextts.utils.maskgct_utils import build_semantic_model, build_semantic_codec
-from indextts.utils.checkpoint import load_checkpoint
+from indextts.utils.checkpoint import CheckpointBundle, load_checkpoint
+from indextts.utils.feature_extractors import SeamlessM4TFeatures
 from indextts.utils.front import TextNormalizer, TextTokenizer
+from indextts.utils.audio_io import load_prompt_audio
+from indextts.utils.prompt_cache import PromptCache, audio_content_key
+from indextts.utils.streaming import (MelCodeStreamer, MelWindowMerger, PCMBlocks, StreamCancelled, VocoderStream,
+                                      mel_frames_for_codes)
+from indextts.utils.voice_profile import VoiceProfile, is_voice_profile, load_voice_profile
 
-from indextts.s2mel.modules.commons import load_checkpoint2, MyModel
-from indextts.s2mel.modules.bigvgan import bigvgan
-from indextts.s2mel.modules.campplus.DTDNN import CAMPPlus
 from indextts.s2mel.modules.audio import mel_spectrogram
 
-from transformers import AutoTokenizer
-from modelscope import AutoModelForCausalLM
-from huggingface_hub import hf_hub_download
-import safetensors
-from transformers import SeamlessM4TFeatureExtractor
 import random
 import torch.nn.functional as F
 
+def _import_model_modules():
+    """
+    Import the model code (transformers, modelscope, librosa, ...) on first `IndexTTS2()`, not when
+    `indextts.infer_v2` is imported. Done once on the calling thread before the loader threads start.
+    """
+    import indextts.gpt.model_v2  # noqa: F401
+    import indextts.utils.maskgct_utils  # noqa: F401
+    import indextts.s2mel.modules.commons  # noqa: F401
+    import indextts.s2mel.modules.bigvgan.bigvgan  # noqa: F401
+    import indextts.s2mel.modules.campplus.DTDNN  # noqa: F401
+
+
+def _lazy_component(name):
+    """
+    Attribute backed by `IndexTTS2._get_component(name)`: loaded on first access, can be unloaded again.
+    """
+    def getter(self):
+        return self._get_component(name)
+
+    def setter(self, value):
+        with self._component_lock:
+            self._components[name] = value
+
+    return property(getter, setter, doc=f"{name}, loaded on first use")
+
+
 class IndexTTS2:
+    # optional components, loaded on first use unless listed in `preload`
+    LAZY_COMPONENTS = ("qwen_emo", "semantic_model", "campplus_model", "emo_matrix", "spk_matrix")
+    DEFAULT_PRELOAD = ("semantic_model", "campplus_model")
+
+    qwen_emo = _lazy_component("qwen_emo")
+    semantic_model = _lazy_component("semantic_model")
+    campplus_model = _lazy_component("campplus_model")
+    emo_matrix = _lazy_component("emo_matrix")
+    spk_matrix = _lazy_component("spk_matrix")
+
     def __init__(
             self, cfg_path="checkpoints/config.yaml", model_dir="checkpoints", use_fp16=False, device=None,
-            use_cuda_kernel=None,use_deepspeed=False, use_accel=False, use_torch_compile=False
+            use_cuda_kernel=None,use_deepspeed=False, use_accel=False, use_torch_compile=False,
+            prompt_cache_size=32, prompt_cache_bytes=None, s2mel_bucket_size=128, preload=None, load_workers=4
     ):
         """
         Args:
@@ -50,6 +89,17 @@ class IndexTTS2:
             use_deepspeed (bool): whether to use DeepSpeed or not.
             use_accel (bool): whether to use acceleration engine for GPT2 or not.
             use_torch_compile (bool): whether to use torch.compile for optimization or not.
+            prompt_cache_size (int): max number of speaker/emotion prompts kept in the conditioning cache, 0 disables it.
+            prompt_cache_bytes (None | int): max total bytes of cached conditioning tensors, None for no limit.
+            s2mel_bucket_size (None | int): with use_torch_compile, pad s2mel sequences to a multiple of this many
+                frames and compile one static graph per length bucket, None compiles with dynamic shapes.
+                Use `warmup_s2mel()` (or tools/s2mel_warmup.py) to compile the buckets ahead of time.
+            preload (None | str | list): optional components (see `LAZY_COMPONENTS`) to load now, the others are
+                loaded on first use: "qwen_emo" is only needed for `use_emo_text`, "emo_matrix"/"spk_matrix" for
+                `emo_vector`, "semantic_model"/"campplus_model" for new (not cached) prompt audios.
+                None preloads `DEFAULT_PRELOAD`, "all" every component, [] none.
+            load_workers (int): threads loading the independent models (GPT, semantic codec, s2mel, BigVGAN,
+                text frontend and the preloaded components) concurrently, 1 loads them one after another.
         """
         if device is not None:
             self.device = device
@@ -80,11 +130,87 @@ class IndexTTS2:
         self.use_accel = use_accel
         self.use_torch_compile = use_torch_compile
 
-        self.qwen_emo = QwenEmotion(os.path.join(self.model_dir, self.cfg.qwen_emo_path))
+        # tools/convert_to_safetensors.py 转换后的 safetensors 权重, 以 mmap 方式加载
+        self.bundle = CheckpointBundle.find(self.model_dir)
+        if self.bundle is not None:
+            print(">> safetensors checkpoint bundle found in:", self.model_dir)
+
+        self._components = {}
+        self._component_lock = threading.RLock()
+        self._component_loaders = {
+            "qwen_emo": self._load_qwen_emo,
+            "semantic_model": self._load_semantic_model,
+            "campplus_model": self._load_campplus_model,
+            "emo_matrix": lambda: self._load_emo_matrix(self.cfg.emo_matrix, "emo_matrix"),
+            "spk_matrix": lambda: self._load_emo_matrix(self.cfg.spk_matrix, "spk_matrix"),
+        }
+
+        # w2v-BERT 输入特征 (SeamlessM4TFeatureExtractor 的 torch 实现), 在模型设备上计算
+        self.extract_features = SeamlessM4TFeatures().to(self.device)
+
+        self.emo_num = list(self.cfg.emo_num)
+
+        mel_fn_args = {
+            "n_fft": self.cfg.s2mel['preprocess_params']['spect_params']['n_fft'],
+            "win_size": self.cfg.s2mel['preprocess_params']['spect_params']['win_length'],
+            "hop_size": self.cfg.s2mel['preprocess_params']['spect_params']['hop_length'],
+            "num_mels": self.cfg.s2mel['preprocess_params']['spect_params']['n_mels'],
+            "sampling_rate": self.cfg.s2mel["preprocess_params"]["sr"],
+            "fmin": self.cfg.s2mel['preprocess_params']['spect_params'].get('fmin', 0),
+            "fmax": None if self.cfg.s2mel['preprocess_params']['spect_params'].get('fmax', "None") == "None" else 8000,
+            "center": False
+        }
+        self.mel_fn = lambda x: mel_spectrogram(x, **mel_fn_args)
+
+        # 缓存参考音频：按音频内容哈希缓存多个说话人/情感参考的条件特征
+        self.prompt_cache = PromptCache(max_entries=prompt_cache_size, max_bytes=prompt_cache_bytes)
+
+        # 进度引用显示（可选）
+        self.gr_progress = None
+        # 最近一次 infer_stream 的统计 (首块延迟等)
+        self.stream_stats = None
+        self.model_version = self.cfg.version if hasattr(self.cfg, "version") else None
+
+        if preload is None:
+            preload = self.DEFAULT_PRELOAD
+        elif preload == "all":
+            preload = self.LAZY_COMPONENTS
+
+        # 必须在 huggingface_hub 被导入 (_import_model_modules) 之前设置, 不覆盖用户已设置的缓存目录
+        os.environ.setdefault('HF_HUB_CACHE', './checkpoints/hf_cache')
+        # 互相独立的模型并行加载: 反序列化, 权重拷贝和设备传输互相重叠
+        _import_model_modules()
+        start_time = time.perf_counter()
+        loaders = [
+            lambda: self._load_gpt(use_deepspeed),
+            self._load_semantic_codec,
+            lambda: self._load_s2mel(s2mel_bucket_size),
+            self._load_bigvgan,
+            self._load_text_frontend,
+        ] + [functools.partial(self._get_component, name) for name in preload]
+        if load_workers > 1:
+            with ThreadPoolExecutor(max_workers=load_workers, thread_name_prefix="indextts-load") as pool:
+                futures = [pool.submit(loader) for loader in loaders]
+                for future in futures:
+                    future.result()
+        else:
+            for loader in loaders:
+                loader()
+        print(f">> models loaded in {time.perf_counter() - start_time:.2f} seconds")
+
+    def _load_gpt(self, use_deepspeed):
+        from indextts.gpt.model_v2 import UnifiedVoice
 
         self.gpt = UnifiedVoice(**self.cfg.gpt, use_accel=self.use_accel)
         self.gpt_path = os.path.join(self.model_dir, self.cfg.gpt_checkpoint)
-        load_checkpoint(self.gpt, self.gpt_path)
+        if self.bundle is not None and self.bundle.has("gpt"):
+            if self.use_fp16:
+                # 权重已是 fp16 时直接使用映射的张量, 不再转换
+                self.gpt.half()
+            self.bundle.load_into(self.gpt, "gpt")
+            self.gpt_path = self.bundle.path(self.bundle.components["gpt"][0])
+        else:
+            load_checkpoint(self.gpt, self.gpt_path)
         self.gpt = self.gpt.to(self.device)
         if self.use_fp16:
             self.gpt.eval().half()
@@ -101,24 +227,10 @@ class IndexTTS2:
 
         self.gpt.post_init_gpt2_config(use_deepspeed=use_deepspeed, kv_cache=True, half=self.use_fp16)
 
-        if self.use_cuda_kernel:
-            # preload the CUDA kernel for BigVGAN
-            try:
-                from indextts.s2mel.modules.bigvgan.alias_free_activation.cuda import activation1d
-
-                print(">> Preload custom CUDA kernel for BigVGAN", activation1d.anti_alias_activation_cuda)
-            except Exception as e:
-                print(">> Failed to load custom CUDA kernel for BigVGAN. Falling back to torch.")
-                print(f"{e!r}")
-                self.use_cuda_kernel = False
-
-        self.extract_features = SeamlessM4TFeatureExtractor.from_pretrained("facebook/w2v-bert-2.0")
-        self.semantic_model, self.semantic_mean, self.semantic_std = build_semantic_model(
-            os.path.join(self.model_dir, self.cfg.w2v_stat))
-        self.semantic_model = self.semantic_model.to(self.device)
-        self.semantic_model.eval()
-        self.semantic_mean = self.semantic_mean.to(self.device)
-        self.semantic_std = self.semantic_std.to(self.device)
+    def _load_semantic_codec(self):
+        from huggingface_hub import hf_hub_download
+        import safetensors.torch
+        from indextts.utils.maskgct_utils import build_semantic_codec
 
         semantic_codec = build_semantic_codec(self.cfg.semantic_codec)
         semantic_code_ckpt = hf_hub_download("amphion/MaskGCT", filename="semantic_codec/model.safetensors")
@@ -127,45 +239,66 @@ class IndexTTS2:
         self.semantic_codec.eval()
         print('>> semantic_codec weights restored from: {}'.format(semantic_code_ckpt))
 
+    def _load_s2mel(self, s2mel_bucket_size):
+        from indextts.s2mel.modules.commons import load_checkpoint2, MyModel
+
         s2mel_path = os.path.join(self.model_dir, self.cfg.s2mel_checkpoint)
         s2mel = MyModel(self.cfg.s2mel, use_gpt_latent=True)
-        s2mel, _, _, _ = load_checkpoint2(
-            s2mel,
-            None,
-            s2mel_path,
-            load_only_params=True,
-            ignore_modules=[],
-            is_distributed=False,
-        )
+        if self.bundle is not None and self.bundle.has("s2mel"):
+            self.bundle.load_into(s2mel.models, "s2mel", strict=False)
+            s2mel_path = self.bundle.path(self.bundle.components["s2mel"][0])
+        else:
+            s2mel, _, _, _ = load_checkpoint2(
+                s2mel,
+                None,
+                s2mel_path,
+                load_only_params=True,
+                ignore_modules=[],
+                is_distributed=False,
+            )
         self.s2mel = s2mel.to(self.device)
         self.s2mel.models['cfm'].estimator.setup_caches(max_batch_size=1, max_seq_length=8192)
         
         # Enable torch.compile optimization if requested
         if self.use_torch_compile:
             print(">> Enabling torch.compile optimization")
-            self.s2mel.enable_torch_compile()
+            self.s2mel.enable_torch_compile(bucket_size=s2mel_bucket_size)
             print(">> torch.compile optimization enabled successfully")
         
         self.s2mel.eval()
         print(">> s2mel weights restored from:", s2mel_path)
 
-        # load campplus_model
-        campplus_ckpt_path = hf_hub_download(
-            "funasr/campplus", filename="campplus_cn_common.bin"
-        )
-        campplus_model = CAMPPlus(feat_dim=80, embedding_size=192)
-        campplus_model.load_state_dict(torch.load(campplus_ckpt_path, map_location="cpu"))
-        self.campplus_model = campplus_model.to(self.device)
-        self.campplus_model.eval()
-        print(">> campplus_model weights restored from:", campplus_ckpt_path)
+    def _load_bigvgan(self):
+        from indextts.s2mel.modules.bigvgan import bigvgan
+
+        if self.use_cuda_kernel:
+            # preload the CUDA kernel for BigVGAN
+            try:
+                from indextts.s2mel.modules.bigvgan.alias_free_activation.cuda import activation1d
+
+                print(">> Preload custom CUDA kernel for BigVGAN", activation1d.anti_alias_activation_cuda)
+            except Exception as e:
+                print(">> Failed to load custom CUDA kernel for BigVGAN. Falling back to torch.")
+                print(f"{e!r}")
+                self.use_cuda_kernel = False
 
         bigvgan_name = self.cfg.vocoder.name
-        self.bigvgan = bigvgan.BigVGAN.from_pretrained(bigvgan_name, use_cuda_kernel=self.use_cuda_kernel)
-        self.bigvgan = self.bigvgan.to(self.device)
-        self.bigvgan.remove_weight_norm()
+        if self.bundle is not None and self.bundle.has("bigvgan"):
+            # bundle 中保存的是已去掉 weight norm 的权重
+            h = bigvgan.load_hparams_from_json(self.bundle.file("bigvgan_config"))
+            self.bigvgan = bigvgan.BigVGAN(h, use_cuda_kernel=self.use_cuda_kernel)
+            self.bigvgan.remove_weight_norm()
+            self.bundle.load_into(self.bigvgan, "bigvgan")
+            self.bigvgan = self.bigvgan.to(self.device)
+            bigvgan_name = self.bundle.path(self.bundle.components["bigvgan"][0])
+        else:
+            self.bigvgan = bigvgan.BigVGAN.from_pretrained(bigvgan_name, use_cuda_kernel=self.use_cuda_kernel)
+            self.bigvgan = self.bigvgan.to(self.device)
+            self.bigvgan.remove_weight_norm()
         self.bigvgan.eval()
         print(">> bigvgan weights restored from:", bigvgan_name)
 
+    def _load_text_frontend(self):
         self.bpe_path = os.path.join(self.model_dir, self.cfg.dataset["bpe_model"])
         self.normalizer = TextNormalizer(enable_glossary=True)
         self.normalizer.load()
@@ -179,51 +312,88 @@ class IndexTTS2:
             self.normalizer.load_glossary_from_yaml(self.glossary_path)
             print(">> Glossary loaded from:", self.glossary_path)
 
-        emo_matrix = torch.load(os.path.join(self.model_dir, self.cfg.emo_matrix))
-        self.emo_matrix = emo_matrix.to(self.device)
-        self.emo_num = list(self.cfg.emo_num)
+    def _get_component(self, name):
+        with self._component_lock:
+            component = self._components.get(name)
+            if component is None:
+                if name not in self._component_loaders:
+                    raise KeyError(f"unknown component: {name}, expected one of {self.LAZY_COMPONENTS}")
+                start_time = time.perf_counter()
+                component = self._component_loaders[name]()
+                self._components[name] = component
+                print(f">> {name} loaded in {time.perf_counter() - start_time:.2f} seconds")
+            return component
+
+    def is_component_loaded(self, name):
+        return self._components.get(name) is not None
+
+    def unload_component(self, name):
+        """
+        Release an optional component (see `LAZY_COMPONENTS`), it is loaded again on next use.
+        Returns True if it was loaded.
+        """
+        with self._component_lock:
+            component = self._components.pop(name, None)
+        if component is None:
+            return False
+        del component
+        gc.collect()
+        if torch.device(self.device).type == "cuda":
+            torch.cuda.empty_cache()
+        print(f">> {name} unloaded")
+        return True
+
+    def _load_qwen_emo(self):
+        return QwenEmotion(os.path.join(self.model_dir, self.cfg.qwen_emo_path))
+
+    def _load_semantic_model(self):
+        from indextts.utils.maskgct_utils import build_semantic_model
+
+        # 只用到第 17 层的输出, 之后的层不加载也不计算
+        if self.bundle is not None and self.bundle.has("w2v_stat"):
+            stat_mean_var = self.bundle.state_dict("w2v_stat")
+        else:
+            stat_mean_var = os.path.join(self.model_dir, self.cfg.w2v_stat)
+        semantic_model, _, _ = build_semantic_model(stat_mean_var, output_layer=17)
+        return semantic_model.to(self.device).eval()
 
-        spk_matrix = torch.load(os.path.join(self.model_dir, self.cfg.spk_matrix))
-        self.spk_matrix = spk_matrix.to(self.device)
+    def _load_campplus_model(self):
+        from huggingface_hub import hf_hub_download
+        from indextts.s2mel.modules.campplus.DTDNN import CAMPPlus
 
-        self.emo_matrix = torch.split(self.emo_matrix, self.emo_num)
-        self.spk_matrix = torch.split(self.spk_matrix, self.emo_num)
+        campplus_model = CAMPPlus(feat_dim=80, embedding_size=192)
+        if self.bundle is not None and self.bundle.has("campplus"):
+            campplus_ckpt_path = self.bundle.path(self.bundle.components["campplus"][0])
+            self.bundle.load_into(campplus_model, "campplus")
+        else:
+            campplus_ckpt_path = hf_hub_download(
+                "funasr/campplus", filename="campplus_cn_common.bin"
+            )
+            campplus_model.load_state_dict(torch.load(campplus_ckpt_path, map_location="cpu"))
+        campplus_model = campplus_model.to(self.device)
+        campplus_model.eval()
+        print(">> campplus_model weights restored from:", campplus_ckpt_path)
+        return campplus_model
 
-        mel_fn_args = {
-            "n_fft": self.cfg.s2mel['preprocess_params']['spect_params']['n_fft'],
-            "win_size": self.cfg.s2mel['preprocess_params']['spect_params']['win_length'],
-            "hop_size": self.cfg.s2mel['preprocess_params']['spect_params']['hop_length'],
-            "num_mels": self.cfg.s2mel['preprocess_params']['spect_params']['n_mels'],
-            "sampling_rate": self.cfg.s2mel["preprocess_params"]["sr"],
-            "fmin": self.cfg.s2mel['preprocess_params']['spect_params'].get('fmin', 0),
-            "fmax": None if self.cfg.s2mel['preprocess_params']['spect_params'].get('fmax', "None") == "None" else 8000,
-            "center": False
-        }
-        self.mel_fn = lambda x: mel_spectrogram(x, **mel_fn_args)
+    def _load_emo_matrix(self, path, bundle_name=None):
+        if self.bundle is not None and self.bundle.has(bundle_name):
+            matrix = self.bundle.state_dict(bundle_name)["matrix"]
+        else:
+            matrix = torch.load(os.path.join(self.model_dir, path))
+        return torch.split(matrix.to(self.device), self.emo_num)
 
-        # 缓存参考音频：
-        self.cache_spk_cond = None
-        self.cache_s2mel_style = None
-        self.cache_s2mel_prompt = None
-        self.cache_spk_audio_prompt = None
-        self.cache_emo_cond = None
-        self.cache_emo_audio_prompt = None
-        self.cache_mel = None
+    @property
+    def semantic_mean(self):
+        return self.semantic_model.semantic_mean
 
-        # 进度引用显示（可选）
-        self.gr_progress = None
-        self.model_version = self.cfg.version if hasattr(self.cfg, "version") else None
+    @property
+    def semantic_std(self):
+        return self.semantic_model.semantic_std
 
     @torch.no_grad()
     def get_emb(self, input_features, attention_mask):
-        vq_emb = self.semantic_model(
-            input_features=input_features,
-            attention_mask=attention_mask,
-            output_hidden_states=True,
-        )
-        feat = vq_emb.hidden_states[17]  # (B, T, C)
-        feat = (feat - self.semantic_mean) / self.semantic_std
-        return feat
+        # normalized hidden_states[17] of w2v-BERT, (B, T, C)
+        return self.semantic_model(input_features, attention_mask)
 
     def remove_long_silence(self, codes: torch.Tensor, silent_token=52, max_consecutive=30):
         """
@@ -319,24 +489,139 @@ class IndexTTS2:
 
         return wavs_list
 
+    def bucket_segments(self, segments, bucket_max_size=4) -> List[List[Dict]]:
+        """
+        Segment data bucketing.
+        if ``bucket_max_size=1``, return all segments in one bucket.
+        """
+        outputs: List[Dict] = []
+        for idx, sent in enumerate(segments):
+            outputs.append({"idx": idx, "sent": sent, "len": len(sent)})
+
+        if len(outputs) > bucket_max_size:
+            # split segments into buckets by segment length
+            buckets: List[List[Dict]] = []
+            factor = 1.5
+            last_bucket = None
+            last_bucket_sent_len_median = 0
+
+            for sent in sorted(outputs, key=lambda x: x["len"]):
+                current_sent_len = sent["len"]
+                if current_sent_len == 0:
+                    print(">> skip empty segment")
+                    continue
+                if last_bucket is None \
+                        or current_sent_len >= int(last_bucket_sent_len_median * factor) \
+                        or len(last_bucket) >= bucket_max_size:
+                    # new bucket
+                    buckets.append([sent])
+                    last_bucket = buckets[-1]
+                    last_bucket_sent_len_median = current_sent_len
+                else:
+                    # current bucket can hold more segments
+                    last_bucket.append(sent)  # sorted
+                    mid = len(last_bucket) // 2
+                    last_bucket_sent_len_median = last_bucket[mid]["len"]
+            last_bucket = None
+            # merge all buckets with size 1
+            out_buckets: List[List[Dict]] = []
+            only_ones: List[Dict] = []
+            for b in buckets:
+                if len(b) == 1:
+                    only_ones.append(b[0])
+                else:
+                    out_buckets.append(b)
+            if len(only_ones) > 0:
+                # merge into previous buckets if possible
+                # print("only_ones:", [(o["idx"], o["len"]) for o in only_ones])
+                for i in range(len(out_buckets)):
+                    b = out_buckets[i]
+                    if len(b) < bucket_max_size:
+                        b.append(only_ones.pop(0))
+                        if len(only_ones) == 0:
+                            break
+                # combined all remaining sized 1 buckets
+                if len(only_ones) > 0:
+                    out_buckets.extend(
+                        [only_ones[i:i + bucket_max_size] for i in range(0, len(only_ones), bucket_max_size)])
+            return out_buckets
+        return [outputs]
+
+    def split_buckets_for_accel(self, buckets, prompt_len, max_mel_tokens) -> List[List[Dict]]:
+        """
+        Split the buckets whose segments do not fit the KV cache of the acceleration engine together.
+        Every segment reserves its prompt (`prompt_len` conditioning latents + the text) and `max_mel_tokens` codes,
+        since `AccelInferenceEngine.generate()` cannot preempt a sequence once the cache is full.
+        """
+        engine = self.gpt.accel_engine
+        capacity = engine.kv_manager.num_blocks
+        out_buckets: List[List[Dict]] = []
+        for bucket in buckets:
+            part, used = [], 0
+            for item in bucket:
+                # [cond][start_text][text][stop_text][start_mel] + codes
+                num_tokens = prompt_len + item["len"] + 3 + max_mel_tokens
+                blocks = (num_tokens + engine.block_size - 1) // engine.block_size
+                if part and used + blocks > capacity:
+                    out_buckets.append(part)
+                    part, used = [], 0
+                part.append(item)
+                used += blocks
+            out_buckets.append(part)
+        return out_buckets
+
+    def pad_tokens_cat(self, tokens: List[torch.Tensor]) -> torch.Tensor:
+        # UnifiedVoice.prepare_gpt_inputs 会去掉 start/stop_text_token 并左侧填充,
+        # 直接使用 stop_text_token 右侧填充到最大长度即可
+        # [1, N] -> [N,]
+        tokens = [t.squeeze(0) for t in tokens]
+        return pad_sequence(tokens, batch_first=True, padding_value=self.cfg.gpt.stop_text_token)
+
     def _set_gr_progress(self, value, desc):
         if self.gr_progress is not None:
             self.gr_progress(value, desc=desc)
 
     def _load_and_cut_audio(self,audio_path,max_audio_length_seconds,verbose=False,sr=None):
-        if not sr:
-            audio, sr = librosa.load(audio_path)
-        else:
-            audio, _ = librosa.load(audio_path,sr=sr)
-        audio = torch.tensor(audio).unsqueeze(0)
-        max_audio_samples = int(max_audio_length_seconds * sr)
-
-        if audio.shape[1] > max_audio_samples:
-            if verbose:
-                print(f"Audio too long ({audio.shape[1]} samples), truncating to {max_audio_samples} samples")
-            audio = audio[:, :max_audio_samples]
+        sr = sr or 22050
+        audio = load_prompt_audio(audio_path, max_audio_length_seconds, verbose).at(sr)
         return audio, sr
-    
+
+    def warmup_s2mel(self, max_frames=4096, batch_sizes=(1,), inference_cfg_rate=0.7, cfg_truncate_steps=0):
+        """
+        Compile the s2mel estimator for every length bucket up to `max_frames` (prompt + target mel frames),
+        so the compile cost is paid here instead of on the first requests.
+        Only useful with `use_torch_compile=True` and `s2mel_bucket_size` set.
+        Pass the `inference_cfg_rate` / `cfg_truncate_steps` used by the requests (see `_pop_cfm_kwargs`).
+        """
+        cfm = self.s2mel.models['cfm']
+        if not self.use_torch_compile or not cfm.bucket_size:
+            print(">> s2mel warmup skipped: torch.compile with length buckets is not enabled")
+            return []
+        lengths = range(cfm.bucket_size, max_frames + 1, cfm.bucket_size)
+        start_time = time.perf_counter()
+        shapes = self.s2mel.warmup(lengths, batch_sizes=batch_sizes, inference_cfg_rate=inference_cfg_rate,
+                                   cfg_truncate_steps=cfg_truncate_steps)
+        print(f">> s2mel warmup: {len(shapes)} shapes compiled in {time.perf_counter() - start_time:.2f} seconds")
+        return shapes
+
+    @staticmethod
+    def _pop_cfm_kwargs(generation_kwargs):
+        """
+        CFM sampling options of `infer()` / `infer_fast()` / `infer_stream()`, as `BASECFM.inference` kwargs:
+            diffusion_steps (int, 25): number of ODE steps
+            inference_cfg_rate (float, 0.7): classifier-free guidance strength, 0 disables it
+            cfm_solver (str, "euler"): "euler", "midpoint", "heun", "ab2" or "ab3"
+            cfm_schedule (str, "uniform"): time schedule, "uniform", "cosine" or "sway"
+            cfg_truncate_steps (int, 0): last steps without the unconditional branch
+        """
+        return {
+            "n_timesteps": generation_kwargs.pop("diffusion_steps", 25),
+            "inference_cfg_rate": generation_kwargs.pop("inference_cfg_rate", 0.7),
+            "solver": generation_kwargs.pop("cfm_solver", "euler"),
+            "schedule": generation_kwargs.pop("cfm_schedule", "uniform"),
+            "cfg_truncate_steps": generation_kwargs.pop("cfg_truncate_steps", 0),
+        }
+
     def normalize_emo_vec(self, emo_vector, apply_bias=True):
         # apply biased emotion factors for better user experience,
         # by de-emphasizing emotions that can cause strange results
@@ -353,46 +638,153 @@ class IndexTTS2:
 
         return emo_vector
 
-    # 原始推理模式
-    def infer(self, spk_audio_prompt, text, output_path,
-              emo_audio_prompt=None, emo_alpha=1.0,
-              emo_vector=None,
-              use_emo_text=False, emo_text=None, use_random=False, interval_silence=200,
-              verbose=False, max_text_tokens_per_segment=120, stream_return=False, more_segment_before=0, **generation_kwargs):
-        if stream_return:
-            return self.infer_generator(
-                spk_audio_prompt, text, output_path,
-                emo_audio_prompt, emo_alpha,
-                emo_vector,
-                use_emo_text, emo_text, use_random, interval_silence,
-                verbose, max_text_tokens_per_segment, stream_return, more_segment_before, **generation_kwargs
-            )
-        else:
-            try:
-                return list(self.infer_generator(
-                    spk_audio_prompt, text, output_path,
-                    emo_audio_prompt, emo_alpha,
-                    emo_vector,
-                    use_emo_text, emo_text, use_random, interval_silence,
-                    verbose, max_text_tokens_per_segment, stream_return, more_segment_before, **generation_kwargs
-                ))[0]
-            except IndexError:
-                return None
+    @torch.no_grad()
+    def get_spk_conditioning(self, spk_audio_prompt, verbose=False):
+        """
+        Speaker conditioning bundle of a prompt audio, served from `self.prompt_cache` when possible.
+        `spk_audio_prompt` may also be a `VoiceProfile` or the path of a saved profile.
+        Returns dict with keys: spk_cond_emb, style, prompt_condition, ref_mel
+        """
+        key = ("spk", self._prompt_key(spk_audio_prompt))
+        bundle = self.prompt_cache.get(key)
+        if bundle is not None:
+            if verbose:
+                print(f">> speaker prompt cache hit: {spk_audio_prompt}")
+            return bundle
+
+        if is_voice_profile(spk_audio_prompt):
+            bundle = self.load_voice_profile(spk_audio_prompt).speaker
+            self.prompt_cache.put(key, bundle)
+            return bundle
+
+        # 只解码一次, 先截断再重采样到 22.05k (mel) 和 16k (w2v-BERT / campplus)
+        prompt_audio = load_prompt_audio(spk_audio_prompt, 15, verbose)
+        audio_22k = prompt_audio.at(22050)
+        audio_16k = prompt_audio.at(16000)
+
+        input_features, attention_mask = self.extract_features(audio_16k)
+        spk_cond_emb = self.get_emb(input_features, attention_mask)
+
+        _, S_ref = self.semantic_codec.quantize(spk_cond_emb)
+        ref_mel = self.mel_fn(audio_22k.to(spk_cond_emb.device).float())
+        ref_target_lengths = torch.LongTensor([ref_mel.size(2)]).to(ref_mel.device)
+        feat = torchaudio.compliance.kaldi.fbank(audio_16k.to(ref_mel.device),
+                                                 num_mel_bins=80,
+                                                 dither=0,
+                                                 sample_frequency=16000)
+        feat = feat - feat.mean(dim=0, keepdim=True)  # feat2另外一个滤波器能量组特征[922, 80]
+        style = self.campplus_model(feat.unsqueeze(0))  # 参考音频的全局style2[1,192]
+
+        prompt_condition = self.s2mel.models['length_regulator'](S_ref,
+                                                                 ylens=ref_target_lengths,
+                                                                 n_quantizers=3,
+                                                                 f0=None)[0]
+        bundle = {
+            "spk_cond_emb": spk_cond_emb,
+            "style": style,
+            "prompt_condition": prompt_condition,
+            "ref_mel": ref_mel,
+        }
+        self.prompt_cache.put(key, bundle)
+        return bundle
 
-    def infer_generator(self, spk_audio_prompt, text, output_path,
-              emo_audio_prompt=None, emo_alpha=1.0,
-              emo_vector=None,
-              use_emo_text=False, emo_text=None, use_random=False, interval_silence=200,
-              verbose=False, max_text_tokens_per_segment=120, stream_return=False, quick_streaming_tokens=0, **generation_kwargs):
-        print(">> starting inference...")
-        self._set_gr_progress(0, "starting inference...")
-        if verbose:
-            print(f"origin text:{text}, spk_audio_prompt:{spk_audio_prompt}, "
-                  f"emo_audio_prompt:{emo_audio_prompt}, emo_alpha:{emo_alpha}, "
-                  f"emo_vector:{emo_vector}, use_emo_text:{use_emo_text}, "
-                  f"emo_text:{emo_text}")
-        start_time = time.perf_counter()
+    @torch.no_grad()
+    def get_emo_conditioning(self, emo_audio_prompt, verbose=False):
+        """
+        Emotion conditioning bundle of a prompt audio, served from `self.prompt_cache` when possible.
+        `emo_audio_prompt` may also be a `VoiceProfile` or the path of a saved profile.
+        Returns dict with keys: emo_cond_emb
+        """
+        key = ("emo", self._prompt_key(emo_audio_prompt, emotion=True))
+        bundle = self.prompt_cache.get(key)
+        if bundle is not None:
+            if verbose:
+                print(f">> emotion prompt cache hit: {emo_audio_prompt}")
+            return bundle
+
+        if is_voice_profile(emo_audio_prompt):
+            bundle = self.load_voice_profile(emo_audio_prompt).emotion
+            if bundle is None:
+                raise ValueError(f"voice profile {emo_audio_prompt} has no emotion conditioning, "
+                                 f"pass an emo_audio_prompt explicitly")
+            self.prompt_cache.put(key, bundle)
+            return bundle
+
+        # 与说话人参考是同一段音频时, 16k 特征相同, 直接复用 spk_cond_emb
+        spk_bundle = self.prompt_cache.peek(("spk", key[1]))
+        if spk_bundle is not None:
+            bundle = {"emo_cond_emb": spk_bundle["spk_cond_emb"]}
+            self.prompt_cache.put(key, bundle)
+            return bundle
+
+        emo_audio = load_prompt_audio(emo_audio_prompt, 15, verbose).at(16000)
+        emo_input_features, emo_attention_mask = self.extract_features(emo_audio)
+        emo_cond_emb = self.get_emb(emo_input_features, emo_attention_mask)
+
+        bundle = {"emo_cond_emb": emo_cond_emb}
+        self.prompt_cache.put(key, bundle)
+        return bundle
+
+    def _prompt_key(self, prompt, emotion=False):
+        if isinstance(prompt, VoiceProfile):
+            # 声音配置的情感条件可能来自另一段音频, 与说话人分开标识
+            return prompt.emo_key if emotion else prompt.key
+        return audio_content_key(prompt)
+
+    def create_voice_profile(self, spk_audio_prompt, profile_path=None, emo_audio_prompt=None, verbose=False):
+        """
+        Precompute the speaker (and emotion) conditioning of a prompt audio as a `VoiceProfile`,
+        saving it to `profile_path` (*.safetensors) when given.
+        """
+        if emo_audio_prompt is None:
+            emo_audio_prompt = spk_audio_prompt
+        for prompt in (spk_audio_prompt, emo_audio_prompt):
+            if is_voice_profile(prompt):
+                raise ValueError(f"create_voice_profile expects prompt audio, got a voice profile: {prompt}")
+        speaker = self.get_spk_conditioning(spk_audio_prompt, verbose)
+        emotion = self.get_emo_conditioning(emo_audio_prompt, verbose)
+        metadata = {
+            "source_hash": audio_content_key(spk_audio_prompt),
+            "emo_source_hash": audio_content_key(emo_audio_prompt),
+            "source_name": os.path.basename(spk_audio_prompt),
+            "model_version": str(self.model_version),
+        }
+        profile = VoiceProfile(speaker, emotion, metadata)
+        if profile_path:
+            profile.save(profile_path)
+            print(">> voice profile saved to:", profile_path)
+        return profile
+
+    def load_voice_profile(self, profile):
+        """
+        Load a `VoiceProfile` (or the path of a saved profile) onto the model device.
+        """
+        if not isinstance(profile, VoiceProfile):
+            profile = load_voice_profile(profile)
+        model_version = profile.metadata.get("model_version")
+        if model_version is not None and model_version != str(self.model_version):
+            print(f">> Warning: voice profile was created with model version {model_version}, "
+                  f"current model version is {self.model_version}")
+        return profile.to(self.device)
+
+    def evict_prompt(self, audio_path=None):
+        """
+        Drop the cached conditioning of `audio_path` (speaker and emotion), or of every prompt if None.
+        """
+        if audio_path is None:
+            self.prompt_cache.clear()
+        else:
+            self.prompt_cache.evict(("spk", self._prompt_key(audio_path)))
+            self.prompt_cache.evict(("emo", self._prompt_key(audio_path, emotion=True)))
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
 
+    def _prepare_request(self, spk_audio_prompt, text, emo_audio_prompt=None, emo_alpha=1.0, emo_vector=None,
+                         use_emo_text=False, emo_text=None, use_random=False, verbose=False):
+        """
+        Resolve the emotion settings of a request and gather everything that is shared by its segments.
+        Returns dict with keys: spk_cond_emb, style, prompt_condition, ref_mel, emo_cond_emb, prepared
+        """
         if use_emo_text or emo_vector is not None:
             # we're using a text or emotion vector guidance; so we must remove
             # "emotion reference voice", to ensure we use correct emotion mixing!
@@ -425,49 +817,11 @@ class IndexTTS2:
             emo_alpha = 1.0
 
         # 如果参考音频改变了，才需要重新生成, 提升速度
-        if self.cache_spk_cond is None or self.cache_spk_audio_prompt != spk_audio_prompt:
-            if self.cache_spk_cond is not None:
-                self.cache_spk_cond = None
-                self.cache_s2mel_style = None
-                self.cache_s2mel_prompt = None
-                self.cache_mel = None
-                torch.cuda.empty_cache()
-            audio,sr = self._load_and_cut_audio(spk_audio_prompt,15,verbose)
-            audio_22k = torchaudio.transforms.Resample(sr, 22050)(audio)
-            audio_16k = torchaudio.transforms.Resample(sr, 16000)(audio)
-
-            inputs = self.extract_features(audio_16k, sampling_rate=16000, return_tensors="pt")
-            input_features = inputs["input_features"]
-            attention_mask = inputs["attention_mask"]
-            input_features = input_features.to(self.device)
-            attention_mask = attention_mask.to(self.device)
-            spk_cond_emb = self.get_emb(input_features, attention_mask)
-
-            _, S_ref = self.semantic_codec.quantize(spk_cond_emb)
-            ref_mel = self.mel_fn(audio_22k.to(spk_cond_emb.device).float())
-            ref_target_lengths = torch.LongTensor([ref_mel.size(2)]).to(ref_mel.device)
-            feat = torchaudio.compliance.kaldi.fbank(audio_16k.to(ref_mel.device),
-                                                     num_mel_bins=80,
-                                                     dither=0,
-                                                     sample_frequency=16000)
-            feat = feat - feat.mean(dim=0, keepdim=True)  # feat2另外一个滤波器能量组特征[922, 80]
-            style = self.campplus_model(feat.unsqueeze(0))  # 参考音频的全局style2[1,192]
-
-            prompt_condition = self.s2mel.models['length_regulator'](S_ref,
-                                                                     ylens=ref_target_lengths,
-                                                                     n_quantizers=3,
-                                                                     f0=None)[0]
-
-            self.cache_spk_cond = spk_cond_emb
-            self.cache_s2mel_style = style
-            self.cache_s2mel_prompt = prompt_condition
-            self.cache_spk_audio_prompt = spk_audio_prompt
-            self.cache_mel = ref_mel
-        else:
-            style = self.cache_s2mel_style
-            prompt_condition = self.cache_s2mel_prompt
-            spk_cond_emb = self.cache_spk_cond
-            ref_mel = self.cache_mel
+        spk_cond = self.get_spk_conditioning(spk_audio_prompt, verbose)
+        spk_cond_emb = spk_cond["spk_cond_emb"]
+        style = spk_cond["style"]
+        prompt_condition = spk_cond["prompt_condition"]
+        ref_mel = spk_cond["ref_mel"]
 
         if emo_vector is not None:
             weight_vector = torch.tensor(emo_vector, device=self.device)
@@ -482,22 +836,352 @@ class IndexTTS2:
             emovec_mat = torch.sum(emovec_mat, 0)
             emovec_mat = emovec_mat.unsqueeze(0)
 
-        if self.cache_emo_cond is None or self.cache_emo_audio_prompt != emo_audio_prompt:
-            if self.cache_emo_cond is not None:
-                self.cache_emo_cond = None
-                torch.cuda.empty_cache()
-            emo_audio, _ = self._load_and_cut_audio(emo_audio_prompt,15,verbose,sr=16000)
-            emo_inputs = self.extract_features(emo_audio, sampling_rate=16000, return_tensors="pt")
-            emo_input_features = emo_inputs["input_features"]
-            emo_attention_mask = emo_inputs["attention_mask"]
-            emo_input_features = emo_input_features.to(self.device)
-            emo_attention_mask = emo_attention_mask.to(self.device)
-            emo_cond_emb = self.get_emb(emo_input_features, emo_attention_mask)
-
-            self.cache_emo_cond = emo_cond_emb
-            self.cache_emo_audio_prompt = emo_audio_prompt
+        emo_cond_emb = self.get_emo_conditioning(emo_audio_prompt, verbose)["emo_cond_emb"]
+
+        # the speaker latent, emotion vector and speed embeddings are the same for every segment
+        with torch.no_grad():
+            with torch.amp.autocast(spk_cond_emb.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                emovec = self.gpt.merge_emovec(
+                    spk_cond_emb,
+                    emo_cond_emb,
+                    torch.tensor([spk_cond_emb.shape[-1]], device=spk_cond_emb.device),
+                    torch.tensor([emo_cond_emb.shape[-1]], device=spk_cond_emb.device),
+                    alpha=emo_alpha
+                )
+
+                if emo_vector is not None:
+                    emovec = emovec_mat + (1 - torch.sum(weight_vector)) * emovec
+                    # emovec = emovec_mat
+
+                prepared = self.gpt.prepare_conditioning(
+                    spk_cond_emb,
+                    cond_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=spk_cond_emb.device),
+                    emo_vec=emovec,
+                )
+        if emo_vector is None or not use_random:
+            # same prompts and emotion settings -> same conditioning prefix, shared in the accel KV prefix cache
+            prepared.cache_key = "|".join(str(k) for k in (
+                self._prompt_key(spk_audio_prompt), self._prompt_key(emo_audio_prompt, emotion=True), emo_alpha, emo_vector))
+
+        return {
+            "spk_cond_emb": spk_cond_emb,
+            "style": style,
+            "prompt_condition": prompt_condition,
+            "ref_mel": ref_mel,
+            "emo_cond_emb": emo_cond_emb,
+            "prepared": prepared,
+        }
+
+    def infer_fast(self, spk_audio_prompt, text, output_path,
+                   emo_audio_prompt=None, emo_alpha=1.0,
+                   emo_vector=None,
+                   use_emo_text=False, emo_text=None, use_random=False, interval_silence=200,
+                   verbose=False, max_text_tokens_per_segment=120, segments_bucket_max_size=4, **generation_kwargs):
+        """
+        批量推理: 分句按长度分桶, 每个桶作为一个 batch 依次经过 GPT 生成、latent、length regulator、CFM 和 BigVGAN。
+        Args:
+            ``segments_bucket_max_size``: 分句分桶的最大容量，默认``4``，可以根据GPU内存调整
+                - 越大，bucket数量越少，batch越多，推理速度越*快*，占用内存更多
+                - 越小，bucket数量越多，batch越少，推理速度越*慢*，占用内存和结果更接近于非快速推理
+        """
+        print(">> starting fast inference...")
+        self._set_gr_progress(0, "starting fast inference...")
+        if verbose:
+            print(f"origin text:{text}, spk_audio_prompt:{spk_audio_prompt}, "
+                  f"emo_audio_prompt:{emo_audio_prompt}, emo_alpha:{emo_alpha}, "
+                  f"emo_vector:{emo_vector}, use_emo_text:{use_emo_text}, "
+                  f"emo_text:{emo_text}")
+        start_time = time.perf_counter()
+
+        cond = self._prepare_request(spk_audio_prompt, text, emo_audio_prompt, emo_alpha, emo_vector,
+                                     use_emo_text, emo_text, use_random, verbose)
+        style = cond["style"]
+        prompt_condition = cond["prompt_condition"]
+        ref_mel = cond["ref_mel"]
+        prepared = cond["prepared"]
+        spk_cond_emb = cond["spk_cond_emb"]
+        emo_cond_emb = cond["emo_cond_emb"]
+
+        self._set_gr_progress(0.1, "text processing...")
+        text_tokens_list = self.tokenizer.tokenize(text)
+        segments = self.tokenizer.split_segments(text_tokens_list, max_text_tokens_per_segment)
+        if verbose:
+            print(">> text token count:", len(text_tokens_list))
+            print("   segments count:", len(segments))
+            print("   max_text_tokens_per_segment:", max_text_tokens_per_segment)
+            print(*segments, sep="\n")
+        do_sample = generation_kwargs.pop("do_sample", True)
+        top_p = generation_kwargs.pop("top_p", 0.8)
+        top_k = generation_kwargs.pop("top_k", 30)
+        temperature = generation_kwargs.pop("temperature", 0.8)
+        length_penalty = generation_kwargs.pop("length_penalty", 0.0)
+        num_beams = generation_kwargs.pop("num_beams", 3)
+        repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
+        max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 1500)
+        sampling_rate = 22050
+        hop_length = self.cfg.s2mel['preprocess_params']['spect_params']['hop_length']
+        cfm_kwargs = self._pop_cfm_kwargs(generation_kwargs)
+
+        bucket_max_size = segments_bucket_max_size if self.device != "cpu" else 1
+        all_segments = self.bucket_segments(segments, bucket_max_size=bucket_max_size)
+        if self.gpt.accel_engine is not None and bucket_max_size > 1:
+            all_segments = self.split_buckets_for_accel(all_segments, prepared.conds_latent.size(1), max_mel_tokens)
+        bucket_count = len(all_segments)
+        if verbose:
+            print(">> segments bucket_count:", bucket_count,
+                  "bucket sizes:", [(len(s), [t["idx"] for t in s]) for s in all_segments],
+                  "bucket_max_size:", bucket_max_size)
+
+        gpt_gen_time = 0
+        gpt_forward_time = 0
+        s2mel_time = 0
+        bigvgan_time = 0
+        has_warned = False
+        all_wavs: Dict[int, torch.Tensor] = {}
+        all_batch_num = sum(len(s) for s in all_segments)
+        processed_num = 0
+        for bucket in all_segments:
+            batch_num = len(bucket)
+            item_tokens = [
+                torch.tensor(self.tokenizer.convert_tokens_to_ids(item["sent"]), dtype=torch.int32,
+                             device=self.device).unsqueeze(0)
+                for item in bucket
+            ]
+            if batch_num > 1:
+                batch_text_tokens = self.pad_tokens_cat(item_tokens)
+            else:
+                batch_text_tokens = item_tokens[0]
+            processed_num += batch_num
+            self._set_gr_progress(0.2 + 0.7 * processed_num / all_batch_num,
+                                  f"speech synthesis {processed_num}/{all_batch_num}...")
+
+            m_start_time = time.perf_counter()
+            with torch.no_grad():
+                with torch.amp.autocast(batch_text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                    codes, _ = self.gpt.inference_speech(
+                        spk_cond_emb,
+                        batch_text_tokens,
+                        emo_cond_emb,
+                        do_sample=do_sample,
+                        top_p=top_p,
+                        top_k=top_k,
+                        temperature=temperature,
+                        num_return_sequences=1,
+                        length_penalty=length_penalty,
+                        num_beams=num_beams,
+                        repetition_penalty=repetition_penalty,
+                        max_generate_length=max_mel_tokens,
+                        prepared=prepared,
+                        **generation_kwargs
+                    )
+                gpt_gen_time += time.perf_counter() - m_start_time
+
+                code_lens = []
+                for code in codes:
+                    if self.stop_mel_token not in code:
+                        code_len = len(code)
+                        if not has_warned:
+                            warnings.warn(
+                                f"WARN: generation stopped due to exceeding `max_mel_tokens` ({max_mel_tokens}). "
+                                f"Consider reducing `max_text_tokens_per_segment`({max_text_tokens_per_segment}) or increasing `max_mel_tokens`.",
+                                category=RuntimeWarning
+                            )
+                            has_warned = True
+                    else:
+                        code_len = (code == self.stop_mel_token).nonzero(as_tuple=False)[0, 0].item()
+                    code_lens.append(code_len)
+                max_code_len = max(code_lens)
+                codes = codes[:, :max_code_len]
+                code_lens = torch.tensor(code_lens, dtype=torch.long, device=self.device)
+                if verbose:
+                    print(f"fix codes shape: {codes.shape}, code lens: {code_lens}")
+
+                m_start_time = time.perf_counter()
+                with torch.amp.autocast(batch_text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                    latent = self.gpt.forward_latent(prepared, batch_text_tokens, codes.clone(), code_lens)
+                gpt_forward_time += time.perf_counter() - m_start_time
+
+                m_start_time = time.perf_counter()
+                latent = self.s2mel.models['gpt_layer'](latent)
+                # 填充部分的 stop_mel_token 不在 codebook 中
+                valid = torch.arange(max_code_len, device=codes.device).unsqueeze(0) < code_lens.unsqueeze(1)
+                S_infer = self.semantic_codec.quantizer.vq2emb(codes.masked_fill(~valid, 0).unsqueeze(1))
+                S_infer = S_infer.transpose(1, 2)
+                S_infer = S_infer + latent
+                target_lengths = (code_lens * 1.72).long()
+
+                # length regulator 对整个序列做 GroupNorm, 需要逐条处理, 避免填充部分影响结果
+                cat_conditions = []
+                for i in range(batch_num):
+                    cond = self.s2mel.models['length_regulator'](S_infer[i:i + 1, :code_lens[i]],
+                                                                 ylens=target_lengths[i:i + 1],
+                                                                 n_quantizers=3,
+                                                                 f0=None)[0]
+                    cat_conditions.append(torch.cat([prompt_condition, cond], dim=1).squeeze(0))
+                cat_condition = pad_sequence(cat_conditions, batch_first=True)
+                x_lens = target_lengths + ref_mel.size(-1)
+                vc_target = self.s2mel.models['cfm'].inference(cat_condition,
+                                                               x_lens,
+                                                               ref_mel.expand(batch_num, -1, -1),
+                                                               style.expand(batch_num, -1),
+                                                               None, **cfm_kwargs)
+                vc_target = vc_target[:, :, ref_mel.size(-1):]
+                s2mel_time += time.perf_counter() - m_start_time
+
+                m_start_time = time.perf_counter()
+                # 填充帧设为静音 (log(1e-5)), 再按各自的帧数截断
+                frame_mask = torch.arange(vc_target.size(-1), device=vc_target.device).unsqueeze(0) < target_lengths.unsqueeze(1)
+                vc_target = vc_target.masked_fill(~frame_mask.unsqueeze(1), math.log(1e-5))
+                wav = self.bigvgan(vc_target.float()).squeeze(1)
+                bigvgan_time += time.perf_counter() - m_start_time
+
+                wav = torch.clamp(32767 * wav, -32767.0, 32767.0)
+                for i, item in enumerate(bucket):
+                    all_wavs[item["idx"]] = wav[i:i + 1, :target_lengths[i].item() * hop_length].cpu()
+        end_time = time.perf_counter()
+
+        self._set_gr_progress(0.9, "saving audio...")
+        wavs = [all_wavs[idx] for idx in sorted(all_wavs)]
+        wavs = self.insert_interval_silence(wavs, sampling_rate=sampling_rate, interval_silence=interval_silence)
+        wav = torch.cat(wavs, dim=1)
+        wav_length = wav.shape[-1] / sampling_rate
+        print(f">> gpt_gen_time: {gpt_gen_time:.2f} seconds")
+        print(f">> gpt_forward_time: {gpt_forward_time:.2f} seconds")
+        print(f">> s2mel_time: {s2mel_time:.2f} seconds")
+        print(f">> bigvgan_time: {bigvgan_time:.2f} seconds")
+        print(f">> Total fast inference time: {end_time - start_time:.2f} seconds")
+        print(f">> Generated audio length: {wav_length:.2f} seconds")
+        print(f">> [fast] batch_num: {all_batch_num} bucket_max_size: {bucket_max_size}",
+              f"bucket_count: {bucket_count}" if bucket_max_size > 1 else "")
+        print(f">> [fast] RTF: {(end_time - start_time) / wav_length:.4f}")
+
+        # save audio
+        wav = wav.cpu()  # to cpu
+        if output_path:
+            # 直接保存音频到指定路径中
+            if os.path.isfile(output_path):
+                os.remove(output_path)
+                print(">> remove old wav file:", output_path)
+            if os.path.dirname(output_path) != "":
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            torchaudio.save(output_path, wav.type(torch.int16), sampling_rate)
+            print(">> wav file saved to:", output_path)
+            return output_path
+        else:
+            # 返回以符合Gradio的格式要求
+            wav_data = wav.type(torch.int16)
+            wav_data = wav_data.numpy().T
+            return (sampling_rate, wav_data)
+
+    # 原始推理模式
+    def infer(self, spk_audio_prompt, text, output_path,
+              emo_audio_prompt=None, emo_alpha=1.0,
+              emo_vector=None,
+              use_emo_text=False, emo_text=None, use_random=False, interval_silence=200,
+              verbose=False, max_text_tokens_per_segment=120, stream_return=False, more_segment_before=0, **generation_kwargs):
+        if stream_return:
+            return self.infer_generator(
+                spk_audio_prompt, text, output_path,
+                emo_audio_prompt, emo_alpha,
+                emo_vector,
+                use_emo_text, emo_text, use_random, interval_silence,
+                verbose, max_text_tokens_per_segment, stream_return, more_segment_before, **generation_kwargs
+            )
         else:
-            emo_cond_emb = self.cache_emo_cond
+            try:
+                return list(self.infer_generator(
+                    spk_audio_prompt, text, output_path,
+                    emo_audio_prompt, emo_alpha,
+                    emo_vector,
+                    use_emo_text, emo_text, use_random, interval_silence,
+                    verbose, max_text_tokens_per_segment, stream_return, more_segment_before, **generation_kwargs
+                ))[0]
+            except IndexError:
+                return None
+
+    def _pipelined_segments(self, segments, run_gpt, run_s2mel, max_pending=2):
+        """
+        Two-stage pipeline over the segments of a request: `run_gpt(seg_idx, sent)` runs in a background thread,
+        `run_s2mel(item)` runs on its results in the calling thread (on a separate CUDA stream when on CUDA),
+        so the GPT decodes segment i+1 while segment i is in s2mel/BigVGAN.
+        At most `max_pending` GPT results wait for the second stage.
+        Yields the `run_s2mel` outputs in segment order.
+        """
+        handoff = queue.Queue(maxsize=max_pending)
+        stop = threading.Event()
+        use_cuda = torch.device(self.device).type == "cuda"
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    handoff.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for seg_idx, sent in enumerate(segments):
+                    if stop.is_set():
+                        return
+                    item = run_gpt(seg_idx, sent)
+                    if use_cuda:
+                        # 第二阶段在另一个 stream 上, 需等待本阶段的计算完成
+                        item["ready"] = torch.cuda.Event()
+                        item["ready"].record()
+                    if not put(item):
+                        return
+                put(None)
+            except BaseException as e:
+                put(e)
+
+        stream = torch.cuda.Stream(device=self.device) if use_cuda else None
+        thread = threading.Thread(target=produce, name="indextts-gpt-stage", daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = handoff.get()
+                if item is None:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                if stream is None:
+                    yield run_s2mel(item)
+                    continue
+                with torch.cuda.stream(stream):
+                    stream.wait_event(item.pop("ready"))
+                    for value in item.values():
+                        if isinstance(value, torch.Tensor):
+                            value.record_stream(stream)
+                    output = run_s2mel(item)
+                yield output
+        finally:
+            stop.set()
+            thread.join()
+
+    def infer_generator(self, spk_audio_prompt, text, output_path,
+              emo_audio_prompt=None, emo_alpha=1.0,
+              emo_vector=None,
+              use_emo_text=False, emo_text=None, use_random=False, interval_silence=200,
+              verbose=False, max_text_tokens_per_segment=120, stream_return=False, quick_streaming_tokens=0, **generation_kwargs):
+        print(">> starting inference...")
+        self._set_gr_progress(0, "starting inference...")
+        if verbose:
+            print(f"origin text:{text}, spk_audio_prompt:{spk_audio_prompt}, "
+                  f"emo_audio_prompt:{emo_audio_prompt}, emo_alpha:{emo_alpha}, "
+                  f"emo_vector:{emo_vector}, use_emo_text:{use_emo_text}, "
+                  f"emo_text:{emo_text}")
+        start_time = time.perf_counter()
+
+        cond = self._prepare_request(spk_audio_prompt, text, emo_audio_prompt, emo_alpha, emo_vector,
+                                     use_emo_text, emo_text, use_random, verbose)
+        style = cond["style"]
+        prompt_condition = cond["prompt_condition"]
+        ref_mel = cond["ref_mel"]
+        prepared = cond["prepared"]
+        spk_cond_emb = cond["spk_cond_emb"]
+        emo_cond_emb = cond["emo_cond_emb"]
 
         self._set_gr_progress(0.1, "text processing...")
         text_tokens_list = self.tokenizer.tokenize(text)
@@ -524,6 +1208,8 @@ class IndexTTS2:
         num_beams = generation_kwargs.pop("num_beams", 3)
         repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
         max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 1500)
+        # GPT of segment i+1 runs in a background thread while segment i goes through s2mel and BigVGAN
+        pipeline = generation_kwargs.pop("pipeline", False)
         sampling_rate = 22050
 
         wavs = []
@@ -533,10 +1219,11 @@ class IndexTTS2:
         bigvgan_time = 0
         has_warned = False
         silence = None # for stream_return
-        for seg_idx, sent in enumerate(segments):
-            self._set_gr_progress(0.2 + 0.7 * seg_idx / segments_count,
-                                  f"speech synthesis {seg_idx + 1}/{segments_count}...")
+        cfm_kwargs = self._pop_cfm_kwargs(generation_kwargs)
 
+        def run_gpt(seg_idx, sent):
+            # 第一阶段: GPT 生成 codes 与 latent, 并按顺序抽取该段 CFM 的初始噪声, 保证随机数的使用顺序与串行执行一致
+            nonlocal gpt_gen_time, gpt_forward_time, has_warned
             text_tokens = self.tokenizer.convert_tokens_to_ids(sent)
             text_tokens = torch.tensor(text_tokens, dtype=torch.int32, device=self.device).unsqueeze(0)
             if verbose:
@@ -549,25 +1236,10 @@ class IndexTTS2:
             m_start_time = time.perf_counter()
             with torch.no_grad():
                 with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
-                    emovec = self.gpt.merge_emovec(
-                        spk_cond_emb,
-                        emo_cond_emb,
-                        torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
-                        torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
-                        alpha=emo_alpha
-                    )
-
-                    if emo_vector is not None:
-                        emovec = emovec_mat + (1 - torch.sum(weight_vector)) * emovec
-                        # emovec = emovec_mat
-
                     codes, speech_conditioning_latent = self.gpt.inference_speech(
                         spk_cond_emb,
                         text_tokens,
                         emo_cond_emb,
-                        cond_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
-                        emo_cond_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
-                        emo_vec=emovec,
                         do_sample=True,
                         top_p=top_p,
                         top_k=top_k,
@@ -577,6 +1249,7 @@ class IndexTTS2:
                         num_beams=num_beams,
                         repetition_penalty=repetition_penalty,
                         max_generate_length=max_mel_tokens,
+                        prepared=prepared,
                         **generation_kwargs
                     )
 
@@ -590,12 +1263,6 @@ class IndexTTS2:
                     )
                     has_warned = True
 
-                code_lens = torch.tensor([codes.shape[-1]], device=codes.device, dtype=codes.dtype)
-                #                 if verbose:
-                #                     print(codes, type(codes))
-                #                     print(f"codes shape: {codes.shape}, codes type: {codes.dtype}")
-                #                     print(f"code len: {code_lens}")
-
                 code_lens = []
                 max_code_len = 0
                 for code in codes:
@@ -615,7 +1282,6 @@ class IndexTTS2:
                     print(f"code len: {code_lens}")
 
                 m_start_time = time.perf_counter()
-                use_speed = torch.zeros(spk_cond_emb.size(0)).to(spk_cond_emb.device).long()
                 with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
                     latent = self.gpt(
                         speech_conditioning_latent,
@@ -624,53 +1290,66 @@ class IndexTTS2:
                         codes,
                         torch.tensor([codes.shape[-1]], device=text_tokens.device),
                         emo_cond_emb,
-                        cond_mel_lengths=torch.tensor([spk_cond_emb.shape[-1]], device=text_tokens.device),
-                        emo_cond_mel_lengths=torch.tensor([emo_cond_emb.shape[-1]], device=text_tokens.device),
-                        emo_vec=emovec,
-                        use_speed=use_speed,
+                        prepared=prepared,
                     )
-                    gpt_forward_time += time.perf_counter() - m_start_time
-
-                dtype = None
-                with torch.amp.autocast(text_tokens.device.type, enabled=dtype is not None, dtype=dtype):
-                    m_start_time = time.perf_counter()
-                    diffusion_steps = 25
-                    inference_cfg_rate = 0.7
-                    latent = self.s2mel.models['gpt_layer'](latent)
-                    S_infer = self.semantic_codec.quantizer.vq2emb(codes.unsqueeze(1))
-                    S_infer = S_infer.transpose(1, 2)
-                    S_infer = S_infer + latent
-                    target_lengths = (code_lens * 1.72).long()
-
-                    cond = self.s2mel.models['length_regulator'](S_infer,
-                                                                 ylens=target_lengths,
-                                                                 n_quantizers=3,
-                                                                 f0=None)[0]
-                    cat_condition = torch.cat([prompt_condition, cond], dim=1)
-                    vc_target = self.s2mel.models['cfm'].inference(cat_condition,
-                                                                   torch.LongTensor([cat_condition.size(1)]).to(
-                                                                       cond.device),
-                                                                   ref_mel, style, None, diffusion_steps,
-                                                                   inference_cfg_rate=inference_cfg_rate)
-                    vc_target = vc_target[:, :, ref_mel.size(-1):]
-                    s2mel_time += time.perf_counter() - m_start_time
-
-                    m_start_time = time.perf_counter()
-                    wav = self.bigvgan(vc_target.float()).squeeze().unsqueeze(0)
-                    print(wav.shape)
-                    bigvgan_time += time.perf_counter() - m_start_time
-                    wav = wav.squeeze(1)
+                gpt_forward_time += time.perf_counter() - m_start_time
+
+                target_lengths = (code_lens * 1.72).long()
+                cfm = self.s2mel.models['cfm']
+                total_len = prompt_condition.size(1) + int(target_lengths[0])
+                z = torch.randn([1, cfm.in_channels, total_len], device=latent.device)
+            return {"codes": codes, "latent": latent, "target_lengths": target_lengths, "z": z}
+
+        def run_s2mel(item):
+            # 第二阶段: s2mel + BigVGAN
+            nonlocal s2mel_time, bigvgan_time
+            codes, latent, target_lengths = item["codes"], item["latent"], item["target_lengths"]
+            dtype = None
+            with torch.no_grad(), torch.amp.autocast(codes.device.type, enabled=dtype is not None, dtype=dtype):
+                m_start_time = time.perf_counter()
+                latent = self.s2mel.models['gpt_layer'](latent)
+                S_infer = self.semantic_codec.quantizer.vq2emb(codes.unsqueeze(1))
+                S_infer = S_infer.transpose(1, 2)
+                S_infer = S_infer + latent
+
+                cond = self.s2mel.models['length_regulator'](S_infer,
+                                                             ylens=target_lengths,
+                                                             n_quantizers=3,
+                                                             f0=None)[0]
+                cat_condition = torch.cat([prompt_condition, cond], dim=1)
+                vc_target = self.s2mel.models['cfm'].inference(cat_condition,
+                                                               torch.LongTensor([cat_condition.size(1)]).to(
+                                                                   cond.device),
+                                                               ref_mel, style, None,
+                                                               z=item["z"], **cfm_kwargs)
+                vc_target = vc_target[:, :, ref_mel.size(-1):]
+                s2mel_time += time.perf_counter() - m_start_time
 
-                wav = torch.clamp(32767 * wav, -32767.0, 32767.0)
-                if verbose:
-                    print(f"wav shape: {wav.shape}", "min:", wav.min(), "max:", wav.max())
-                # wavs.append(wav[:, :-512])
-                wavs.append(wav.cpu())  # to cpu before saving
-                if stream_return:
-                    yield wav.cpu()
-                    if silence == None:
-                        silence = self.interval_silence(wavs, sampling_rate=sampling_rate, interval_silence=interval_silence)
-                    yield silence
+                m_start_time = time.perf_counter()
+                wav = self.bigvgan(vc_target.float()).squeeze().unsqueeze(0)
+                print(wav.shape)
+                bigvgan_time += time.perf_counter() - m_start_time
+                wav = wav.squeeze(1)
+
+            wav = torch.clamp(32767 * wav, -32767.0, 32767.0)
+            if verbose:
+                print(f"wav shape: {wav.shape}", "min:", wav.min(), "max:", wav.max())
+            return wav.cpu()  # to cpu before saving
+
+        if pipeline:
+            segment_outputs = self._pipelined_segments(segments, run_gpt, run_s2mel)
+        else:
+            segment_outputs = (run_s2mel(run_gpt(seg_idx, sent)) for seg_idx, sent in enumerate(segments))
+        for seg_idx, wav in enumerate(segment_outputs):
+            self._set_gr_progress(0.2 + 0.7 * (seg_idx + 1) / segments_count,
+                                  f"speech synthesis {seg_idx + 1}/{segments_count}...")
+            # wavs.append(wav[:, :-512])
+            wavs.append(wav)
+            if stream_return:
+                yield wav
+                if silence == None:
+                    silence = self.interval_silence(wavs, sampling_rate=sampling_rate, interval_silence=interval_silence)
+                yield silence
         end_time = time.perf_counter()
 
         self._set_gr_progress(0.9, "saving audio...")
@@ -707,6 +1386,215 @@ class IndexTTS2:
             wav_data = wav_data.numpy().T
             yield (sampling_rate, wav_data)
 
+    def infer_stream(self, spk_audio_prompt, text,
+                     emo_audio_prompt=None, emo_alpha=1.0, emo_vector=None,
+                     use_emo_text=False, emo_text=None, use_random=False, interval_silence=200,
+                     verbose=False, max_text_tokens_per_segment=120,
+                     stream_first_chunk_codes=20, stream_chunk_codes=40, stream_context_codes=20,
+                     stream_block_size=4096, **generation_kwargs):
+        """
+        Streaming synthesis inside segments: the mel codes are consumed while the GPT is still generating
+        them (in a background thread). Every `stream_chunk_codes` new codes, the length regulator and CFM
+        run on a window with `stream_context_codes` codes of left context. Overlapping mel windows are
+        crossfaded, and BigVGAN vocodes the finished frames in overlapped chunks with an audio crossfade.
+
+        Args:
+            stream_first_chunk_codes: codes of the first window of every segment, smaller for a lower first-chunk latency
+            stream_chunk_codes: new codes per following window
+            stream_context_codes: left context codes of every window
+            stream_block_size: samples per yielded block (the last block of the request may be shorter)
+        Yields:
+            [1, stream_block_size] float tensors at 22050 Hz in the int16 range (like `infer(stream_return=True)`)
+
+        `self.stream_stats` holds the measurements of the request: first_chunk_latency (seconds to the first
+        yielded block) as soon as it is known, then total_time, audio_length and rtf when the stream ends.
+        """
+        print(">> starting streaming inference...")
+        start_time = time.perf_counter()
+        self.stream_stats = {"first_chunk_latency": None}
+        cond = self._prepare_request(spk_audio_prompt, text, emo_audio_prompt, emo_alpha, emo_vector,
+                                     use_emo_text, emo_text, use_random, verbose)
+        style = cond["style"]
+        prompt_condition = cond["prompt_condition"]
+        ref_mel = cond["ref_mel"]
+        prepared = cond["prepared"]
+        spk_cond_emb = cond["spk_cond_emb"]
+        emo_cond_emb = cond["emo_cond_emb"]
+
+        text_tokens_list = self.tokenizer.tokenize(text)
+        segments = self.tokenizer.split_segments(text_tokens_list, max_text_tokens_per_segment)
+        if verbose:
+            print("segments count:", len(segments))
+            print(*segments, sep="\n")
+        generation_kwargs.pop("do_sample", None)
+        top_p = generation_kwargs.pop("top_p", 0.8)
+        top_k = generation_kwargs.pop("top_k", 30)
+        temperature = generation_kwargs.pop("temperature", 0.8)
+        length_penalty = generation_kwargs.pop("length_penalty", 0.0)
+        num_beams = generation_kwargs.pop("num_beams", 1)
+        if num_beams != 1:
+            print(f">> infer_stream: beam search cannot be streamed, num_beams={num_beams} is ignored")
+        repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
+        max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 1500)
+        sampling_rate = 22050
+        hop_length = self.cfg.s2mel['preprocess_params']['spect_params']['hop_length']
+        cfm_kwargs = self._pop_cfm_kwargs(generation_kwargs)
+
+        # 有界队列: 消费者提前停止时, 生成线程不会无限制地继续生成
+        code_queue = queue.Queue(maxsize=4 * max(stream_first_chunk_codes, stream_chunk_codes))
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    code_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def generate_codes():
+            # 在后台线程生成 mel codes, 经 MelCodeStreamer 逐个送入 code_queue
+            try:
+                for seg_idx, sent in enumerate(segments):
+                    if stop.is_set():
+                        return
+                    text_tokens = self.tokenizer.convert_tokens_to_ids(sent)
+                    text_tokens = torch.tensor(text_tokens, dtype=torch.int32, device=self.device).unsqueeze(0)
+                    streamer = MelCodeStreamer(code_queue, seg_idx, self.stop_mel_token, stop_event=stop)
+                    with torch.no_grad():
+                        with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                            self.gpt.inference_speech(
+                                spk_cond_emb,
+                                text_tokens,
+                                emo_cond_emb,
+                                do_sample=True,
+                                top_p=top_p,
+                                top_k=top_k,
+                                temperature=temperature,
+                                num_return_sequences=1,
+                                length_penalty=length_penalty,
+                                num_beams=1,
+                                repetition_penalty=repetition_penalty,
+                                max_generate_length=max_mel_tokens,
+                                prepared=prepared,
+                                streamer=streamer,
+                                **generation_kwargs
+                            )
+                put(None)
+            except StreamCancelled:
+                pass
+            except BaseException as e:
+                put(e)
+
+        @torch.no_grad()
+        def extend_latent(text_tokens, codes, latent, state):
+            # GPT 是因果的, teacher-forced 的 KV cache 可以跨窗口保留, 每个窗口只计算新 codes 的 latent
+            codes_t = torch.tensor(codes, dtype=torch.long, device=self.device).unsqueeze(0)
+            with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                new_latent, state = self.gpt.forward_latent_chunk(prepared, text_tokens, codes_t, state)
+            latent = new_latent if latent is None else torch.cat([latent, new_latent], dim=1)
+            return latent, state
+
+        @torch.no_grad()
+        def s2mel_window(codes, latent, c0, c1):
+            codes_t = torch.tensor(codes[c0:c1], dtype=torch.long, device=self.device).unsqueeze(0)
+            latent = self.s2mel.models['gpt_layer'](latent[:, c0:c1])
+            S_infer = self.semantic_codec.quantizer.vq2emb(codes_t.unsqueeze(1)).transpose(1, 2) + latent
+            frame_start, frame_end = mel_frames_for_codes(c0), mel_frames_for_codes(c1)
+            cond = self.s2mel.models['length_regulator'](S_infer,
+                                                         ylens=torch.LongTensor([frame_end - frame_start]).to(self.device),
+                                                         n_quantizers=3,
+                                                         f0=None)[0]
+            cat_condition = torch.cat([prompt_condition, cond], dim=1)
+            vc_target = self.s2mel.models['cfm'].inference(cat_condition,
+                                                           torch.LongTensor([cat_condition.size(1)]).to(cond.device),
+                                                           ref_mel, style, None, **cfm_kwargs)
+            return vc_target[:, :, ref_mel.size(-1):], frame_start
+
+        def vocode(mel):
+            with torch.no_grad():
+                return self.bigvgan(mel.float())
+
+        hold_frames = 16
+        blocks = PCMBlocks(stream_block_size)
+        silence = torch.zeros(1, int(sampling_rate * interval_silence / 1000.0))
+        first_chunk_latency = None
+        total_samples = 0
+        thread = threading.Thread(target=generate_codes, name="indextts-stream-gpt", daemon=True)
+        thread.start()
+
+        try:
+            seg_idx = -1
+            while True:
+                item = code_queue.get()
+                if item is None:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                tag, code, _ = item
+                if tag != seg_idx:
+                    # new segment
+                    seg_idx = tag
+                    codes, window_end = [], 0
+                    seg_latent, latent_state = None, None
+                    seg_text_tokens = torch.tensor(self.tokenizer.convert_tokens_to_ids(segments[seg_idx]),
+                                                   dtype=torch.int32, device=self.device).unsqueeze(0)
+                    merger = MelWindowMerger(hold_frames)
+                    vocoder = VocoderStream(vocode, hop_length=hop_length)
+                    chunk = stream_first_chunk_codes
+                final = code is None
+                if not final:
+                    codes.append(code)
+                    if len(codes) - window_end < chunk:
+                        continue
+                wavs = []
+                if len(codes) > window_end:
+                    # 左侧上下文需覆盖 merger 仍保留的帧
+                    c0 = max(0, window_end - stream_context_codes)
+                    while c0 > 0 and mel_frames_for_codes(c0) > merger.done:
+                        c0 -= 1
+                    seg_latent, latent_state = extend_latent(seg_text_tokens, codes, seg_latent, latent_state)
+                    mel, frame_start = s2mel_window(codes, seg_latent, c0, len(codes))
+                    window_end = len(codes)
+                    chunk = stream_chunk_codes
+                    mel = merger.push(mel, frame_start, final=final)
+                    wavs.append(vocoder.push(mel, final=final))
+                elif final:
+                    mel = merger.pending if merger.pending is not None else ref_mel.new_zeros(1, ref_mel.size(1), 0)
+                    merger.pending = None
+                    wavs.append(vocoder.push(mel, final=True))
+                if final and seg_idx < len(segments) - 1 and silence.size(-1) > 0:
+                    wavs.append(silence.to(self.device))
+                for wav in wavs:
+                    wav = torch.clamp(32767 * wav, -32767.0, 32767.0).cpu()
+                    for block in blocks.push(wav):
+                        if first_chunk_latency is None:
+                            first_chunk_latency = time.perf_counter() - start_time
+                            self.stream_stats["first_chunk_latency"] = first_chunk_latency
+                            print(f">> first_chunk_latency: {first_chunk_latency:.3f} seconds")
+                        total_samples += block.size(-1)
+                        yield block
+        finally:
+            stop.set()
+            thread.join()
+        for block in blocks.flush():
+            if first_chunk_latency is None:
+                first_chunk_latency = time.perf_counter() - start_time
+                self.stream_stats["first_chunk_latency"] = first_chunk_latency
+                print(f">> first_chunk_latency: {first_chunk_latency:.3f} seconds")
+            total_samples += block.size(-1)
+            yield block
+
+        end_time = time.perf_counter()
+        wav_length = total_samples / sampling_rate
+        self.stream_stats.update(total_time=end_time - start_time, audio_length=wav_length,
+                                 rtf=(end_time - start_time) / wav_length if wav_length > 0 else None)
+        print(f">> Total inference time: {end_time - start_time:.2f} seconds")
+        print(f">> Generated audio length: {wav_length:.2f} seconds")
+        if wav_length > 0:
+            print(f">> RTF: {(end_time - start_time) / wav_length:.4f}")
+
 
 def find_most_similar_cosine(query_vector, matrix):
     query_vector = query_vector.float()
@@ -718,6 +1606,9 @@ def find_most_similar_cosine(query_vector, matrix):
 
 class QwenEmotion:
     def __init__(self, model_dir):
+        from transformers import AutoTokenizer
+        from modelscope import AutoModelForCausalLM
+
         self.model_dir = model_dir
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_dir)
         self.model = AutoModelForCausalLM.from_pretrained(
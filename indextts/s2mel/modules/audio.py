@@ -1,7 +1,6 @@
 import numpy as np
 import torch
 import torch.utils.data
-from librosa.filters import mel as librosa_mel_fn
 from scipy.io.wavfile import read
 
 MAX_WAV_VALUE = 32768.0
@@ -50,6 +49,8 @@ def mel_spectrogram(y, n_fft, num_mels, sampling_rate, hop_size, win_size, fmin,
 
     global mel_basis, hann_window  # pylint: disable=global-statement
     if f"{str(sampling_rate)}_{str(fmax)}_{str(y.device)}" not in mel_basis:
+        from librosa.filters import mel as librosa_mel_fn
+
         mel = librosa_mel_fn(sr=sampling_rate, n_fft=n_fft, n_mels=num_mels, fmin=fmin, fmax=fmax)
         mel_basis[str(sampling_rate) + "_" + str(fmax) + "_" + str(y.device)] = torch.from_numpy(mel).float().to(y.device)
         hann_window[str(sampling_rate) + "_" + str(y.device)] = torch.hann_window(win_size).to(y.device)
@@ -439,14 +439,23 @@ class MyModel(nn.Module):
         x = self.models['gpt_layer'](x)
         return x
 
-    def enable_torch_compile(self):
+    def enable_torch_compile(self, bucket_size=128, mode=None):
         """Enable torch.compile optimization.
         
         This method applies torch.compile to the model for significant
         performance improvements during inference.
+        See `CFM.enable_torch_compile` for `bucket_size` and `mode`.
         """
         if 'cfm' in self.models:
-            self.models['cfm'].enable_torch_compile()
+            self.models['cfm'].enable_torch_compile(bucket_size=bucket_size, mode=mode)
+
+    def warmup(self, lengths, batch_sizes=(1,), inference_cfg_rate=0.7, cfg_truncate_steps=0):
+        """Compile the CFM estimator ahead of time for the given lengths, see `CFM.warmup`."""
+        if 'cfm' in self.models:
+            return self.models['cfm'].warmup(lengths, batch_sizes=batch_sizes,
+                                             inference_cfg_rate=inference_cfg_rate,
+                                             cfg_truncate_steps=cfg_truncate_steps)
+        return []
 
 
 
@@ -1,5 +1,6 @@
 import torch
 from torch import nn
+import torch.nn.functional as F
 import math
 
 from indextts.s2mel.modules.gpt_fast.model import ModelArgs, Transformer
@@ -181,21 +182,58 @@ class DiT(torch.nn.Module):
             self.style_in = nn.Linear(args.style_encoder.dim, args.DiT.hidden_dim)
 
     def setup_caches(self, max_batch_size, max_seq_length):
-        self.transformer.setup_caches(max_batch_size, max_seq_length, use_kv_cache=False)
+        self.transformer.setup_caches(max_batch_size, max_seq_length, use_kv_cache=False, is_causal=self.is_causal)
         
-    def forward(self, x, prompt_x, x_lens, t, style, cond, mask_content=False):
+    @torch.no_grad()
+    def prepare_condition(self, prompt_x, style, cond, null_branch=False):
+        """
+        Step-invariant part of the input projection for inference: the prompt mel, projected content and style
+        go through their columns of `cond_x_merge_linear` once per request, each diffusion step then only adds
+        the `x` columns (see `forward(cond_cache=...)`).
+            prompt_x (torch.Tensor): reference mel + zero mel
+                shape: (batch_size, 80, mel_timesteps)
+            style (torch.Tensor): reference global style
+                shape: (batch_size, 192)
+            cond (torch.Tensor): semantic info of reference audio and altered audio
+                shape: (batch_size, mel_timesteps, 512)
+            null_branch (bool): append the CFG null inputs (zero prompt, style and content) along the batch,
+                they reduce to one constant row computed from the biases
+        Returns:
+            dict, `cond_cache` for `forward`, batch_size (x2 with null_branch) items
+        """
+        B, _, T = prompt_x.size()
+        C = self.in_channels
+        H = self.cond_projection.out_features
+        weight, bias = self.cond_x_merge_linear.weight, self.cond_x_merge_linear.bias
+        parts = [prompt_x.transpose(1, 2), self.cond_projection(cond)]
+        if self.transformer_style_condition and not self.style_as_token:
+            parts.append(style[:, None, :].expand(-1, T, -1))
+        x_cond = F.linear(torch.cat(parts, dim=-1), weight[:, C:], bias)
+        style_token = self.style_in(style).unsqueeze(1) if self.style_as_token else None
+        if null_branch:
+            # 全零输入只剩 cond_projection 的偏置经过 cond_x_merge_linear
+            null_cond = F.linear(self.cond_projection.bias, weight[:, 2 * C:2 * C + H], bias)
+            x_cond = torch.cat([x_cond, null_cond.expand(B, T, -1)], dim=0)
+            if style_token is not None:
+                style_token = torch.cat([style_token, self.style_in.bias.expand(B, 1, -1)], dim=0)
+        return {"x_cond": x_cond, "style_token": style_token}
+
+    def forward(self, x, prompt_x, x_lens, t, style, cond, mask_content=False, cond_cache=None):
         """
             x (torch.Tensor): random noise
             prompt_x (torch.Tensor): reference mel + zero mel
                 shape: (batch_size, 80, 795+1068)
             x_lens (torch.Tensor): mel frames output
                 shape: (batch_size, mel_timesteps)
+                None when no item is padded, attention then runs without a mask
             t (torch.Tensor): radshape: 
                 shape: (batch_size)    
             style (torch.Tensor): reference global style
                 shape: (batch_size, 192)
             cond (torch.Tensor): semantic info of reference audio and altered audio
                 shape: (batch_size, mel_timesteps(795+1069), 512)
+            cond_cache (dict): output of `prepare_condition` (inference only), prompt_x, style and cond are
+                then not used and may be None
         
         """
         class_dropout = False
@@ -210,33 +248,45 @@ class DiT(torch.nn.Module):
 
 
         t1 = self.t_embedder(t)  # (N, D) # t1 [2, 512]
-        cond = cond_in_module(cond) # cond [2,1863,512]->[2,1863,512]
-
         x = x.transpose(1, 2) # [2,1863,80]
-        prompt_x = prompt_x.transpose(1, 2) # [2,1863,80]
 
-        x_in = torch.cat([x, prompt_x, cond], dim=-1) # 80+80+512=672 [2, 1863, 672]
-        
-        if self.transformer_style_condition and not self.style_as_token: # True and True
-            x_in = torch.cat([x_in, style[:, None, :].repeat(1, T, 1)], dim=-1) #[2, 1863, 864]
-            
-        if class_dropout: #False
-            x_in[..., self.in_channels:] = x_in[..., self.in_channels:] * 0 # 80维后全置为0
-            
-        x_in = self.cond_x_merge_linear(x_in)  # (N, T, D) [2, 1863, 512]
-        
-        if self.style_as_token: # False
-            style = self.style_in(style)
-            style = torch.zeros_like(style) if class_dropout else style
-            x_in = torch.cat([style.unsqueeze(1), x_in], dim=1)
+        if cond_cache is not None:
+            # 条件部分已在 prepare_condition 中算好, 这里只加上 x 的投影
+            x_in = F.linear(x, self.cond_x_merge_linear.weight[:, :self.in_channels]) + cond_cache["x_cond"]
+            if self.style_as_token:
+                x_in = torch.cat([cond_cache["style_token"], x_in], dim=1)
+        else:
+            cond = cond_in_module(cond) # cond [2,1863,512]->[2,1863,512]
+            prompt_x = prompt_x.transpose(1, 2) # [2,1863,80]
+
+            x_in = torch.cat([x, prompt_x, cond], dim=-1) # 80+80+512=672 [2, 1863, 672]
+
+            if self.transformer_style_condition and not self.style_as_token: # True and True
+                x_in = torch.cat([x_in, style[:, None, :].repeat(1, T, 1)], dim=-1) #[2, 1863, 864]
+
+            if class_dropout: #False
+                x_in[..., self.in_channels:] = x_in[..., self.in_channels:] * 0 # 80维后全置为0
+
+            x_in = self.cond_x_merge_linear(x_in)  # (N, T, D) [2, 1863, 512]
+
+            if self.style_as_token: # False
+                style = self.style_in(style)
+                style = torch.zeros_like(style) if class_dropout else style
+                x_in = torch.cat([style.unsqueeze(1), x_in], dim=1)
             
         if self.time_as_token: # False
             x_in = torch.cat([t1.unsqueeze(1), x_in], dim=1)
             
-        x_mask = sequence_mask(x_lens + self.style_as_token + self.time_as_token, max_length=x_in.size(1)).to(x.device).unsqueeze(1) #torch.Size([1, 1, 1863])True
+        if x_lens is None:
+            # 无填充: 不传 mask, SDPA 可以选用 fused kernel
+            x_mask = torch.ones(B, 1, x_in.size(1), dtype=torch.bool, device=x.device)
+            attn_mask = None
+        else:
+            x_mask = sequence_mask(x_lens + self.style_as_token + self.time_as_token, max_length=x_in.size(1)).to(x.device).unsqueeze(1) #torch.Size([1, 1, 1863])True
+            # 只屏蔽填充的 key, [B, 1, 1, T] 在 SDPA 内广播, 不再生成 T x T 的 mask
+            attn_mask = x_mask[:, None, :, :]
         input_pos = self.input_pos[:x_in.size(1)]  # (T,) range（0，1863）
-        x_mask_expanded = x_mask[:, None, :].repeat(1, 1, x_in.size(1), 1) if not self.is_causal else None # torch.Size([1, 1, 1863, 1863]
-        x_res = self.transformer(x_in, t1.unsqueeze(1), input_pos, x_mask_expanded) # [2, 1863, 512]
+        x_res = self.transformer(x_in, t1.unsqueeze(1), input_pos, attn_mask if not self.is_causal else None) # [2, 1863, 512]
         x_res = x_res[:, 1:] if self.time_as_token else x_res
         x_res = x_res[:, 1:] if self.style_as_token else x_res
         
@@ -246,7 +296,8 @@ class DiT(torch.nn.Module):
             x = self.conv1(x_res)
             x = x.transpose(1, 2)
             t2 = self.t_embedder2(t)
-            x = self.wavenet(x, x_mask, g=t2.unsqueeze(2)).transpose(1, 2) + self.res_projection(
+            # 填充帧 (x_lens 之后) 置零, 避免卷积把它们带入有效帧的边界
+            x = self.wavenet(x * x_mask, x_mask, g=t2.unsqueeze(2)).transpose(1, 2) + self.res_projection(
                 x_res)  # long residual connection
             x = self.final_layer(x, t1).transpose(1, 2)
             x = self.conv2(x)
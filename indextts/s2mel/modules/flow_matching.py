@@ -1,4 +1,7 @@
+import math
+import time
 from abc import ABC
+from typing import Iterable, Optional
 
 import torch
 import torch.nn.functional as F
@@ -8,6 +11,51 @@ from indextts.s2mel.modules.commons import sequence_mask
 
 from tqdm import tqdm
 
+SOLVERS = ("euler", "midpoint", "heun", "ab2", "ab3")
+SCHEDULES = ("uniform", "cosine", "sway")
+
+
+def time_schedule(n_timesteps, schedule="uniform", sway_coef=-1.0, device=None):
+    """
+    Time points 0 = t_0 < ... < t_n = 1 of the ODE solver.
+
+    Args:
+        schedule: "uniform"; "cosine", (1 - cos(pi * u)) / 2, small steps at both ends;
+            "sway", u + s * (cos(pi / 2 * u) - 1 + u) (sway sampling), s < 0 puts more steps near the noise end
+        sway_coef: s of the sway schedule, -1 gives 1 - cos(pi / 2 * u)
+    """
+    u = torch.linspace(0, 1, n_timesteps + 1, device=device)
+    if schedule == "uniform":
+        return u
+    if schedule == "cosine":
+        return (1 - torch.cos(math.pi * u)) / 2
+    if schedule == "sway":
+        return u + sway_coef * (torch.cos(math.pi / 2 * u) - 1 + u)
+    raise ValueError(f"unknown CFM schedule: {schedule}, expected one of {SCHEDULES}")
+
+
+def adams_bashforth_coefficients(ts, t_next):
+    """
+    Weights w_j of the variable-step Adams-Bashforth step x_next = x + sum_j w_j * f(ts[j]),
+    the integral over [ts[0], t_next] of the Lagrange polynomial through the nodes `ts`
+    (newest first). Exact with 2-point Gauss-Legendre quadrature up to 3 nodes.
+    """
+    t0 = ts[0]
+    h = t_next - t0
+    points = [t0 + h * (1 + g) / 2 for g in (-1 / math.sqrt(3), 1 / math.sqrt(3))]
+    weights = []
+    for j, tj in enumerate(ts):
+        w = 0.0
+        for t in points:
+            basis = 1.0
+            for k, tk in enumerate(ts):
+                if k != j:
+                    basis *= (t - tk) / (tj - tk)
+            w += basis
+        weights.append(w * h / 2)
+    return weights
+
+
 class BASECFM(torch.nn.Module, ABC):
     def __init__(
         self,
@@ -19,6 +67,10 @@ class BASECFM(torch.nn.Module, ABC):
         self.estimator = None
 
         self.in_channels = args.DiT.in_channels
+        self.content_dim = args.DiT.content_dim
+        self.style_dim = args.style_encoder.dim
+        # 推理时把序列长度补齐到该值的整数倍, None 表示不补齐 (见 enable_torch_compile)
+        self.bucket_size = None
 
         self.criterion = torch.nn.MSELoss() if args.reg_loss_type == "l2" else torch.nn.L1Loss()
 
@@ -28,7 +80,8 @@ class BASECFM(torch.nn.Module, ABC):
             self.zero_prompt_speech_token = False
 
     @torch.inference_mode()
-    def inference(self, mu, x_lens, prompt, style, f0, n_timesteps, temperature=1.0, inference_cfg_rate=0.5):
+    def inference(self, mu, x_lens, prompt, style, f0, n_timesteps, temperature=1.0, inference_cfg_rate=0.5, z=None,
+                  solver="euler", schedule="uniform", cfg_truncate_steps=0, sway_coef=-1.0):
         """Forward diffusion
 
         Args:
@@ -43,38 +96,113 @@ class BASECFM(torch.nn.Module, ABC):
             f0: None
             n_timesteps (int): number of diffusion steps
             temperature (float, optional): temperature for scaling noise. Defaults to 1.0.
+            z (torch.Tensor, optional): standard normal noise to start from instead of drawing it here
+                shape: (batch_size, in_channels, mel_timesteps)
+            solver (str): ODE solver, one of `SOLVERS`. "euler", "ab2" and "ab3" (Adams-Bashforth multistep)
+                run the estimator once per step, "midpoint" and "heun" twice.
+            schedule (str): time schedule, one of `SCHEDULES` (see `time_schedule`)
+            cfg_truncate_steps (int): run the last `cfg_truncate_steps` steps without the unconditional branch,
+                i.e. with half the estimator batch
+            sway_coef (float): coefficient of the "sway" schedule
 
         Returns:
             sample: generated mel-spectrogram
                 shape: (batch_size, 80, mel_timesteps)
         """
         B, T = mu.size(0), mu.size(1)
-        z = torch.randn([B, self.in_channels, T], device=mu.device) * temperature
-        t_span = torch.linspace(0, 1, n_timesteps + 1, device=mu.device)
-        # t_span = t_span + (-1) * (torch.cos(torch.pi / 2 * t_span) - 1 + t_span)
-        return self.solve_euler(z, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate)
+        if z is None:
+            z = torch.randn([B, self.in_channels, T], device=mu.device)
+        z = z * temperature
+        padded_len = self.bucket_length(T)
+        if padded_len > T:
+            # 补齐到桶长度, estimator 只会见到固定的几种形状; 补齐部分由 x_lens 屏蔽, 不影响有效帧
+            mu = F.pad(mu, (0, 0, 0, padded_len - T))
+            z = F.pad(z, (0, padded_len - T))
+        elif not self.bucket_size and bool((x_lens >= T).all()):
+            # 没有填充, estimator 的 attention 不需要 mask
+            x_lens = None
+        t_span = time_schedule(n_timesteps, schedule, sway_coef=sway_coef, device=mu.device)
+        return self.solve(z, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate,
+                          solver=solver, cfg_truncate_steps=cfg_truncate_steps)[..., :T]
+
+    def bucket_length(self, length: int) -> int:
+        """Sequence length the estimator runs at for `length` frames."""
+        if not self.bucket_size:
+            return length
+        return (length + self.bucket_size - 1) // self.bucket_size * self.bucket_size
+
+    @torch.inference_mode()
+    def warmup(self, lengths: Iterable[int], batch_sizes: Iterable[int] = (1,), n_timesteps: int = 1,
+               inference_cfg_rate: float = 0.7, cfg_truncate_steps: int = 0):
+        """Run the estimator once for every (batch size, bucket length) so that compilation
+        happens here instead of on the first requests.
+
+        Args:
+            lengths: mel frame counts (prompt + target) to warm up, rounded up to the bucket length
+            batch_sizes: batch sizes to warm up (doubled internally when inference_cfg_rate > 0)
+            n_timesteps: diffusion steps per warm-up call, the shapes do not depend on it
+            inference_cfg_rate: must match the value used at inference (> 0 or not)
+            cfg_truncate_steps: > 0 when inference uses CFG truncation, which also runs the estimator without
+                the unconditional half of the batch
+
+        Returns:
+            list of the warmed up (batch_size, length) shapes
+        """
+        param = next(self.parameters())
+        device = param.device
+        shapes = sorted({(b, self.bucket_length(int(n))) for b in batch_sizes for n in lengths})
+        if cfg_truncate_steps and inference_cfg_rate > 0:
+            # 至少一步带 CFG, 一步不带
+            n_timesteps, cfg_truncate_steps = max(n_timesteps, 2), 1
+        else:
+            cfg_truncate_steps = 0
+        for B, T in shapes:
+            start = time.perf_counter()
+            prompt_len = T // 2
+            self.inference(
+                torch.zeros(B, T, self.content_dim, device=device),
+                torch.full((B,), T, dtype=torch.long, device=device),
+                torch.zeros(B, self.in_channels, prompt_len, device=device),
+                torch.zeros(B, self.style_dim, device=device),
+                None,
+                n_timesteps,
+                inference_cfg_rate=inference_cfg_rate,
+                cfg_truncate_steps=cfg_truncate_steps,
+            )
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+            print(f">> s2mel warmup: batch {B}, length {T}: {time.perf_counter() - start:.2f}s")
+        return shapes
 
     def solve_euler(self, x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate=0.5):
         """
-        Fixed euler solver for ODEs.
+        Fixed euler solver for ODEs, see `solve`.
+        """
+        return self.solve(x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate, solver="euler")
+
+    def solve(self, x, x_lens, prompt, mu, style, f0, t_span, inference_cfg_rate=0.5, solver="euler",
+              cfg_truncate_steps=0, cache_condition=True):
+        """
+        Fixed-step ODE solver on the time points `t_span`.
         Args:
             x (torch.Tensor): random noise
-            t_span (torch.Tensor): n_timesteps interpolated
+            t_span (torch.Tensor): time points, 0 to 1
                 shape: (n_timesteps + 1,)
             mu (torch.Tensor): semantic info of reference audio and altered audio
                 shape: (batch_size, mel_timesteps(795+1069), 512)
             x_lens (torch.Tensor): mel frames output
-                shape: (batch_size, mel_timesteps)
+                shape: (batch_size, mel_timesteps), None when no item is padded
             prompt (torch.Tensor): reference mel
                 shape: (batch_size, 80, 795)
             style (torch.Tensor): reference global style
                 shape: (batch_size, 192)
+            solver (str): one of `SOLVERS`
+            cfg_truncate_steps (int): number of final steps without classifier-free guidance
+            cache_condition (bool): project prompt, content and style once (`DiT.prepare_condition`) instead of
+                in every estimator call
         """
-        t, _, _ = t_span[0], t_span[-1], t_span[1] - t_span[0]
-
-        # I am storing this because I can later plot it by putting a debugger here and saving it to a file
-        # Or in future might add like a return_all_steps flag
-        sol = []
+        if solver not in SOLVERS:
+            raise ValueError(f"unknown CFM solver: {solver}, expected one of {SOLVERS}")
         # apply prompt
         prompt_len = prompt.size(-1)
         prompt_x = torch.zeros_like(x)
@@ -82,37 +210,73 @@ class BASECFM(torch.nn.Module, ABC):
         x[..., :prompt_len] = 0
         if self.zero_prompt_speech_token:
             mu[..., :prompt_len] = 0
-        for step in tqdm(range(1, len(t_span))):
-            dt = t_span[step] - t_span[step - 1]
-            if inference_cfg_rate > 0:
-                # Stack original and CFG (null) inputs for batched processing
+        B = x.size(0)
+        cache_condition = cache_condition and hasattr(self.estimator, "prepare_condition")
+        if inference_cfg_rate > 0:
+            # 条件与无条件 (null) 输入拼成一个 batch, 不随步数变化的部分只拼一次
+            stacked_x_lens = torch.cat([x_lens, x_lens], dim=0) if x_lens is not None else None
+            if cache_condition:
+                stacked_cache = self.estimator.prepare_condition(prompt_x, style, mu, null_branch=True)
+            else:
                 stacked_prompt_x = torch.cat([prompt_x, torch.zeros_like(prompt_x)], dim=0)
                 stacked_style = torch.cat([style, torch.zeros_like(style)], dim=0)
                 stacked_mu = torch.cat([mu, torch.zeros_like(mu)], dim=0)
-                stacked_x = torch.cat([x, x], dim=0)
-                stacked_t = torch.cat([t.unsqueeze(0), t.unsqueeze(0)], dim=0)
+        if cache_condition:
+            if inference_cfg_rate > 0:
+                # 条件分支就是 stacked_cache 的前一半 (CFG 截断的步数使用)
+                cond_cache = {k: v[:B] if v is not None else None for k, v in stacked_cache.items()}
+            else:
+                cond_cache = self.estimator.prepare_condition(prompt_x, style, mu)
 
+        def velocity(x, t, use_cfg):
+            if use_cfg:
                 # Perform a single forward pass for both original and CFG inputs
-                stacked_dphi_dt = self.estimator(
-                    stacked_x, stacked_prompt_x, x_lens, stacked_t, stacked_style, stacked_mu,
-                )
-
-                # Split the output back into the original and CFG components
+                if cache_condition:
+                    stacked_dphi_dt = self.estimator(
+                        torch.cat([x, x], dim=0), None, stacked_x_lens, t.expand(2 * B), None, None,
+                        cond_cache=stacked_cache,
+                    )
+                else:
+                    stacked_dphi_dt = self.estimator(
+                        torch.cat([x, x], dim=0), stacked_prompt_x, stacked_x_lens, t.expand(2 * B),
+                        stacked_style, stacked_mu,
+                    )
                 dphi_dt, cfg_dphi_dt = stacked_dphi_dt.chunk(2, dim=0)
-
                 # Apply CFG formula
-                dphi_dt = (1.0 + inference_cfg_rate) * dphi_dt - inference_cfg_rate * cfg_dphi_dt
-            else:
-                dphi_dt = self.estimator(x, prompt_x, x_lens, t.unsqueeze(0), style, mu)
+                return (1.0 + inference_cfg_rate) * dphi_dt - inference_cfg_rate * cfg_dphi_dt
+            if cache_condition:
+                return self.estimator(x, None, x_lens, t.expand(B), None, None, cond_cache=cond_cache)
+            return self.estimator(x, prompt_x, x_lens, t.expand(B), style, mu)
 
-            x = x + dt * dphi_dt
-            t = t + dt
-            sol.append(x)
-            if step < len(t_span) - 1:
-                dt = t_span[step + 1] - t
+        n_steps = len(t_span) - 1
+        history = []  # (t, dphi_dt) of the previous steps, for the multistep solvers
+        for step in tqdm(range(n_steps)):
+            t, t_next = t_span[step], t_span[step + 1]
+            dt = t_next - t
+            use_cfg = inference_cfg_rate > 0 and step < n_steps - cfg_truncate_steps
+            dphi_dt = velocity(x, t, use_cfg)
+            if solver == "euler":
+                x = x + dt * dphi_dt
+            elif solver == "midpoint":
+                x_mid = x + 0.5 * dt * dphi_dt
+                x_mid[:, :, :prompt_len] = 0
+                x = x + dt * velocity(x_mid, t + 0.5 * dt, use_cfg)
+            elif solver == "heun":
+                x_pred = x + dt * dphi_dt
+                x_pred[:, :, :prompt_len] = 0
+                x = x + 0.5 * dt * (dphi_dt + velocity(x_pred, t_next, use_cfg))
+            else:
+                # Adams-Bashforth, 前几步阶数不足时自动降阶
+                order = min(int(solver[2:]), len(history) + 1)
+                history.insert(0, (float(t), dphi_dt))
+                del history[order:]
+                weights = adams_bashforth_coefficients([h[0] for h in history], float(t_next))
+                for w, (_, f) in zip(weights, history):
+                    x = x + w * f
             x[:, :, :prompt_len] = 0
 
-        return sol[-1]
+        return x
+
     def forward(self, x1, x_lens, prompt_lens, mu, style):
         """Computes diffusion loss
 
@@ -170,17 +334,27 @@ class CFM(BASECFM):
         else:
             raise NotImplementedError(f"Unknown diffusion type {args.dit_type}")
 
-    def enable_torch_compile(self):
+    def enable_torch_compile(self, bucket_size: Optional[int] = 128, mode: Optional[str] = None):
         """Enable torch.compile optimization for the estimator model.
         
         This method applies torch.compile to the estimator (DiT model) for significant
         performance improvements during inference. It also configures distributed
         training optimizations if applicable.
+
+        Args:
+            bucket_size: pad the sequence length to a multiple of this many frames and compile
+                static shapes, one graph per bucket (see `warmup`). None compiles with dynamic shapes.
+            mode: torch.compile mode, e.g. "reduce-overhead" to also capture CUDA graphs per shape.
         """
         if torch.distributed.is_initialized():
             torch._inductor.config.reorder_for_compute_comm_overlap = True
+        self.bucket_size = bucket_size
+        if bucket_size:
+            # 每个 (batch, 桶长度) 组合各编译一份, 默认的缓存上限 (8) 不够用
+            torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, 256)
         self.estimator = torch.compile(
             self.estimator, 
             fullgraph=True,
-            dynamic=True,
+            dynamic=not bucket_size,
+            mode=mode,
         )
@@ -128,10 +128,13 @@ class Transformer(nn.Module):
 
         self.freqs_cis: Optional[Tensor] = None
         self.mask_cache: Optional[Tensor] = None
+        self.causal_mask: Optional[Tensor] = None
+        self.is_causal = True
         self.max_batch_size = -1
         self.max_seq_length = -1
 
-    def setup_caches(self, max_batch_size, max_seq_length, use_kv_cache=True):
+    def setup_caches(self, max_batch_size, max_seq_length, use_kv_cache=True, is_causal=True):
+        self.is_causal = is_causal
         if self.max_seq_length >= max_seq_length and self.max_batch_size >= max_batch_size:
             return
         head_dim = self.config.dim // self.config.n_head
@@ -147,7 +150,8 @@ class Transformer(nn.Module):
 
         self.freqs_cis = precompute_freqs_cis(self.config.block_size, self.config.head_dim,
                                               self.config.rope_base, dtype).to(device)
-        self.causal_mask = torch.tril(torch.ones(self.max_seq_length, self.max_seq_length, dtype=torch.bool)).to(device)
+        # max_seq_length x max_seq_length, built on first use (see get_causal_mask)
+        self.causal_mask = None
         self.use_kv_cache = use_kv_cache
         self.uvit_skip_connection = self.config.uvit_skip_connection
         if self.uvit_skip_connection:
@@ -167,11 +171,13 @@ class Transformer(nn.Module):
                 cross_attention_mask: Optional[Tensor] = None,
                 ) -> Tensor:
         assert self.freqs_cis is not None, "Caches must be initialized first"
-        if mask is None: # in case of non-causal model
+        # non-causal model: mask None attends everywhere, otherwise it is a key padding mask [B, 1, 1, T]
+        if mask is None and self.is_causal:
+            causal_mask = self.get_causal_mask()
             if not self.training and self.use_kv_cache:
-                mask = self.causal_mask[None, None, input_pos]
+                mask = causal_mask[None, None, input_pos]
             else:
-                mask = self.causal_mask[None, None, input_pos]
+                mask = causal_mask[None, None, input_pos]
                 mask = mask[..., input_pos]
         freqs_cis = self.freqs_cis[input_pos]
         if context is not None:
@@ -190,6 +196,12 @@ class Transformer(nn.Module):
         x = self.norm(x, c)
         return x
 
+    def get_causal_mask(self) -> Tensor:
+        if self.causal_mask is None:
+            device = self.norm.project_layer.weight.device
+            self.causal_mask = torch.tril(torch.ones(self.max_seq_length, self.max_seq_length, dtype=torch.bool, device=device))
+        return self.causal_mask
+
     @classmethod
     def from_name(cls, name: str):
         return cls(ModelArgs.from_name(name))
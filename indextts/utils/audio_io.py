@@ -0,0 +1,102 @@
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+import torch
+import torchaudio
+
+from indextts.utils.prompt_cache import audio_content_key
+
+
+@lru_cache(maxsize=16)
+def get_resampler(orig_freq, new_freq):
+    """
+    Shared `torchaudio.transforms.Resample` per (orig_freq, new_freq), the sinc kernel is built once.
+    """
+    return torchaudio.transforms.Resample(orig_freq, new_freq)
+
+
+def resample(audio, orig_freq, new_freq):
+    """
+    Resample `audio` [..., samples] with a cached kernel.
+    """
+    if orig_freq == new_freq:
+        return audio
+    return get_resampler(int(orig_freq), int(new_freq))(audio)
+
+
+def decode_audio(audio_path, max_seconds=None):
+    """
+    Decode an audio file once at its native sample rate, downmixed to mono and truncated to
+    `max_seconds` before any resampling.
+    Uses soundfile, falls back to librosa (audioread/ffmpeg) for formats libsndfile cannot read.
+
+    Returns:
+        (audio [1, samples] float32 tensor, sample_rate)
+    """
+    try:
+        import soundfile
+        frames = -1
+        if max_seconds is not None:
+            frames = int(max_seconds * soundfile.info(audio_path).samplerate)
+        audio, sr = soundfile.read(audio_path, frames=frames, dtype="float32", always_2d=True)
+        audio = audio.mean(axis=1)
+    except Exception:
+        import librosa
+        audio, sr = librosa.load(audio_path, sr=None, mono=True, duration=max_seconds)
+    if max_seconds is not None:
+        audio = audio[:int(max_seconds * sr)]
+    return torch.from_numpy(np.ascontiguousarray(audio, dtype=np.float32)).unsqueeze(0), sr
+
+
+class PromptAudio:
+    """
+    A prompt recording decoded once, handing out each sample rate it is needed at.
+    Resampled versions are computed on first use and kept.
+    """
+
+    def __init__(self, audio, sample_rate):
+        self.sample_rate = sample_rate
+        self._rates = {sample_rate: audio}
+
+    @property
+    def num_samples(self):
+        return self._rates[self.sample_rate].shape[-1]
+
+    def at(self, sample_rate):
+        """
+        Waveform [1, samples] at `sample_rate`.
+        """
+        audio = self._rates.get(sample_rate)
+        if audio is None:
+            audio = resample(self._rates[self.sample_rate], self.sample_rate, sample_rate)
+            self._rates[sample_rate] = audio
+        return audio
+
+
+_recent_prompts = OrderedDict()
+_recent_lock = threading.Lock()
+_RECENT_SIZE = 4
+
+
+def load_prompt_audio(audio_path, max_seconds=None, verbose=False):
+    """
+    `PromptAudio` of a file, so the speaker and emotion conditioning of the same recording
+    share one decode and one resample per rate. The last few files are kept by content hash.
+    """
+    key = (audio_content_key(audio_path), max_seconds)
+    with _recent_lock:
+        prompt = _recent_prompts.get(key)
+        if prompt is not None:
+            _recent_prompts.move_to_end(key)
+            return prompt
+    audio, sr = decode_audio(audio_path, max_seconds)
+    if verbose:
+        print(f">> prompt audio decoded: {audio_path}, {audio.shape[-1]} samples at {sr} Hz")
+    prompt = PromptAudio(audio, sr)
+    with _recent_lock:
+        _recent_prompts[key] = prompt
+        while len(_recent_prompts) > _RECENT_SIZE:
+            _recent_prompts.popitem(last=False)
+    return prompt
@@ -32,3 +32,182 @@ def load_checkpoint(model: torch.nn.Module, model_pth: str) -> dict:
         with open(info_path, 'r') as fin:
             configs = yaml.load(fin, Loader=yaml.FullLoader)
     return configs
+
+
+# safetensors checkpoint bundle, see tools/convert_to_safetensors.py
+BUNDLE_MANIFEST = "bundle.json"
+
+_SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def save_safetensors_shards(state_dict: dict, out_dir: str, name: str, dtype=None,
+                            max_shard_size=2 << 30) -> list:
+    """
+    Save `state_dict` as `{name}.safetensors`, or `{name}-0000i-of-0000n.safetensors` shards of at
+    most `max_shard_size` bytes. Floating point tensors are cast to `dtype` when it is given.
+
+    Returns:
+        the file names, relative to `out_dir`
+    """
+    from safetensors.torch import save_file
+
+    tensors = OrderedDict()
+    storages = set()
+    for k, v in state_dict.items():
+        if not isinstance(v, torch.Tensor):
+            continue
+        v = v.detach().cpu()
+        if dtype is not None and v.is_floating_point():
+            v = v.to(dtype)
+        v = v.contiguous()
+        # safetensors 不能保存共享存储的张量 (如 tied embedding), 共享的副本单独复制一份
+        ptr = v.untyped_storage().data_ptr()
+        if ptr in storages:
+            v = v.clone()
+        storages.add(v.untyped_storage().data_ptr())
+        tensors[k] = v
+
+    shards, shard, size = [], OrderedDict(), 0
+    for k, v in tensors.items():
+        nbytes = v.numel() * v.element_size()
+        if shard and size + nbytes > max_shard_size:
+            shards.append(shard)
+            shard, size = OrderedDict(), 0
+        shard[k] = v
+        size += nbytes
+    if shard or not shards:
+        shards.append(shard)
+
+    files = []
+    for i, shard in enumerate(shards):
+        if len(shards) == 1:
+            file_name = f"{name}.safetensors"
+        else:
+            file_name = f"{name}-{i + 1:05d}-of-{len(shards):05d}.safetensors"
+        save_file(shard, os.path.join(out_dir, file_name), metadata={"format": "pt"})
+        files.append(file_name)
+    return files
+
+
+def mmap_safetensors(path: str) -> dict:
+    """
+    Open a safetensors file as a memory map. The returned CPU tensors are views of the mapped file,
+    nothing is read until a tensor is used, and processes mapping the same file share the page cache.
+    """
+    import json
+    import struct
+
+    with open(path, 'rb') as fin:
+        header_len = struct.unpack('<Q', fin.read(8))[0]
+        header = json.loads(fin.read(header_len))
+    file_size = os.path.getsize(path)
+    data_start = 8 + header_len
+    # MAP_PRIVATE: 只读共享页缓存, 写入时才复制, 不会改动文件
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=file_size)
+    state_dict = OrderedDict()
+    for k, info in header.items():
+        if k == "__metadata__":
+            continue
+        dtype = _SAFETENSORS_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        begin += data_start
+        itemsize = torch.empty(0, dtype=dtype).element_size()
+        if begin % itemsize:
+            # 未对齐的张量无法直接作为视图, 复制一份
+            raw = torch.empty(0, dtype=torch.uint8).set_(storage, begin, (data_start + end - begin,))
+            state_dict[k] = raw.clone().view(dtype).reshape(info["shape"])
+            continue
+        tensor = torch.empty(0, dtype=dtype)
+        tensor.set_(storage, begin // itemsize, tuple(info["shape"]))
+        state_dict[k] = tensor
+    return state_dict
+
+
+def load_state_dict_mmap(model: torch.nn.Module, state_dict: dict, strict: bool = True):
+    """
+    `load_state_dict` that keeps the memory-mapped tensors instead of copying them into the
+    parameters (`assign=True`), when they already have the dtype of the model.
+
+    With `strict=False`, keys with a shape different from the model are skipped with a warning,
+    like `load_checkpoint2`.
+    """
+    model_state = model.state_dict()
+    shared = len({v.untyped_storage().data_ptr() for v in model_state.values()}) < len(model_state)
+    filtered = OrderedDict()
+    for k, v in state_dict.items():
+        if k not in model_state:
+            filtered[k] = v
+            continue
+        target = model_state[k]
+        if target.shape != v.shape:
+            if strict:
+                raise RuntimeError(f"{k}: shape {tuple(v.shape)} in checkpoint, {tuple(target.shape)} in model")
+            logging.warning(f"{k}: shape {tuple(v.shape)} in checkpoint, {tuple(target.shape)} in model, skipped")
+            continue
+        if v.dtype != target.dtype:
+            v = v.to(target.dtype)
+        filtered[k] = v
+    # 共享参数 (如 tied embedding) 用 assign 会断开共享, 这种情况下拷贝进已有参数
+    return model.load_state_dict(filtered, strict=strict, assign=not shared)
+
+
+class CheckpointBundle:
+    """
+    A directory of safetensors files written by `tools/convert_to_safetensors.py`, described by
+    `bundle.json`: `{"dtype": ..., "components": {name: [files]}, "files": {name: file}}`.
+    """
+
+    def __init__(self, bundle_dir: str):
+        import json
+
+        self.bundle_dir = bundle_dir
+        with open(os.path.join(bundle_dir, BUNDLE_MANIFEST), 'r', encoding='utf-8') as fin:
+            self.manifest = json.load(fin)
+        self.components = self.manifest.get("components", {})
+
+    @classmethod
+    def find(cls, model_dir: str):
+        """
+        The bundle of `model_dir`, or None when it has not been converted.
+        """
+        if model_dir and os.path.exists(os.path.join(model_dir, BUNDLE_MANIFEST)):
+            return cls(model_dir)
+        return None
+
+    @property
+    def dtype(self):
+        dtype = self.manifest.get("dtype")
+        return getattr(torch, dtype) if dtype else None
+
+    def has(self, name: str) -> bool:
+        return name in self.components
+
+    def path(self, file_name: str) -> str:
+        return os.path.join(self.bundle_dir, file_name)
+
+    def file(self, name: str) -> str:
+        """
+        Path of a non-tensor file of the bundle, e.g. the BigVGAN `config.json`.
+        """
+        return self.path(self.manifest["files"][name])
+
+    def state_dict(self, name: str) -> dict:
+        state_dict = OrderedDict()
+        for file_name in self.components[name]:
+            state_dict.update(mmap_safetensors(self.path(file_name)))
+        return state_dict
+
+    def load_into(self, model: torch.nn.Module, name: str, strict: bool = True):
+        load_state_dict_mmap(model, self.state_dict(name), strict=strict)
+        return model
@@ -48,3 +48,104 @@ class MelSpectrogramFeatures(FeatureExtractor):
         mel = self.mel_spec(audio)
         mel = safe_log(mel)
         return mel
+
+
+def _kaldi_hertz_to_mel(freq):
+    return 1127.0 * torch.log(1.0 + freq / 700.0)
+
+
+def kaldi_mel_filters(num_mel_bins=80, fft_length=512, sample_rate=16000, min_frequency=20.0):
+    """
+    Kaldi mel filter bank (triangles in mel space) of shape (fft_length // 2 + 1, num_mel_bins),
+    same values as `transformers.audio_utils.mel_filter_bank(..., mel_scale="kaldi",
+    triangularize_in_mel_space=True)` padded with a zero row for the Nyquist bin.
+    """
+    num_frequency_bins = fft_length // 2
+    mel_min = _kaldi_hertz_to_mel(torch.tensor(min_frequency, dtype=torch.float64))
+    mel_max = _kaldi_hertz_to_mel(torch.tensor(float(sample_rate // 2), dtype=torch.float64))
+    mel_freqs = torch.linspace(mel_min.item(), mel_max.item(), num_mel_bins + 2, dtype=torch.float64)
+    fft_bin_width = sample_rate / fft_length
+    fft_freqs = _kaldi_hertz_to_mel(fft_bin_width * torch.arange(num_frequency_bins, dtype=torch.float64))
+    filter_diff = torch.diff(mel_freqs)
+    slopes = mel_freqs.unsqueeze(0) - fft_freqs.unsqueeze(1)
+    down_slopes = -slopes[:, :-2] / filter_diff[:-1]
+    up_slopes = slopes[:, 2:] / filter_diff[1:]
+    filters = torch.clamp(torch.minimum(down_slopes, up_slopes), min=0.0)
+    return torch.nn.functional.pad(filters, (0, 0, 0, 1))
+
+
+class SeamlessM4TFeatures(nn.Module):
+    """
+    Torch port of `transformers.SeamlessM4TFeatureExtractor` (w2v-BERT 2.0 input features) that runs
+    on the module's device and on a padded batch:
+    kaldi-style fbank (povey window, DC removal, pre-emphasis) -> per-utterance mean/variance
+    normalization over each mel bin -> stacking of `stride` consecutive frames.
+    """
+
+    def __init__(self, sample_rate=16000, num_mel_bins=80, stride=2, frame_length=400, hop_length=160,
+                 fft_length=512, preemphasis=0.97, mel_floor=1.192092955078125e-07):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.num_mel_bins = num_mel_bins
+        self.stride = stride
+        self.frame_length = frame_length
+        self.hop_length = hop_length
+        self.fft_length = fft_length
+        self.preemphasis = preemphasis
+        self.mel_floor = mel_floor
+        # povey window: hann (non periodic) ** 0.85
+        window = torch.hann_window(frame_length, periodic=False, dtype=torch.float64).pow(0.85)
+        self.register_buffer("window", window.float(), persistent=False)
+        self.register_buffer("mel_filters", kaldi_mel_filters(num_mel_bins, fft_length, sample_rate).float(),
+                             persistent=False)
+
+    def num_frames(self, num_samples):
+        return torch.clamp(torch.div(num_samples - self.frame_length, self.hop_length, rounding_mode="floor") + 1,
+                           min=0)
+
+    @torch.no_grad()
+    def forward(self, waveforms, lengths=None):
+        """
+        Args:
+            waveforms: [B, samples] (or [samples]) float waveforms at `sample_rate`, right padded
+            lengths: [B] valid samples of every waveform, None when unpadded
+        Returns:
+            input_features: [B, frames // stride, num_mel_bins * stride]
+            attention_mask: [B, frames // stride] (long)
+        """
+        if waveforms.dim() == 1:
+            waveforms = waveforms.unsqueeze(0)
+        device = self.window.device
+        waveforms = waveforms.to(device=device, dtype=torch.float32)
+        batch_size, num_samples = waveforms.shape
+        if lengths is None:
+            lengths = torch.full((batch_size,), num_samples, dtype=torch.long, device=device)
+        else:
+            lengths = torch.as_tensor(lengths, dtype=torch.long, device=device)
+        # 与 Kaldi 一致, 按 16-bit 整数幅度计算
+        frames = (waveforms * 32768.0).unfold(-1, self.frame_length, self.hop_length)  # [B, F, frame_length]
+        frames = frames - frames.mean(dim=-1, keepdim=True)
+        frames = torch.cat([frames[..., :1] * (1.0 - self.preemphasis),
+                            frames[..., 1:] - self.preemphasis * frames[..., :-1]], dim=-1)
+        frames = frames * self.window
+        power = torch.fft.rfft(frames, n=self.fft_length).abs().pow(2)  # [B, F, fft_length // 2 + 1]
+        features = torch.clamp(power @ self.mel_filters, min=self.mel_floor).log()  # [B, F, num_mel_bins]
+
+        # 每条语音在自己的有效帧上做归一化 (方差为无偏估计, 与 HF 的 ddof=1 一致)
+        num_frames = features.size(1)
+        valid_frames = self.num_frames(lengths)
+        frame_mask = torch.arange(num_frames, device=device).unsqueeze(0) < valid_frames.unsqueeze(1)
+        mask = frame_mask.unsqueeze(-1).to(features.dtype)
+        count = valid_frames.to(features.dtype).view(-1, 1, 1)
+        mean = (features * mask).sum(dim=1, keepdim=True) / count
+        var = ((features - mean).pow(2) * mask).sum(dim=1, keepdim=True) / (count - 1)
+        features = (features - mean) / torch.sqrt(var + 1e-7) * mask
+
+        # 补齐到 stride 的整数倍后, 相邻 stride 帧拼接为一帧
+        remainder = num_frames % self.stride
+        if remainder:
+            features = torch.nn.functional.pad(features, (0, 0, 0, self.stride - remainder))
+            frame_mask = torch.nn.functional.pad(frame_mask, (0, self.stride - remainder))
+        input_features = features.reshape(batch_size, -1, self.num_mel_bins * self.stride)
+        attention_mask = frame_mask[:, self.stride - 1::self.stride].long()
+        return input_features, attention_mask
@@ -3,7 +3,7 @@ from functools import lru_cache
 import os
 import traceback
 import re
-from typing import List, Union, overload
+from typing import Iterable, Iterator, List, Union, overload
 import warnings
 from indextts.utils.common import tokenize_by_CJK_char, de_tokenized_by_CJK_char
 from sentencepiece import SentencePieceProcessor
@@ -519,75 +519,103 @@ class TextTokenizer:
         """
         将tokenize后的结果按特定token进一步分割
         """
-        # 处理特殊情况
-        if len(tokenized_str) == 0:
-            return []
-        segments: List[List[str]] = []
-        current_segment = []
-        current_segment_tokens_len = 0
-        for i in range(len(tokenized_str)):
-            token = tokenized_str[i]
-            current_segment.append(token)
-            current_segment_tokens_len += 1
-            if not  ("," in split_tokens or "▁," in split_tokens ) and ("," in current_segment or "▁," in current_segment): 
-                # 如果当前tokens中有,，则按,分割
-                sub_segments = TextTokenizer.split_segments_by_token(
-                    current_segment, [",", "▁,"], max_text_tokens_per_segment=max_text_tokens_per_segment, quick_streaming_tokens = quick_streaming_tokens
-                )
-            elif "-" not in split_tokens and "-" in current_segment:
-                # 没有,，则按-分割
-                sub_segments = TextTokenizer.split_segments_by_token(
-                    current_segment, ["-"], max_text_tokens_per_segment=max_text_tokens_per_segment, quick_streaming_tokens = quick_streaming_tokens
-                )
-            elif current_segment_tokens_len <= max_text_tokens_per_segment:
-                if token in split_tokens and current_segment_tokens_len > 2:
-                    if i < len(tokenized_str) - 1:
-                        if tokenized_str[i + 1] in ["'", "▁'"]:
-                            # 后续token是'，则不切分
-                            current_segment.append(tokenized_str[i + 1])
-                            i += 1
-                    segments.append(current_segment)
-                    current_segment = []
-                    current_segment_tokens_len = 0
-                continue
-            # 如果当前tokens的长度超过最大限制
-            else:
-                # 按照长度分割
-                sub_segments = []
-                for j in range(0, len(current_segment), max_text_tokens_per_segment):
-                    if j + max_text_tokens_per_segment < len(current_segment):
-                        sub_segments.append(current_segment[j : j + max_text_tokens_per_segment])
-                    else:
-                        sub_segments.append(current_segment[j:])
-                warnings.warn(
-                    f"The tokens length of segment exceeds limit: {max_text_tokens_per_segment}, "
-                    f"Tokens in segment: {current_segment}."
-                    "Maybe unexpected behavior",
-                    RuntimeWarning,
-                )
-            segments.extend(sub_segments)
-            current_segment = []
-            current_segment_tokens_len = 0
-        if current_segment_tokens_len > 0:
-            assert current_segment_tokens_len <= max_text_tokens_per_segment
-            segments.append(current_segment)
+        return list(TextTokenizer.iter_segments_by_token(
+            tokenized_str, split_tokens, max_text_tokens_per_segment, quick_streaming_tokens=quick_streaming_tokens
+        ))
+
+    @staticmethod
+    def iter_segments_by_token(
+        tokens: Iterable[str],
+        split_tokens: List[str],
+        max_text_tokens_per_segment: int,
+        quick_streaming_tokens: int = 0
+    ) -> Iterator[List[str]]:
+        """
+        单遍分句, 线性时间: 可以输入 token 迭代器, 每个分句确定后立即产出.
+        规则与原先的递归实现相同:
+            - 遇到 , (若 , 不是分割 token) 或 - (若 - 不是分割 token) 时, 当前句按它们再分割
+            - 遇到分割 token 且当前句超过 2 个 token 时切分, 后续的 ' 同时加入当前句
+            - 超过 max_text_tokens_per_segment 时按长度切分
+            - 相邻的句子合并后不超过最大长度且此前 token 总数超过 quick_streaming_tokens, 或不超过最大长度的一半, 则合并
+        """
+        max_len = max_text_tokens_per_segment
+        split_set = set(split_tokens)
+        split_by_comma = not ("," in split_set or "▁," in split_set)
+        split_by_dash = "-" not in split_set
+        tokens = iter(tokens)
+        end = object()
+
+        def raw_segments():
+            current = []
+            # 代替对 current 的 "," in / "-" in 扫描
+            has_comma = has_dash = False
+            lookahead = end
+            while True:
+                if lookahead is not end:
+                    token, lookahead = lookahead, end
+                else:
+                    token = next(tokens, end)
+                    if token is end:
+                        break
+                current.append(token)
+                has_comma = has_comma or token == "," or token == "▁,"
+                has_dash = has_dash or token == "-"
+                if split_by_comma and has_comma:
+                    # 如果当前tokens中有,，则按,分割
+                    sub_segments = TextTokenizer.iter_segments_by_token(
+                        current, [",", "▁,"], max_len, quick_streaming_tokens=quick_streaming_tokens
+                    )
+                elif split_by_dash and has_dash:
+                    # 没有,，则按-分割
+                    sub_segments = TextTokenizer.iter_segments_by_token(
+                        current, ["-"], max_len, quick_streaming_tokens=quick_streaming_tokens
+                    )
+                elif len(current) <= max_len:
+                    if token in split_set and len(current) > 2:
+                        lookahead = next(tokens, end)
+                        if lookahead == "'" or lookahead == "▁'":
+                            # 后续token是'，也加入当前句 (并照常作为下一句的第一个token)
+                            current.append(lookahead)
+                        yield current
+                        current = []
+                        has_comma = has_dash = False
+                    continue
+                # 如果当前tokens的长度超过最大限制
+                else:
+                    # 按照长度分割
+                    sub_segments = [current[j:j + max_len] for j in range(0, len(current), max_len)]
+                    warnings.warn(
+                        f"The tokens length of segment exceeds limit: {max_len}, "
+                        f"Tokens in segment: {current}."
+                        "Maybe unexpected behavior",
+                        RuntimeWarning,
+                    )
+                yield from sub_segments
+                current = []
+                has_comma = has_dash = False
+            if current:
+                assert len(current) <= max_len
+                yield current
+
         # 如果相邻的句子加起来长度小于最大限制，且此前token总数超过quick_streaming_tokens，则合并
-        merged_segments = []
+        merged = None
         total_token = 0
-        for segment in segments:
+        for segment in raw_segments():
             total_token += len(segment)
             if len(segment) == 0:
                 continue
-            if len(merged_segments) == 0:
-                merged_segments.append(segment)
-            elif len(merged_segments[-1]) + len(segment) <= max_text_tokens_per_segment and total_token > quick_streaming_tokens:
-                merged_segments[-1] = merged_segments[-1] + segment
+            if merged is None:
+                merged = list(segment)
+            elif len(merged) + len(segment) <= max_len and total_token > quick_streaming_tokens:
+                merged.extend(segment)
             # 或小于最大长度限制的一半，则合并
-            elif len(merged_segments[-1]) + len(segment) <= max_text_tokens_per_segment / 2:
-                merged_segments[-1] = merged_segments[-1] + segment
+            elif len(merged) + len(segment) <= max_len / 2:
+                merged.extend(segment)
             else:
-                merged_segments.append(segment)
-        return merged_segments
+                yield merged
+                merged = list(segment)
+        if merged is not None:
+            yield merged
 
     punctuation_marks_tokens = [
         ".",
@@ -603,6 +631,14 @@ class TextTokenizer:
             tokenized, self.punctuation_marks_tokens, max_text_tokens_per_segment=max_text_tokens_per_segment, quick_streaming_tokens = quick_streaming_tokens
         )
 
+    def iter_segments(self, tokenized: Iterable[str], max_text_tokens_per_segment=120, quick_streaming_tokens = 0) -> Iterator[List[str]]:
+        """
+        与 split_segments 相同, 但逐个产出分句, 可以输入 token 迭代器 (例如逐段 tokenize 的长文档)
+        """
+        return TextTokenizer.iter_segments_by_token(
+            tokenized, self.punctuation_marks_tokens, max_text_tokens_per_segment=max_text_tokens_per_segment, quick_streaming_tokens = quick_streaming_tokens
+        )
+
 
 if __name__ == "__main__":
     # 测试程序
@@ -1,5 +1,4 @@
 import torch
-import librosa
 import json5
 from huggingface_hub import hf_hub_download
 from transformers import SeamlessM4TFeatureExtractor, Wav2Vec2BertModel
@@ -84,12 +83,54 @@ class JsonHParams:
         return self.__dict__.__repr__()
 
 
-def build_semantic_model(path_='./models/tts/maskgct/ckpt/wav2vec2bert_stats.pt'):
+class SemanticEncoder(torch.nn.Module):
+    """
+    Inference-only w2v-BERT encoder that stops at `output_layer`.
+
+    Equivalent to `model(..., output_hidden_states=True).hidden_states[output_layer]` normalized by the
+    w2v-BERT statistics, but the encoder layers after `output_layer` are dropped, so they are neither
+    executed nor kept in memory, and the intermediate hidden states are not collected.
+    """
+
+    def __init__(self, model: Wav2Vec2BertModel, semantic_mean, semantic_std, output_layer=17):
+        super().__init__()
+        config = model.config
+        # hidden_states[i] 是第 i 层 encoder 的输出, 只有 encoder 之后没有 adapter 时 last_hidden_state 才等价
+        assert not config.add_adapter and not getattr(config, "use_intermediate_ffn_before_adapter", False), \
+            "SemanticEncoder does not support w2v-BERT models with an adapter"
+        assert 0 < output_layer <= len(model.encoder.layers), f"invalid output_layer: {output_layer}"
+        model.encoder.layers = model.encoder.layers[:output_layer]
+        config.num_hidden_layers = output_layer
+        self.model = model.eval()
+        self.output_layer = output_layer
+        self.register_buffer("semantic_mean", semantic_mean.clone(), persistent=False)
+        self.register_buffer("semantic_std", semantic_std.clone(), persistent=False)
+
+    @torch.no_grad()
+    def forward(self, input_features, attention_mask=None):
+        feat = self.model(
+            input_features=input_features,
+            attention_mask=attention_mask,
+        ).last_hidden_state  # (B, T, C)
+        return (feat - self.semantic_mean.to(feat)) / self.semantic_std.to(feat)
+
+
+def build_semantic_model(path_='./models/tts/maskgct/ckpt/wav2vec2bert_stats.pt', output_layer=None):
+    """
+    Args:
+        path_: w2v-BERT mean/var statistics, a file or an already loaded {"mean", "var"} dict
+        output_layer: when set, the model is a `SemanticEncoder` truncated after this layer that
+            directly returns the normalized features of that layer
+    Returns:
+        (semantic_model, semantic_mean, semantic_std)
+    """
     semantic_model = Wav2Vec2BertModel.from_pretrained("facebook/w2v-bert-2.0")
     semantic_model.eval()
-    stat_mean_var = torch.load(path_)
+    stat_mean_var = path_ if isinstance(path_, dict) else torch.load(path_)
     semantic_mean = stat_mean_var["mean"]
     semantic_std = torch.sqrt(stat_mean_var["var"])
+    if output_layer is not None:
+        semantic_model = SemanticEncoder(semantic_model, semantic_mean, semantic_std, output_layer=output_layer)
     return semantic_model, semantic_mean, semantic_std
 
 
@@ -140,6 +181,9 @@ class Inference_Pipeline():
 
     @torch.no_grad()
     def get_emb(self, input_features, attention_mask):
+        if isinstance(self.semantic_model, SemanticEncoder):
+            assert self.semantic_model.output_layer == 17
+            return self.semantic_model(input_features, attention_mask)
         vq_emb = self.semantic_model(
             input_features=input_features,
             attention_mask=attention_mask,
@@ -222,6 +266,7 @@ class Inference_Pipeline():
         cfg_s2a=2.5,
         rescale_cfg_s2a=0.75,
     ):
+        import librosa
         speech = librosa.load(prompt_speech_path, sr=24000)[0]
         acoustic_code = self.extract_acoustic_code(
             torch.tensor(speech).unsqueeze(0).to(combine_semantic_code.device)
@@ -242,6 +287,7 @@ class Inference_Pipeline():
         prompt_speech_path,
         combine_semantic_code,
     ):
+        import librosa
         speech = librosa.load(prompt_speech_path, sr=24000)[0]
         '''
         acoustic_code = self.extract_acoustic_code(
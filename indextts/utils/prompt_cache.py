@@ -0,0 +1,148 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+def hash_audio_file(audio_path, chunk_size=1 << 20):
+    """
+    Content hash of an audio file, so the same recording reached through different
+    paths (or re-uploaded by a web client under a new temp name) shares cache entries.
+    """
+    h = hashlib.sha1()
+    with open(audio_path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+_file_hash_memo = {}
+
+
+def audio_content_key(audio_path):
+    """
+    Cached `hash_audio_file`, re-hashing only when the file's size or mtime changes.
+    """
+    st = os.stat(audio_path)
+    memo_key = (os.path.abspath(audio_path), st.st_size, st.st_mtime_ns)
+    digest = _file_hash_memo.get(memo_key)
+    if digest is None:
+        digest = hash_audio_file(audio_path)
+        if len(_file_hash_memo) > 4096:
+            _file_hash_memo.clear()
+        _file_hash_memo[memo_key] = digest
+    return digest
+
+
+def bundle_nbytes(bundle):
+    """
+    Size in bytes of all tensors in a conditioning bundle (a dict of tensors).
+    """
+    total = 0
+    for value in bundle.values():
+        if isinstance(value, torch.Tensor):
+            total += value.numel() * value.element_size()
+    return total
+
+
+class PromptCache:
+    """
+    Bounded LRU cache of per-prompt conditioning bundles.
+
+    Keys are tuples like ("spk", <content hash>), values are dicts of tensors
+    (e.g. spk_cond_emb, style, prompt_condition, ref_mel). Entries are evicted in
+    least-recently-used order once `max_entries` or `max_bytes` is exceeded.
+    """
+
+    def __init__(self, max_entries=32, max_bytes=None):
+        """
+        Args:
+            max_entries (int): maximum number of cached bundles, 0 disables the cache.
+            max_bytes (None | int): maximum total tensor bytes held, None for no limit.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes = {}
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        with self._lock:
+            bundle = self._entries.get(key)
+            if bundle is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return bundle
+
+    def peek(self, key):
+        """
+        Cached bundle or None, without touching the LRU order or the hit/miss counters.
+        """
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key, bundle):
+        if self.max_entries <= 0:
+            return
+        nbytes = bundle_nbytes(bundle)
+        if self.max_bytes is not None and nbytes > self.max_bytes:
+            # a single bundle larger than the whole budget is never cached
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = bundle
+            self._nbytes[key] = nbytes
+            self.total_bytes += nbytes
+            while len(self._entries) > self.max_entries or (
+                    self.max_bytes is not None and self.total_bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def evict(self, key):
+        """
+        Drop a single entry, returns True if it was cached.
+        """
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._remove(key)
+            self.evictions += 1
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _remove(self, key):
+        del self._entries[key]
+        self.total_bytes -= self._nbytes.pop(key)
@@ -0,0 +1,188 @@
+import queue
+import threading
+from typing import Callable, List, Optional
+
+import torch
+
+
+def mel_frames_for_codes(num_codes, ratio=1.72):
+    """
+    Mel frames of the first `num_codes` codes, `(code_lens * 1.72).long()` as in `infer_generator`
+    (float32 product, so windows add up to exactly the non-streaming length).
+    """
+    return int((torch.tensor([num_codes], dtype=torch.long) * ratio).long())
+
+
+class StreamCancelled(Exception):
+    """
+    Raised from a streamer to abort the `generate()` call that feeds it.
+    """
+
+
+class MelCodeStreamer:
+    """
+    HF-style streamer (`put` / `end`) forwarding the codes of one generated sequence, together with
+    their GPT latents, into a queue as `(tag, code, latent)` items, and `(tag, None, None)` at the end.
+    Codes from the stop token on are dropped.
+
+    The latent of a step comes from `put_latent()` (accel engine) or, when it was not called,
+    from the last entry of `latent_source()` (`GPT2InferenceModel.captured_latents`).
+
+    With a `stop_event`, the queue may be bounded: a full queue blocks until the consumer catches up,
+    and once the event is set, `put()` / `end()` raise `StreamCancelled` to stop the generation.
+    """
+
+    def __init__(self, out_queue: queue.Queue, tag=None, stop_token=None,
+                 latent_source: Optional[Callable[[], List[torch.Tensor]]] = None,
+                 stop_event: Optional[threading.Event] = None):
+        self.queue = out_queue
+        self.tag = tag
+        self.stop_token = stop_token
+        self.latent_source = latent_source
+        self.stop_event = stop_event
+        self._prompt_seen = False
+        self._stopped = False
+        self._latent = None
+
+    def put_latent(self, latent):
+        self._latent = latent
+
+    def _emit(self, item):
+        if self.stop_event is None:
+            self.queue.put(item)
+            return
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        raise StreamCancelled()
+
+    def put(self, value):
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise StreamCancelled()
+        if not self._prompt_seen:
+            # the first put is the prompt
+            self._prompt_seen = True
+            return
+        latent, self._latent = self._latent, None
+        if self._stopped:
+            return
+        code = int(value.reshape(-1)[0])
+        if code == self.stop_token:
+            self._stopped = True
+            return
+        if latent is None and self.latent_source is not None:
+            latent = self.latent_source()[-1]
+        self._emit((self.tag, code, latent[0] if latent is not None else None))
+
+    def end(self):
+        self._emit((self.tag, None, None))
+
+
+class MelWindowMerger:
+    """
+    Joins mel windows that are generated independently but overlap, e.g. by CFM on overlapping code windows.
+
+    The last `hold_frames` frames of a window are kept back. The next window regenerates them, and the
+    two versions are linearly crossfaded before they are released.
+    """
+
+    def __init__(self, hold_frames=16):
+        self.hold_frames = hold_frames
+        self.done = 0  # 已输出的 mel 帧数
+        self.pending = None
+
+    def push(self, mel, start, final=False):
+        """
+        Args:
+            mel: [1, C, T] window covering the mel frames [start, start + T), start <= self.done
+            final: the window reaches the end of the utterance, release everything
+        Returns:
+            [1, C, n] newly finished frames, starting at the previous `self.done`
+        """
+        assert start <= self.done, f"window starts at frame {start}, after the released frames ({self.done})"
+        mel = mel[..., self.done - start:]
+        if self.pending is not None and self.pending.size(-1) > 0:
+            n = min(self.pending.size(-1), mel.size(-1))
+            fade_in = torch.linspace(0, 1, n + 2, device=mel.device, dtype=mel.dtype)[1:-1]
+            mel = mel.clone()
+            mel[..., :n] = self.pending[..., :n] * (1 - fade_in) + mel[..., :n] * fade_in
+        end = mel.size(-1) if final else max(0, mel.size(-1) - self.hold_frames)
+        self.pending = None if final else mel[..., end:]
+        self.done += end
+        return mel[..., :end]
+
+
+class VocoderStream:
+    """
+    Vocodes a mel stream chunk by chunk. Every chunk is vocoded with `context_frames` frames of left
+    context. The last `crossfade_samples` of every output are held back and crossfaded with the same
+    samples of the next chunk, which hides the chunk boundaries.
+    """
+
+    def __init__(self, vocoder: Callable[[torch.Tensor], torch.Tensor], hop_length=256, context_frames=8,
+                 crossfade_samples=1024):
+        assert context_frames * hop_length >= crossfade_samples, "crossfade longer than the vocoder context"
+        self.vocoder = vocoder
+        self.hop_length = hop_length
+        self.context_frames = context_frames
+        self.crossfade_samples = crossfade_samples
+        self.history = None
+        self.tail = None
+
+    def push(self, mel, final=False):
+        """
+        Args:
+            mel: [1, C, n] new mel frames
+            final: end of the stream, also release the held back samples
+        Returns:
+            [1, samples] audio
+        """
+        if mel.size(-1) == 0:
+            if final and self.tail is not None:
+                wav, self.tail = self.tail, None
+                return wav
+            return mel.new_zeros(1, 0)
+        ctx = 0 if self.history is None else self.history.size(-1)
+        mel_in = mel if ctx == 0 else torch.cat([self.history, mel], dim=-1)
+        wav = self.vocoder(mel_in).reshape(1, -1)
+        tail_len = 0 if self.tail is None else self.tail.size(-1)
+        wav = wav[:, ctx * self.hop_length - tail_len:]
+        if tail_len:
+            n = min(tail_len, wav.size(-1))
+            fade_in = torch.linspace(0, 1, n + 2, device=wav.device, dtype=wav.dtype)[1:-1]
+            wav = wav.clone()
+            wav[:, :n] = self.tail[:, :n] * (1 - fade_in) + wav[:, :n] * fade_in
+        self.history = mel_in[..., -self.context_frames:]
+        if final:
+            self.tail = None
+            return wav
+        keep = min(self.crossfade_samples, wav.size(-1))
+        self.tail = wav[:, wav.size(-1) - keep:]
+        return wav[:, :wav.size(-1) - keep]
+
+
+class PCMBlocks:
+    """
+    Re-chunks a stream of [1, n] audio tensors into blocks of exactly `block_size` samples.
+    """
+
+    def __init__(self, block_size=4096):
+        self.block_size = block_size
+        self.buffer = None
+
+    def push(self, wav):
+        self.buffer = wav if self.buffer is None else torch.cat([self.buffer, wav], dim=-1)
+        blocks = []
+        while self.block_size and self.buffer.size(-1) >= self.block_size:
+            blocks.append(self.buffer[:, :self.block_size])
+            self.buffer = self.buffer[:, self.block_size:]
+        return blocks
+
+    def flush(self):
+        if self.buffer is None or self.buffer.size(-1) == 0:
+            return []
+        wav, self.buffer = self.buffer, None
+        return [wav]
@@ -0,0 +1,97 @@
+import json
+import os
+
+import torch
+
+PROFILE_FORMAT_VERSION = "1"
+PROFILE_EXT = ".safetensors"
+
+SPK_KEYS = ("spk_cond_emb", "style", "prompt_condition", "ref_mel")
+EMO_KEYS = ("emo_cond_emb",)
+
+
+class VoiceProfile:
+    """
+    Precomputed conditioning of a speaker prompt (and optionally its emotion prompt).
+
+    `speaker` holds spk_cond_emb, style, prompt_condition and ref_mel, `emotion` holds emo_cond_emb,
+    exactly as produced by `IndexTTS2.get_spk_conditioning` / `IndexTTS2.get_emo_conditioning`.
+    """
+
+    def __init__(self, speaker, emotion=None, metadata=None):
+        missing = [k for k in SPK_KEYS if k not in speaker]
+        if missing:
+            raise ValueError(f"voice profile is missing speaker tensors: {missing}")
+        if emotion is not None:
+            missing = [k for k in EMO_KEYS if k not in emotion]
+            if missing:
+                raise ValueError(f"voice profile is missing emotion tensors: {missing}")
+        self.speaker = speaker
+        self.emotion = emotion
+        self.metadata = metadata or {}
+
+    @property
+    def key(self):
+        """
+        Identity of the speaker conditioning used for caching, the content hash of the source audio when known.
+        """
+        return self.metadata.get("source_hash") or f"profile-{id(self)}"
+
+    @property
+    def emo_key(self):
+        """
+        Identity of the emotion conditioning used for caching, the content hash of the emotion source audio
+        when known. Profiles without it get a key of their own, never shared with a raw audio prompt.
+        """
+        return self.metadata.get("emo_source_hash") or f"profile-emo-{id(self)}"
+
+    def to(self, device):
+        speaker = {k: v.to(device) for k, v in self.speaker.items()}
+        emotion = None if self.emotion is None else {k: v.to(device) for k, v in self.emotion.items()}
+        return VoiceProfile(speaker, emotion, dict(self.metadata))
+
+    def save(self, path):
+        save_voice_profile(path, self.speaker, self.emotion, self.metadata)
+
+
+def is_voice_profile(prompt):
+    return isinstance(prompt, VoiceProfile) or (
+        isinstance(prompt, (str, os.PathLike)) and os.fspath(prompt).endswith(PROFILE_EXT))
+
+
+def save_voice_profile(path, speaker, emotion=None, metadata=None):
+    """
+    Serialize speaker/emotion conditioning tensors to a safetensors file.
+    """
+    from safetensors.torch import save_file
+
+    tensors = {f"speaker.{k}": speaker[k].detach().contiguous().cpu() for k in SPK_KEYS}
+    if emotion is not None:
+        tensors.update({f"emotion.{k}": emotion[k].detach().contiguous().cpu() for k in EMO_KEYS})
+    meta = {"format_version": PROFILE_FORMAT_VERSION}
+    for k, v in (metadata or {}).items():
+        meta[k] = v if isinstance(v, str) else json.dumps(v)
+    if os.path.dirname(path) != "":
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    save_file(tensors, path, metadata=meta)
+
+
+def load_voice_profile(path, device="cpu"):
+    """
+    Load a voice profile written by `save_voice_profile`. Tensors are memory-mapped when device is cpu.
+    """
+    from safetensors import safe_open
+
+    speaker, emotion = {}, {}
+    with safe_open(path, framework="pt", device=str(device)) as f:
+        metadata = dict(f.metadata() or {})
+        version = metadata.get("format_version")
+        if version != PROFILE_FORMAT_VERSION:
+            raise ValueError(f"unsupported voice profile format version {version!r} in {path}")
+        for name in f.keys():
+            group, _, key = name.partition(".")
+            if group == "speaker":
+                speaker[key] = f.get_tensor(name)
+            elif group == "emotion":
+                emotion[key] = f.get_tensor(name)
+    return VoiceProfile(speaker, emotion or None, metadata)
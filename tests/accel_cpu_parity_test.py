@@ -0,0 +1,116 @@
+import torch
+
+from indextts.gpt.model_v2 import UnifiedVoice
+
+
+def build_tiny_gpt(use_accel):
+    torch.manual_seed(0)
+    module = {
+        "output_size": 32,
+        "linear_units": 64,
+        "attention_heads": 2,
+        "num_blocks": 1,
+        "input_layer": "conv2d2",
+        "perceiver_mult": 2,
+    }
+    gpt = UnifiedVoice(
+        layers=2, model_dim=64, heads=4, max_text_tokens=64, max_mel_tokens=96,
+        number_text_tokens=100, number_mel_codes=8194, start_mel_token=8192, stop_mel_token=8193,
+        condition_type="conformer_perceiver", condition_module=module, emo_condition_module=module,
+        use_accel=use_accel,
+    )
+    gpt.eval()
+    gpt.post_init_gpt2_config(use_deepspeed=False, kv_cache=True, half=False)
+    # small paged cache so that sequences span several blocks
+    if gpt.accel_engine is not None:
+        from indextts.accel import AccelInferenceEngine
+        gpt.accel_engine = AccelInferenceEngine(
+            model=gpt.accel_engine.model,
+            lm_head=gpt.accel_engine.lm_head,
+            num_layers=gpt.layers,
+            num_heads=gpt.heads,
+            head_dim=gpt.model_dim // gpt.heads,
+            block_size=16,
+            num_blocks=64,
+            use_cuda_graph=False,
+        )
+    return gpt
+
+
+def generate(gpt, text_tokens, spk_cond, accel, max_generate_length, repetition_penalty=1.0):
+    engine = gpt.accel_engine
+    if not accel:
+        gpt.accel_engine = None
+    try:
+        codes, _, latent = gpt.inference_speech(
+            spk_cond, text_tokens, spk_cond, return_latent=True,
+            max_generate_length=max_generate_length,
+            do_sample=False, num_beams=1, repetition_penalty=repetition_penalty,
+        )
+    finally:
+        gpt.accel_engine = engine
+    return codes, latent
+
+
+def trim(codes, stop_token):
+    codes = codes.tolist()
+    return codes[:codes.index(stop_token)] if stop_token in codes else codes
+
+
+if __name__ == "__main__":
+    """
+    Greedy decoding parity of the accel engine (PyTorch attention backend, paged KV cache) against
+    `GPT2InferenceModel.generate`, on CPU with a tiny randomly initialized model.
+    ```
+    python tests/accel_cpu_parity_test.py
+    ```
+    """
+    gpt = build_tiny_gpt(use_accel=True)
+    assert gpt.accel_engine is not None, "accel engine was not created"
+    # the accel model aliases the GPT weights instead of copying them
+    gpt_ptrs = {p.data_ptr() for p in gpt.gpt.parameters()}
+    accel_params = [p for name, p in gpt.accel_engine.model.named_parameters() if not name.startswith("wte.")]
+    assert all(p.data_ptr() in gpt_ptrs for p in accel_params), "accel engine copied the GPT weights"
+    print(f">> accel engine shares {sum(p.numel() for p in accel_params)} GPT parameters")
+    stop = gpt.stop_mel_token
+    max_generate_length = 40
+    spk_cond = torch.randn(1, 1024, 50)
+    texts = [
+        torch.randint(2, 100, (1, 12), dtype=torch.int32),
+        torch.randint(2, 100, (1, 7), dtype=torch.int32),
+    ]
+    with torch.no_grad():
+        references = []
+        for i, text_tokens in enumerate(texts):
+            ref_codes, ref_latent = generate(gpt, text_tokens, spk_cond, False, max_generate_length)
+            codes, latent = generate(gpt, text_tokens, spk_cond, True, max_generate_length)
+            ref, out = trim(ref_codes[0], stop), trim(codes[0], stop)
+            assert ref == out, f"text {i}: accel codes differ\nhf:    {ref}\naccel: {out}"
+            steps = min(ref_latent.shape[1], latent.shape[1])
+            torch.testing.assert_close(latent[:, :steps], ref_latent[:, :steps], atol=1e-4, rtol=1e-4)
+            references.append(ref)
+            print(f">> text {i}: {len(ref)} codes match")
+
+        # same voice and text again: the conditioning/text prefix blocks come from the prefix cache
+        kv_manager = gpt.accel_engine.kv_manager
+        assert kv_manager.block_hash_to_id, "no prompt blocks were registered in the prefix cache"
+        codes, _ = generate(gpt, texts[0], spk_cond, True, max_generate_length)
+        assert trim(codes[0], stop) == references[0], "prefix cache hit changed the output"
+        print(">> prefix cache hit matches")
+
+        # varlen batch: left-padded prompts, every row must match its unbatched reference
+        batch = torch.nn.utils.rnn.pad_sequence([t[0] for t in texts], batch_first=True,
+                                                padding_value=gpt.stop_text_token)
+        codes, _ = generate(gpt, batch, spk_cond, True, max_generate_length)
+        for i, ref in enumerate(references):
+            out = trim(codes[i], stop)
+            assert out == ref, f"batch row {i}: accel codes differ\nref:   {ref}\naccel: {out}"
+        print(">> varlen batch matches")
+
+        # greedy decoding with the repetition penalty over the input ids and the generated codes
+        ref_codes, _ = generate(gpt, texts[0], spk_cond, False, max_generate_length, repetition_penalty=3.0)
+        codes, _ = generate(gpt, texts[0], spk_cond, True, max_generate_length, repetition_penalty=3.0)
+        ref, out = trim(ref_codes[0], stop), trim(codes[0], stop)
+        assert ref == out, f"repetition penalty: accel codes differ\nhf:    {ref}\naccel: {out}"
+        print(">> repetition penalty matches")
+        print(">> accel CPU parity test passed")
@@ -0,0 +1,78 @@
+import torch
+from transformers import (LogitsProcessorList, RepetitionPenaltyLogitsProcessor, TemperatureLogitsWarper,
+                          TopKLogitsWarper, TopPLogitsWarper)
+
+from indextts.accel.accel_engine import Sampler
+
+
+def hf_process(logits, seen_ids, temperature, top_k, top_p, repetition_penalty):
+    # the logits processors of HF `generate()` (do_sample=True), in the same order
+    processors = LogitsProcessorList()
+    if repetition_penalty != 1.0:
+        processors.append(RepetitionPenaltyLogitsProcessor(repetition_penalty))
+    if temperature != 1.0:
+        processors.append(TemperatureLogitsWarper(temperature))
+    if top_k > 0:
+        processors.append(TopKLogitsWarper(top_k))
+    if top_p < 1.0:
+        processors.append(TopPLogitsWarper(top_p))
+    return processors(seen_ids, logits.clone())
+
+
+if __name__ == "__main__":
+    """
+    Parity of the accel `Sampler` logits processing with the HF logits processors (repetition penalty,
+    temperature, top-k, top-p) for a batch with different parameters per row, and a check that the
+    sampled tokens follow the processed distribution.
+    ```
+    python tests/accel_sampler_parity_test.py [cuda]
+    ```
+    """
+    import sys
+    device = sys.argv[1] if len(sys.argv) > 1 else "cpu"
+    torch.manual_seed(0)
+    vocab = 8194
+    # (temperature, top_k, top_p, repetition_penalty), the IndexTTS2 defaults first
+    params = [
+        (0.8, 30, 0.8, 10.0),
+        (1.0, 50, 1.0, 1.0),
+        (0.5, 0, 0.95, 1.2),
+        (1.3, 5, 1.0, 2.0),
+        (1.0, 0, 0.3, 1.0),
+    ]
+    batch = len(params)
+    logits = torch.randn(batch, vocab, device=device) * 3
+    seen_ids = torch.randint(0, vocab, (batch, 40), device=device)
+    seen_mask = torch.zeros(batch, vocab, dtype=torch.bool, device=device).scatter_(1, seen_ids, True)
+    temperatures, top_k, top_p, penalties = (torch.tensor(p, device=device) for p in zip(*params))
+
+    out, greedy = Sampler.process_logits(logits, temperatures, top_k.long(), top_p, penalties, seen_mask)
+    assert not greedy.any()
+    for i, (t, k, p, r) in enumerate(params):
+        ref = hf_process(logits[i:i + 1], seen_ids[i:i + 1], t, k, p, r)[0]
+        kept = ref != float("-inf")
+        assert torch.equal(out[i] != float("-inf"), kept), f"row {i}: kept tokens differ"
+        torch.testing.assert_close(out[i].softmax(-1), ref.softmax(-1), atol=1e-6, rtol=1e-5)
+        print(f">> row {i} {params[i]}: {kept.sum().item()} tokens kept, distributions match")
+
+    # greedy rows: argmax after the repetition penalty, as HF with do_sample=False
+    zeros = torch.zeros_like(temperatures)
+    out, greedy = Sampler.process_logits(logits, zeros, top_k.long(), top_p, penalties, seen_mask)
+    assert greedy.all()
+    for i, (_, _, _, r) in enumerate(params):
+        ref = hf_process(logits[i:i + 1], seen_ids[i:i + 1], 1.0, 0, 1.0, r)[0]
+        assert out[i].argmax() == ref.argmax(), f"row {i}: greedy token differs"
+    print(">> greedy tokens match")
+
+    # sampled token frequencies follow the processed distribution
+    sampler = Sampler()
+    row = torch.tensor(params[3], device=device)
+    num_samples = 4000
+    tokens = sampler(*(x.expand(num_samples, *x.shape[1:]).contiguous() for x in (
+        logits[3:4], row[0:1], row[1:2].long(), row[2:3], row[3:4], seen_mask[3:4])))
+    expected = hf_process(logits[3:4], seen_ids[3:4], *params[3])[0].softmax(-1)
+    freq = torch.bincount(tokens, minlength=vocab).float() / num_samples
+    assert (freq[expected == 0] == 0).all(), "sampled a filtered token"
+    assert (freq - expected).abs().max() < 0.03, f"sample frequencies off by {(freq - expected).abs().max():.3f}"
+    print(">> sample frequencies match")
+    print(">> accel sampler parity test passed")
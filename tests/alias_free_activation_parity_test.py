@@ -0,0 +1,43 @@
+import torch
+
+from indextts.BigVGAN import activations as v1_activations
+from indextts.BigVGAN.alias_free_activation.torch.act import Activation1d as BigVGANActivation1d
+from indextts.BigVGAN.alias_free_torch import Activation1d as V1Activation1d
+from indextts.s2mel.modules.bigvgan import activations as s2mel_activations
+from indextts.s2mel.modules.bigvgan.alias_free_activation.torch.act import Activation1d as S2MelActivation1d
+
+IMPLEMENTATIONS = [
+    ("BigVGAN/alias_free_torch", V1Activation1d, v1_activations),
+    ("BigVGAN/alias_free_activation/torch", BigVGANActivation1d, v1_activations),
+    ("s2mel/bigvgan/alias_free_activation/torch", S2MelActivation1d, s2mel_activations),
+]
+
+
+if __name__ == "__main__":
+    """
+    Parity of the polyphase `Activation1d` (eval mode) against upsample -> act -> downsample (train mode)
+    for Snake and SnakeBeta with random parameters, in every copy of the alias-free activation.
+    ```
+    python tests/alias_free_activation_parity_test.py [cuda]
+    ```
+    """
+    import sys
+    device = sys.argv[1] if len(sys.argv) > 1 else "cpu"
+    torch.manual_seed(0)
+    C = 64
+    for name, Activation1d, activations in IMPLEMENTATIONS:
+        for act in (activations.Snake(C, alpha_logscale=True), activations.SnakeBeta(C, alpha_logscale=True)):
+            with torch.no_grad():
+                for p in act.parameters():
+                    p.normal_(0, 0.5)
+            module = Activation1d(activation=act).to(device)
+            assert module.polyphase
+            for T in (1, 2, 3, 7, 100, 1001):
+                x = torch.randn(2, C, T, device=device)
+                with torch.no_grad():
+                    ref = module.train()(x)
+                    out = module.eval()(x)
+                assert out.shape == ref.shape, f"{name}: shape {tuple(out.shape)} != {tuple(ref.shape)}"
+                torch.testing.assert_close(out, ref, atol=1e-5, rtol=1e-5)
+            print(f">> {name} {type(act).__name__}: polyphase matches")
+    print(">> alias-free activation parity test passed")
@@ -0,0 +1,48 @@
+import time
+
+import torch
+
+from indextts.s2mel.modules.bigvgan.bigvgan import BigVGAN, load_hparams_from_json
+
+
+def set_polyphase(model, enabled):
+    for module in model.modules():
+        if hasattr(module, "polyphase"):
+            module.polyphase = enabled
+
+
+if __name__ == "__main__":
+    """
+    CPU BigVGAN vocoding time with the polyphase anti-aliased activations against the reference
+    upsample -> act -> downsample path, on the IndexTTS2 vocoder architecture with random weights.
+    ```
+    python tests/bigvgan_cpu_benchmark.py [seconds_of_audio] [threads]
+    ```
+    """
+    import sys
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    if len(sys.argv) > 2:
+        torch.set_num_threads(int(sys.argv[2]))
+    torch.manual_seed(0)
+    h = load_hparams_from_json("indextts/s2mel/modules/bigvgan/config.json")
+    model = BigVGAN(h, use_cuda_kernel=False)
+    model.remove_weight_norm()
+    model.eval()
+    frames = int(seconds * h.sampling_rate / h.hop_size)
+    mel = torch.randn(1, h.num_mels, frames)
+
+    results = {}
+    with torch.inference_mode():
+        for polyphase in (False, True):
+            set_polyphase(model, polyphase)
+            model(mel[..., :32])  # warm up
+            elapsed = []
+            for _ in range(3):
+                start = time.perf_counter()
+                wav = model(mel)
+                elapsed.append(time.perf_counter() - start)
+            results[polyphase] = (min(elapsed), wav)
+    (ref_time, ref), (out_time, out) = results[False], results[True]
+    print(f">> {seconds:.1f}s of audio ({frames} frames), {torch.get_num_threads()} threads")
+    print(f">> reference: {ref_time:.3f}s, polyphase: {out_time:.3f}s, speedup {ref_time / out_time:.2f}x")
+    print(f">> max abs diff: {(out - ref).abs().max().item():.2e}")
@@ -0,0 +1,75 @@
+import time
+
+import torch
+
+from indextts.infer_v2 import IndexTTS2
+
+
+def _sync(device):
+    if str(device).startswith("cuda"):
+        torch.cuda.synchronize()
+
+
+CONFIGS = [
+    # (solver, schedule, diffusion_steps, cfg_truncate_steps)
+    ("euler", "uniform", 25, 0),  # 默认设置
+    ("euler", "uniform", 10, 0),
+    ("euler", "sway", 10, 0),
+    ("euler", "uniform", 25, 5),
+    ("midpoint", "uniform", 8, 0),
+    ("heun", "uniform", 8, 0),
+    ("heun", "sway", 6, 0),
+    ("ab2", "uniform", 12, 0),
+    ("ab3", "sway", 10, 0),
+    ("ab3", "cosine", 10, 2),
+]
+
+
+if __name__ == "__main__":
+    """
+    Quality vs. latency of the CFM solvers, schedules, step counts and CFG truncation.
+    The CFM inputs of one real request are captured once, then every configuration runs from the same noise
+    and is compared with a 100-step Euler reference (mel L1 on the generated frames).
+    ```
+    python tests/cfm_solver_benchmark.py checkpoints "Text to synthesize"
+    ```
+    """
+    import sys
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "checkpoints"
+    text = sys.argv[2] if len(sys.argv) > 2 else "快躲起来！是他要来了！他要来抓我们了！"
+    audio_prompt = "tests/sample_prompt.wav"
+    tts = IndexTTS2(cfg_path=f"{model_dir}/config.yaml", model_dir=model_dir, use_fp16=False, use_cuda_kernel=False)
+    cfm = tts.s2mel.models['cfm']
+
+    captured = []
+    inference = cfm.inference
+
+    def capture(mu, x_lens, prompt, style, f0, *args, **kwargs):
+        captured.append((mu.clone(), x_lens.clone(), prompt.clone(), style.clone()))
+        return inference(mu, x_lens, prompt, style, f0, *args, **kwargs)
+
+    cfm.inference = capture
+    tts.infer(audio_prompt, text, None, max_text_tokens_per_segment=1000)
+    cfm.inference = inference
+    mu, x_lens, prompt, style = captured[0]
+    prompt_len = prompt.size(-1)
+    z = torch.randn([mu.size(0), cfm.in_channels, mu.size(1)], device=mu.device,
+                    generator=torch.Generator(mu.device).manual_seed(0))
+
+    def run(solver, schedule, steps, truncate):
+        _sync(tts.device)
+        start = time.perf_counter()
+        mel = cfm.inference(mu.clone(), x_lens, prompt, style, None, steps, inference_cfg_rate=0.7, z=z.clone(),
+                            solver=solver, schedule=schedule, cfg_truncate_steps=truncate)
+        _sync(tts.device)
+        return mel[..., prompt_len:], time.perf_counter() - start
+
+    run("euler", "uniform", 2, 0)  # warm up
+    reference, reference_time = run("euler", "uniform", 100, 0)
+    print(f">> target frames: {reference.size(-1)}, reference (euler, 100 steps): {reference_time:.3f}s")
+    print(f"{'solver':>8} {'schedule':>8} {'steps':>5} {'cfg_trunc':>9} {'NFE':>4} {'time (s)':>9} {'mel L1':>8}")
+    for solver, schedule, steps, truncate in CONFIGS:
+        mel, elapsed = run(solver, schedule, steps, truncate)
+        nfe = steps * (2 if solver in ("midpoint", "heun") else 1)
+        l1 = (mel - reference).abs().mean().item()
+        print(f"{solver:>8} {schedule:>8} {steps:>5} {truncate:>9} {nfe:>4} {elapsed:>9.3f} {l1:>8.4f}")
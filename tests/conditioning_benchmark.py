@@ -0,0 +1,59 @@
+import time
+
+import torch
+
+from indextts.infer_v2 import IndexTTS2
+
+
+def _sync(device):
+    if str(device).startswith("cuda"):
+        torch.cuda.synchronize()
+
+
+if __name__ == "__main__":
+    """
+    Measure the per-segment cost of the GPT conditioning that `infer_generator` used to recompute
+    for every segment (`merge_emovec` + `get_conditioning` in `inference_speech`; the teacher-forced
+    forward reused the returned speech_conditioning_latent) against preparing it once per request.
+    ```
+    python tests/conditioning_benchmark.py checkpoints 40
+    ```
+    """
+    import sys
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "checkpoints"
+    segments = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    audio_prompt = "tests/sample_prompt.wav"
+    tts = IndexTTS2(cfg_path=f"{model_dir}/config.yaml", model_dir=model_dir, use_fp16=False, use_cuda_kernel=False)
+    gpt = tts.gpt
+    spk_cond_emb = tts.get_spk_conditioning(audio_prompt)["spk_cond_emb"]
+    emo_cond_emb = tts.get_emo_conditioning(audio_prompt)["emo_cond_emb"]
+    cond_lengths = torch.tensor([spk_cond_emb.shape[-1]], device=spk_cond_emb.device)
+    emo_cond_lengths = torch.tensor([emo_cond_emb.shape[-1]], device=spk_cond_emb.device)
+
+    def per_segment():
+        emovec = gpt.merge_emovec(spk_cond_emb, emo_cond_emb, cond_lengths, emo_cond_lengths)
+        # in inference_speech, the teacher-forced pass got its latent with do_spk_cond=False
+        gpt.prepare_conditioning(spk_cond_emb, cond_lengths, emo_vec=emovec)
+
+    def per_request():
+        emovec = gpt.merge_emovec(spk_cond_emb, emo_cond_emb, cond_lengths, emo_cond_lengths)
+        gpt.prepare_conditioning(spk_cond_emb, cond_lengths, emo_vec=emovec)
+
+    with torch.no_grad():
+        per_segment()  # warm up
+        _sync(tts.device)
+        start = time.perf_counter()
+        for _ in range(segments):
+            per_segment()
+        _sync(tts.device)
+        old_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        per_request()
+        _sync(tts.device)
+        new_time = time.perf_counter() - start
+
+    print(f">> segments: {segments}")
+    print(f">> conditioning per segment (old): {old_time:.3f} seconds total, {old_time / segments * 1000:.2f} ms/segment")
+    print(f">> conditioning once per request (new): {new_time:.3f} seconds total")
+    print(f">> saved: {old_time - new_time:.3f} seconds")
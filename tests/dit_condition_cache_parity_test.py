@@ -0,0 +1,62 @@
+import torch
+from omegaconf import OmegaConf
+
+from indextts.s2mel.modules.commons import MyModel
+
+
+if __name__ == "__main__":
+    """
+    Parity of the DiT estimator with the step-invariant conditioning precomputed (`DiT.prepare_condition`)
+    against the full input projection, per estimator call (conditional and CFG null branch) and for a whole
+    CFM solve. Uses the s2mel architecture of config.yaml with random weights.
+    ```
+    python tests/dit_condition_cache_parity_test.py [checkpoints/config.yaml] [cuda]
+    ```
+    """
+    import sys
+    cfg_path = sys.argv[1] if len(sys.argv) > 1 else "checkpoints/config.yaml"
+    device = sys.argv[2] if len(sys.argv) > 2 else "cpu"
+    torch.manual_seed(0)
+    cfg = OmegaConf.load(cfg_path)
+    cfm = MyModel(cfg.s2mel, use_gpt_latent=True).models['cfm'].to(device).eval()
+    dit = cfm.estimator
+    dit.setup_caches(max_batch_size=4, max_seq_length=1024)
+
+    B, T, prompt_len = 2, 300, 120
+    x = torch.randn(B, cfm.in_channels, T, device=device)
+    prompt_x = torch.zeros_like(x)
+    prompt_x[..., :prompt_len] = torch.randn(B, cfm.in_channels, prompt_len, device=device)
+    style = torch.randn(B, cfm.style_dim, device=device)
+    mu = torch.randn(B, T, cfm.content_dim, device=device)
+    x_lens = torch.tensor([T, T - 37], device=device)
+    t = torch.rand(B, device=device)
+
+    with torch.inference_mode():
+        stacked_cache = dit.prepare_condition(prompt_x, style, mu, null_branch=True)
+        cond_cache = dit.prepare_condition(prompt_x, style, mu)
+        # 条件分支
+        ref = dit(x, prompt_x, x_lens, t, style, mu)
+        out = dit(x, None, x_lens, t, None, None, cond_cache=cond_cache)
+        torch.testing.assert_close(out, ref, atol=1e-4, rtol=1e-4)
+        # 条件 + CFG null 分支
+        stacked_x = torch.cat([x, x], dim=0)
+        stacked_x_lens = torch.cat([x_lens, x_lens], dim=0)
+        stacked_t = torch.cat([t, t], dim=0)
+        ref = dit(stacked_x, torch.cat([prompt_x, torch.zeros_like(prompt_x)], dim=0), stacked_x_lens, stacked_t,
+                  torch.cat([style, torch.zeros_like(style)], dim=0), torch.cat([mu, torch.zeros_like(mu)], dim=0))
+        out = dit(stacked_x, None, stacked_x_lens, stacked_t, None, None, cond_cache=stacked_cache)
+        torch.testing.assert_close(out, ref, atol=1e-4, rtol=1e-4)
+        print(f">> estimator call matches, max abs diff {(out - ref).abs().max().item():.2e}")
+
+        prompt = prompt_x[..., :prompt_len]
+        for cfg_truncate_steps in (0, 3):
+            t_span = torch.linspace(0, 1, 11, device=device)
+            ref = cfm.solve(x.clone(), x_lens, prompt, mu.clone(), style, None, t_span, 0.7,
+                            cfg_truncate_steps=cfg_truncate_steps, cache_condition=False)
+            out = cfm.solve(x.clone(), x_lens, prompt, mu.clone(), style, None, t_span, 0.7,
+                            cfg_truncate_steps=cfg_truncate_steps, cache_condition=True)
+            valid = torch.arange(T, device=device)[None, None, :] < x_lens[:, None, None]
+            torch.testing.assert_close(out * valid, ref * valid, atol=1e-3, rtol=1e-3)
+            print(f">> 10-step solve (cfg_truncate_steps={cfg_truncate_steps}) matches, "
+                  f"max abs diff {((out - ref) * valid).abs().max().item():.2e}")
+    print(">> DiT condition cache parity test passed")
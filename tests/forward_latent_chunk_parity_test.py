@@ -0,0 +1,33 @@
+import torch
+
+from accel_cpu_parity_test import build_tiny_gpt
+
+
+if __name__ == "__main__":
+    """
+    Parity of the incremental teacher-forced latents of `infer_stream` (`UnifiedVoice.forward_latent_chunk`,
+    codes fed in chunks on top of the kept KV cache) with `forward_latent` on the whole segment,
+    on CPU with a tiny randomly initialized model.
+    ```
+    python tests/forward_latent_chunk_parity_test.py
+    ```
+    """
+    gpt = build_tiny_gpt(use_accel=False)
+    torch.manual_seed(0)
+    spk_cond = torch.randn(1, 1024, 50)
+    with torch.no_grad():
+        prepared = gpt.prepare_conditioning(spk_cond, torch.tensor([spk_cond.shape[-1]]))
+        for text_len, chunks in [(12, [20, 40, 41, 80]), (7, [1, 2, 30]), (20, [64])]:
+            text_tokens = torch.randint(2, 100, (1, text_len), dtype=torch.int32)
+            codes = torch.randint(0, 8192, (1, chunks[-1]))
+            reference = gpt.forward_latent(prepared, text_tokens, codes.clone(), torch.tensor([codes.size(1)]))
+            latents, state, done = [], None, 0
+            for c1 in chunks:
+                latent, state = gpt.forward_latent_chunk(prepared, text_tokens, codes[:, :c1], state)
+                assert latent.size(1) == c1 - done, f"{latent.size(1)} latents for codes [{done}, {c1})"
+                latents.append(latent)
+                done = c1
+            latent = torch.cat(latents, dim=1)
+            torch.testing.assert_close(latent, reference, atol=1e-5, rtol=1e-4)
+            print(f">> text {text_len} tokens, chunks {chunks}: latents match")
+    print(">> forward_latent_chunk parity test passed")
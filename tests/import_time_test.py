@@ -0,0 +1,52 @@
+import os
+import re
+import subprocess
+import sys
+
+# 导入 indextts.infer_v2 时不应加载的重型依赖, 它们在 IndexTTS2() 中才被导入
+HEAVY_MODULES = ("transformers", "modelscope", "librosa", "huggingface_hub", "safetensors",
+                 "indextts.gpt.transformers_modeling_utils", "indextts.gpt.transformers_generation_utils")
+
+
+def import_time(module):
+    """
+    Cumulative import time of `module` in a fresh interpreter, from `python -X importtime`, in seconds,
+    and the modules it loaded.
+    """
+    code = f"import sys, {module}; print('\\n'.join(sorted(sys.modules)))"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          capture_output=True, text=True, check=True)
+    cumulative = None
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        m = re.match(r"import time:\s*(\d+)\s*\|\s*(\d+)\s*\|\s*(\S+)\s*$", line)
+        if m and m.group(3) == module:
+            cumulative = int(m.group(2)) / 1e6
+    return cumulative, set(proc.stdout.split())
+
+
+if __name__ == "__main__":
+    """
+    Import-time budget of the IndexTTS2 entry point: importing `indextts.infer_v2` must stay under the
+    budget, must not pull in transformers/modelscope/librosa/huggingface_hub and must not set HF_HUB_CACHE.
+    ```
+    python tests/import_time_test.py [budget_seconds]
+    ```
+    """
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    # torch 本身的导入时间不计入
+    torch_time, _ = import_time("torch")
+    total, modules = import_time("indextts.infer_v2")
+    assert total is not None, "indextts.infer_v2 not found in -X importtime output"
+    print(f">> import torch: {torch_time:.2f}s, import indextts.infer_v2: {total:.2f}s")
+
+    loaded = [m for m in HEAVY_MODULES if m in modules]
+    assert not loaded, f"heavy modules imported by indextts.infer_v2: {loaded}"
+    # 导入模块不应修改环境变量, HF_HUB_CACHE 在 IndexTTS2() 中才设置默认值
+    env = subprocess.run([sys.executable, "-c", "import os, indextts.infer_v2; print(os.environ.get('HF_HUB_CACHE'))"],
+                         capture_output=True, text=True, check=True,
+                         env={k: v for k, v in os.environ.items() if k != "HF_HUB_CACHE"})
+    assert env.stdout.strip() == "None", f"importing indextts.infer_v2 set HF_HUB_CACHE={env.stdout.strip()}"
+    assert total - torch_time < budget, \
+        f"indextts.infer_v2 takes {total - torch_time:.2f}s on top of torch, budget {budget:.2f}s"
+    print(">> import time test passed")
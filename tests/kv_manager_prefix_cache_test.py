@@ -0,0 +1,43 @@
+import torch
+
+from indextts.accel.kv_manager import KVCacheManager, Seq, prefix_token_id
+
+
+if __name__ == "__main__":
+    """
+    Prefix cache of the accel `KVCacheManager`: a block that is reused for another sequence must not be
+    served for the hash it held before, even when the new content has the same token ids (same text,
+    different speaker prefix).
+    ```
+    python tests/kv_manager_prefix_cache_test.py
+    ```
+    """
+    block_size = 4
+    manager = KVCacheManager(num_layers=1, num_heads=1, head_dim=8, block_size=block_size, num_blocks=6,
+                             dtype=torch.float32, device="cpu")
+    text = [11, 12, 13, 14]
+    prefix_a = [prefix_token_id("speaker-a", i) for i in range(block_size)]
+    prefix_b = [prefix_token_id("speaker-b", i) for i in range(block_size)]
+
+    # speaker A: [prefix][text][tail] in blocks 0, 1, 2
+    seq_a = Seq(prefix_a + text + [15], block_size)
+    manager.allocate(seq_a)
+    assert seq_a.block_table == [0, 1, 2] and seq_a.num_cached_tokens == 0
+    manager.remove_seq(seq_a)
+
+    # speaker B ends with the same text, which lands in block 1, A's old text block
+    seq_b = Seq(prefix_b + [20, 21, 22, 23] + [24, 25, 26, 27] + [28, 29, 30, 31] + text, block_size)
+    manager.allocate(seq_b)
+    assert seq_b.block_table[-1] == 1 and manager.blocks[1].token_ids == text
+    assert len(manager.block_hash_to_id) <= manager.num_blocks
+    manager.remove_seq(seq_b)
+
+    # A again: its prefix block 0 is still valid, its text block was overwritten by B
+    seq_a = Seq(prefix_a + text + [15], block_size)
+    manager.allocate(seq_a)
+    assert seq_a.block_table[0] == 0
+    assert seq_a.num_cached_tokens == block_size, \
+        f"{seq_a.num_cached_tokens} cached tokens, the text block of speaker B was served to speaker A"
+    assert all(manager.blocks[block_id].block_hash == block_hash
+               for block_hash, block_id in manager.block_hash_to_id.items())
+    print(">> kv manager prefix cache test passed")
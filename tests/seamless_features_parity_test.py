@@ -0,0 +1,44 @@
+import numpy as np
+import torch
+from transformers import SeamlessM4TFeatureExtractor
+
+from indextts.utils.feature_extractors import SeamlessM4TFeatures
+
+
+if __name__ == "__main__":
+    """
+    Numerical parity of the torch `SeamlessM4TFeatures` against HuggingFace `SeamlessM4TFeatureExtractor`,
+    one utterance at a time and as a right-padded batch.
+    ```
+    python tests/seamless_features_parity_test.py [cuda]
+    ```
+    """
+    import sys
+    device = sys.argv[1] if len(sys.argv) > 1 else "cpu"
+    torch.manual_seed(0)
+    hf_extractor = SeamlessM4TFeatureExtractor()
+    extractor = SeamlessM4TFeatures().to(device)
+
+    # 不同长度, 覆盖奇数/偶数帧数
+    lengths = [16000 * 3, 16000 * 2 + 1234, 16000 + 160 * 7 + 55, 9000]
+    waveforms = [0.1 * torch.randn(n) * torch.linspace(0.2, 1.0, n) for n in lengths]
+
+    for i, wav in enumerate(waveforms):
+        ref = hf_extractor(wav.unsqueeze(0), sampling_rate=16000, return_tensors="pt")
+        feats, mask = extractor(wav.unsqueeze(0))
+        assert feats.shape == ref["input_features"].shape, f"{feats.shape} vs {ref['input_features'].shape}"
+        assert torch.equal(mask.cpu(), ref["attention_mask"].long()), f"utterance {i}: attention mask differs"
+        torch.testing.assert_close(feats.cpu(), ref["input_features"], atol=2e-3, rtol=1e-3)
+        print(f">> utterance {i}: {tuple(feats.shape)} matches, max abs diff "
+              f"{(feats.cpu() - ref['input_features']).abs().max().item():.2e}")
+
+    ref = hf_extractor([w.numpy() for w in waveforms], sampling_rate=16000, padding=True, return_tensors="pt")
+    batch = torch.nn.utils.rnn.pad_sequence(waveforms, batch_first=True)
+    feats, mask = extractor(batch, lengths=torch.tensor(lengths))
+    assert feats.shape == ref["input_features"].shape, f"{feats.shape} vs {ref['input_features'].shape}"
+    assert torch.equal(mask.cpu(), ref["attention_mask"].long()), "batch attention mask differs"
+    valid = mask.cpu().bool()
+    torch.testing.assert_close(feats.cpu()[valid], ref["input_features"][valid], atol=2e-3, rtol=1e-3)
+    assert np.allclose(feats.cpu()[~valid].numpy(), 0.0), "padding frames are not zero"
+    print(">> padded batch matches")
+    print(">> SeamlessM4T features parity test passed")
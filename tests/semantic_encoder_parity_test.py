@@ -0,0 +1,59 @@
+import copy
+
+import torch
+from transformers import Wav2Vec2BertConfig, Wav2Vec2BertModel
+
+from indextts.utils.maskgct_utils import SemanticEncoder
+
+
+def reference_emb(model, semantic_mean, semantic_std, input_features, attention_mask, output_layer):
+    # IndexTTS2.get_emb before SemanticEncoder
+    vq_emb = model(
+        input_features=input_features,
+        attention_mask=attention_mask,
+        output_hidden_states=True,
+    )
+    feat = vq_emb.hidden_states[output_layer]
+    return (feat - semantic_mean) / semantic_std
+
+
+if __name__ == "__main__":
+    """
+    Parity of the truncated `SemanticEncoder` against `hidden_states[17]` of the full w2v-BERT model.
+    Uses a small randomly initialized model by default, or the real facebook/w2v-bert-2.0 with `--pretrained`.
+    ```
+    python tests/semantic_encoder_parity_test.py [--pretrained]
+    ```
+    """
+    import sys
+    torch.manual_seed(0)
+    output_layer = 17
+    if "--pretrained" in sys.argv:
+        model = Wav2Vec2BertModel.from_pretrained("facebook/w2v-bert-2.0")
+    else:
+        config = Wav2Vec2BertConfig(
+            hidden_size=64, num_hidden_layers=24, num_attention_heads=4, intermediate_size=128,
+            output_hidden_size=64, conv_depthwise_kernel_size=7,
+        )
+        model = Wav2Vec2BertModel(config)
+    model.eval()
+    hidden_size = model.config.hidden_size
+    semantic_mean = torch.randn(hidden_size)
+    semantic_std = torch.rand(hidden_size) + 0.5
+
+    encoder = SemanticEncoder(copy.deepcopy(model), semantic_mean, semantic_std, output_layer=output_layer)
+    assert len(encoder.model.encoder.layers) == output_layer
+
+    feature_dim = model.config.feature_projection_input_dim
+    input_features = torch.randn(2, 120, feature_dim)
+    attention_mask = torch.ones(2, 120, dtype=torch.long)
+    attention_mask[1, 90:] = 0
+    with torch.no_grad():
+        ref = reference_emb(model, semantic_mean, semantic_std, input_features, attention_mask, output_layer)
+        out = encoder(input_features, attention_mask)
+    torch.testing.assert_close(out, ref, atol=1e-5, rtol=1e-5)
+
+    full_params = sum(p.numel() for p in model.parameters())
+    truncated_params = sum(p.numel() for p in encoder.parameters())
+    print(f">> parameters: {full_params} -> {truncated_params}")
+    print(">> semantic encoder parity test passed")
@@ -0,0 +1,142 @@
+import random
+import time
+import warnings
+from typing import List
+
+from indextts.utils.front import TextTokenizer
+
+
+def reference_split_segments_by_token(
+    tokenized_str: List[str],
+    split_tokens: List[str],
+    max_text_tokens_per_segment: int,
+    quick_streaming_tokens: int = 0
+) -> List[List[str]]:
+    """
+    The original recursive `TextTokenizer.split_segments_by_token`, kept as the reference.
+    """
+    # 处理特殊情况
+    if len(tokenized_str) == 0:
+        return []
+    segments: List[List[str]] = []
+    current_segment = []
+    current_segment_tokens_len = 0
+    for i in range(len(tokenized_str)):
+        token = tokenized_str[i]
+        current_segment.append(token)
+        current_segment_tokens_len += 1
+        if not  ("," in split_tokens or "▁," in split_tokens ) and ("," in current_segment or "▁," in current_segment): 
+            # 如果当前tokens中有,，则按,分割
+            sub_segments = reference_split_segments_by_token(
+                current_segment, [",", "▁,"], max_text_tokens_per_segment=max_text_tokens_per_segment, quick_streaming_tokens = quick_streaming_tokens
+            )
+        elif "-" not in split_tokens and "-" in current_segment:
+            # 没有,，则按-分割
+            sub_segments = reference_split_segments_by_token(
+                current_segment, ["-"], max_text_tokens_per_segment=max_text_tokens_per_segment, quick_streaming_tokens = quick_streaming_tokens
+            )
+        elif current_segment_tokens_len <= max_text_tokens_per_segment:
+            if token in split_tokens and current_segment_tokens_len > 2:
+                if i < len(tokenized_str) - 1:
+                    if tokenized_str[i + 1] in ["'", "▁'"]:
+                        # 后续token是'，则不切分
+                        current_segment.append(tokenized_str[i + 1])
+                        i += 1
+                segments.append(current_segment)
+                current_segment = []
+                current_segment_tokens_len = 0
+            continue
+        # 如果当前tokens的长度超过最大限制
+        else:
+            # 按照长度分割
+            sub_segments = []
+            for j in range(0, len(current_segment), max_text_tokens_per_segment):
+                if j + max_text_tokens_per_segment < len(current_segment):
+                    sub_segments.append(current_segment[j : j + max_text_tokens_per_segment])
+                else:
+                    sub_segments.append(current_segment[j:])
+            warnings.warn(
+                f"The tokens length of segment exceeds limit: {max_text_tokens_per_segment}, "
+                f"Tokens in segment: {current_segment}."
+                "Maybe unexpected behavior",
+                RuntimeWarning,
+            )
+        segments.extend(sub_segments)
+        current_segment = []
+        current_segment_tokens_len = 0
+    if current_segment_tokens_len > 0:
+        assert current_segment_tokens_len <= max_text_tokens_per_segment
+        segments.append(current_segment)
+    # 如果相邻的句子加起来长度小于最大限制，且此前token总数超过quick_streaming_tokens，则合并
+    merged_segments = []
+    total_token = 0
+    for segment in segments:
+        total_token += len(segment)
+        if len(segment) == 0:
+            continue
+        if len(merged_segments) == 0:
+            merged_segments.append(segment)
+        elif len(merged_segments[-1]) + len(segment) <= max_text_tokens_per_segment and total_token > quick_streaming_tokens:
+            merged_segments[-1] = merged_segments[-1] + segment
+        # 或小于最大长度限制的一半，则合并
+        elif len(merged_segments[-1]) + len(segment) <= max_text_tokens_per_segment / 2:
+            merged_segments[-1] = merged_segments[-1] + segment
+        else:
+            merged_segments.append(segment)
+    return merged_segments
+
+
+WORDS = ["▁the", "▁of", "▁and", "▁a", "▁to", "▁in", "▁he", "▁was", "▁that", "▁it", "▁his", "▁her",
+         "我", "们", "的", "是", "了", "在", "一", "个", "不", "人", "有", "这", "他", "上"]
+PUNCTUATION = [".", "▁.", "!", "?", "▁?", "▁...", ",", "▁,", "-", "'", "▁'"]
+
+
+def random_tokens(n, rng, punctuation_rate=0.08):
+    return [rng.choice(PUNCTUATION) if rng.random() < punctuation_rate else rng.choice(WORDS) for _ in range(n)]
+
+
+def chunks(tokens, size):
+    # token 迭代器: 模拟逐段 tokenize 的长文档
+    for i in range(0, len(tokens), size):
+        yield from tokens[i:i + size]
+
+
+if __name__ == "__main__":
+    """
+    Parity of the single-pass `TextTokenizer.iter_segments_by_token` with the original recursive segmenter
+    on random token sequences (sentence/comma/dash/quote tokens, over-long runs, quick streaming), and a
+    benchmark on a novel-length input.
+    ```
+    python tests/text_segmenter_parity_test.py [num_tokens]
+    ```
+    """
+    import sys
+    num_tokens = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    split_tokens = TextTokenizer.punctuation_marks_tokens
+    rng = random.Random(0)
+    warnings.simplefilter("ignore", RuntimeWarning)
+    cases = 0
+    for _ in range(3000):
+        n = rng.randint(0, 300)
+        tokens = random_tokens(n, rng, punctuation_rate=rng.choice([0.0, 0.02, 0.1, 0.3]))
+        max_len = rng.choice([3, 5, 10, 20, 50, 120])
+        quick = rng.choice([0, 0, 10, 50])
+        for splits in (split_tokens, split_tokens + [","], split_tokens + ["-"], ["-"], [","]):
+            ref = reference_split_segments_by_token(tokens, splits, max_len, quick_streaming_tokens=quick)
+            out = list(TextTokenizer.iter_segments_by_token(iter(tokens), splits, max_len, quick_streaming_tokens=quick))
+            assert out == ref, f"segments differ for {tokens} {splits} max={max_len} quick={quick}\nref: {ref}\nout: {out}"
+            cases += 1
+    print(f">> {cases} random cases match")
+
+    tokens = random_tokens(num_tokens, rng)
+    for max_len in (60, 120):
+        start = time.perf_counter()
+        ref = reference_split_segments_by_token(tokens, split_tokens, max_len)
+        ref_time = time.perf_counter() - start
+        start = time.perf_counter()
+        out = list(TextTokenizer.iter_segments_by_token(chunks(tokens, 1000), split_tokens, max_len))
+        out_time = time.perf_counter() - start
+        assert out == ref, "segments differ on the long input"
+        print(f">> {num_tokens} tokens, max {max_len}: recursive {ref_time:.3f}s, "
+              f"single pass {out_time:.3f}s ({ref_time / out_time:.1f}x), {len(out)} segments")
+    print(">> text segmenter parity test passed")
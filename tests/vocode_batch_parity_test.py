@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import torch
+from omegaconf import OmegaConf
+
+from indextts.BigVGAN.models import BigVGAN
+from indextts.infer import IndexTTS
+
+
+if __name__ == "__main__":
+    """
+    Parity of the batched BigVGAN vocoding of the v1 `IndexTTS.infer_fast` (`vocode_batch` on chunks of the
+    same length) with vocoding every chunk alone, in particular the last samples of every chunk, which are
+    the samples at the chunk joins. CPU, small randomly initialized v1 vocoder.
+    ```
+    python tests/vocode_batch_parity_test.py
+    ```
+    """
+    torch.manual_seed(0)
+    h = OmegaConf.create({
+        "gpt_dim": 32, "num_mels": 20, "speaker_embedding_dim": 32,
+        "upsample_initial_channel": 64, "upsample_rates": [4, 4], "upsample_kernel_sizes": [8, 8],
+        "resblock": "1", "resblock_kernel_sizes": [3], "resblock_dilation_sizes": [[1, 3, 5]],
+        "activation": "snakebeta", "snake_logscale": True,
+        "feat_upsample": False, "cond_d_vector_in_each_upsampling_layer": True,
+    })
+    model = BigVGAN(h, use_cuda_kernel=False)
+    model.remove_weight_norm()
+    model.eval()
+    tts = SimpleNamespace(bigvgan=model)
+    join_samples = 16 * 16  # 16 frames at the end of every chunk
+
+    with torch.no_grad():
+        speaker_embedding = model.get_speaker_embedding(torch.randn(1, 50, h.num_mels))
+        latents = [torch.randn(1, length, h.gpt_dim) for length in (40, 40, 57, 40, 57)]
+        references = [model(latent, speaker_embedding=speaker_embedding)[0].squeeze(1) for latent in latents]
+        for length in (40, 57):
+            idxs = [i for i, latent in enumerate(latents) if latent.shape[1] == length]
+            wavs = IndexTTS.vocode_batch(tts, [latents[i] for i in idxs], speaker_embedding)
+            for i, wav in zip(idxs, wavs):
+                ref = references[i]
+                assert wav.shape == ref.shape, f"chunk {i}: {tuple(wav.shape)} != {tuple(ref.shape)}"
+                torch.testing.assert_close(wav[..., -join_samples:], ref[..., -join_samples:], atol=1e-5, rtol=1e-4)
+                torch.testing.assert_close(wav, ref, atol=1e-5, rtol=1e-4)
+            print(f">> {len(idxs)} chunks of {length} frames: batched output matches, join samples included")
+
+        # chunks of different lengths must not be padded into one batch
+        try:
+            IndexTTS.vocode_batch(tts, [latents[0], latents[2]], speaker_embedding)
+        except AssertionError:
+            pass
+        else:
+            raise AssertionError("vocode_batch accepted chunks of different lengths")
+    print(">> vocode batch parity test passed")
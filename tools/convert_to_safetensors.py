@@ -0,0 +1,114 @@
+"""
+Convert an IndexTTS2 checkpoint directory into a safetensors bundle.
+
+Writes GPT, s2mel, the emotion/speaker matrices, the w2v-BERT statistics, CAMPPlus and BigVGAN
+(with weight norm already removed) as safetensors files plus a `bundle.json` manifest. When the
+manifest is present, `IndexTTS2` memory-maps these files instead of unpickling the `.pth` checkpoints,
+so loading skips the copy and CPU workers on one host share the weights through the page cache.
+```
+python tools/convert_to_safetensors.py --model_dir checkpoints [--dtype float16]
+```
+w2v-BERT and the semantic codec are already distributed as safetensors and are loaded as before.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+import torch
+from huggingface_hub import hf_hub_download
+from omegaconf import OmegaConf
+
+from indextts.s2mel.modules.bigvgan import bigvgan
+from indextts.utils.checkpoint import BUNDLE_MANIFEST, save_safetensors_shards
+
+DTYPES = {"float32": None, "float16": torch.float16, "bfloat16": torch.bfloat16}
+
+
+def s2mel_state_dict(s2mel_path):
+    # 与 load_checkpoint2 相同的键, 展平为 MyModel.models 的 state_dict 键: "{module}.{param}"
+    state = torch.load(s2mel_path, map_location="cpu")
+    state_dict = {}
+    for key, params in state["net"].items():
+        for k, v in params.items():
+            if k.startswith("module."):
+                k = k[7:]
+            state_dict[f"{key}.{k}"] = v
+    return state_dict
+
+
+def convert_checkpoint_dir(model_dir, out_dir=None, cfg_path=None, dtype=None, max_shard_size=2 << 30):
+    """
+    Args:
+        dtype: cast the model weights to float16/bfloat16, the matrices and statistics stay float32
+        max_shard_size: bytes per safetensors file
+    """
+    out_dir = out_dir or model_dir
+    os.makedirs(out_dir, exist_ok=True)
+    cfg = OmegaConf.load(cfg_path or os.path.join(model_dir, "config.yaml"))
+    components = {}
+
+    def save(name, state_dict, cast=True):
+        components[name] = save_safetensors_shards(
+            state_dict, out_dir, name, dtype=dtype if cast else None, max_shard_size=max_shard_size)
+        print(f">> {name}: {', '.join(components[name])}")
+
+    gpt_state = torch.load(os.path.join(model_dir, cfg.gpt_checkpoint), map_location="cpu")
+    save("gpt", gpt_state["model"] if "model" in gpt_state else gpt_state)
+    del gpt_state
+
+    save("s2mel", s2mel_state_dict(os.path.join(model_dir, cfg.s2mel_checkpoint)))
+
+    save("emo_matrix", {"matrix": torch.load(os.path.join(model_dir, cfg.emo_matrix), map_location="cpu")}, cast=False)
+    save("spk_matrix", {"matrix": torch.load(os.path.join(model_dir, cfg.spk_matrix), map_location="cpu")}, cast=False)
+    stat_mean_var = torch.load(os.path.join(model_dir, cfg.w2v_stat), map_location="cpu")
+    save("w2v_stat", {"mean": stat_mean_var["mean"], "var": stat_mean_var["var"]}, cast=False)
+
+    campplus_ckpt_path = hf_hub_download("funasr/campplus", filename="campplus_cn_common.bin")
+    save("campplus", torch.load(campplus_ckpt_path, map_location="cpu"))
+
+    vocoder = bigvgan.BigVGAN.from_pretrained(cfg.vocoder.name, use_cuda_kernel=False)
+    vocoder.remove_weight_norm()
+    save("bigvgan", vocoder.state_dict())
+    bigvgan_config = "bigvgan_config.json"
+    with open(os.path.join(out_dir, bigvgan_config), "w", encoding="utf-8") as fout:
+        json.dump(dict(vocoder.h), fout, indent=2)
+    del vocoder
+
+    if os.path.abspath(out_dir) != os.path.abspath(model_dir):
+        # bundle 目录也可以作为 model_dir 使用
+        for file_name in ("config.yaml", cfg.dataset["bpe_model"], "glossary.yaml"):
+            src = os.path.join(model_dir, file_name)
+            if os.path.exists(src):
+                shutil.copy(src, os.path.join(out_dir, file_name))
+
+    manifest = {
+        "version": 1,
+        "dtype": str(dtype).replace("torch.", "") if dtype is not None else None,
+        "components": components,
+        "files": {"bigvgan_config": bigvgan_config},
+        "vocoder": cfg.vocoder.name,
+    }
+    with open(os.path.join(out_dir, BUNDLE_MANIFEST), "w", encoding="utf-8") as fout:
+        json.dump(manifest, fout, indent=2)
+    print(">> bundle written to:", out_dir)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert IndexTTS2 checkpoints to a memory-mappable safetensors bundle",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--model_dir", type=str, default="checkpoints", help="Model checkpoints directory")
+    parser.add_argument("--out_dir", type=str, default=None, help="Output directory (default: model_dir)")
+    parser.add_argument("--config", type=str, default=None, help="config.yaml (default: model_dir/config.yaml)")
+    parser.add_argument("--dtype", type=str, default="float32", choices=list(DTYPES), help="Weight dtype of the models")
+    parser.add_argument("--max_shard_size", type=int, default=2048, help="Maximum size of a safetensors file in MB")
+    args = parser.parse_args()
+    convert_checkpoint_dir(args.model_dir, out_dir=args.out_dir, cfg_path=args.config,
+                           dtype=DTYPES[args.dtype], max_shard_size=args.max_shard_size << 20)
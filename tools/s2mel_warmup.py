@@ -0,0 +1,48 @@
+"""
+Pre-compile the s2mel (CFM/DiT) length buckets with torch.compile.
+
+Compiled kernels are stored in the inductor cache (TORCHINDUCTOR_CACHE_DIR), so later processes
+using `IndexTTS2(use_torch_compile=True)` with the same cache directory, bucket size and GPU load them
+instead of compiling again. Run it once after installing or upgrading:
+```
+python tools/s2mel_warmup.py --model_dir checkpoints --max_frames 4096
+```
+"""
+import argparse
+import os
+import sys
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+parser = argparse.ArgumentParser(
+    description="IndexTTS2 s2mel torch.compile warm-up",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+parser.add_argument("--model_dir", type=str, default="checkpoints", help="Model checkpoints directory")
+parser.add_argument("--device", type=str, default=None, help="Device to compile for, e.g. cuda:0")
+parser.add_argument("--bucket_size", type=int, default=128, help="Pad s2mel sequences to a multiple of this many frames")
+parser.add_argument("--max_frames", type=int, default=4096, help="Longest prompt + target mel length to compile")
+parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1], help="Batch sizes to compile (use the infer_fast bucket sizes)")
+parser.add_argument("--cache_dir", type=str, default=None, help="Inductor cache directory (TORCHINDUCTOR_CACHE_DIR)")
+cmd_args = parser.parse_args()
+
+if cmd_args.cache_dir:
+    # 必须在 import torch 之前设置
+    os.environ["TORCHINDUCTOR_CACHE_DIR"] = os.path.abspath(cmd_args.cache_dir)
+
+import torch
+
+from indextts.infer_v2 import IndexTTS2
+
+if __name__ == "__main__":
+    torch._inductor.config.fx_graph_cache = True
+    tts = IndexTTS2(
+        cfg_path=os.path.join(cmd_args.model_dir, "config.yaml"),
+        model_dir=cmd_args.model_dir,
+        device=cmd_args.device,
+        use_torch_compile=True,
+        s2mel_bucket_size=cmd_args.bucket_size,
+    )
+    tts.warmup_s2mel(max_frames=cmd_args.max_frames, batch_sizes=cmd_args.batch_sizes)
+    print(">> inductor cache:", os.environ.get("TORCHINDUCTOR_CACHE_DIR", "default (see torch._inductor.runtime.cache_dir_utils)"))